@@ -0,0 +1,175 @@
+"""
+Micro-benchmarks of the parsing and body-building hot paths of the ingest pipeline.
+For each sensor type and node count, synthetic snapshots are generated (see generators.py) and the following are
+measured: loadData, cleanData, requests_from_file (new nodes and already registered nodes), insertSensor or
+insertMobileSensor, insertObservation and insertObservationSP. Each benchmark reports the best and median time of
+several runs, the throughput, and the peak memory allocated during a separate run traced with tracemalloc.
+
+Results are written as JSON, so runs can be compared release to release:
+
+    python benchmarks/bench_ingest.py --types light bus --nodes 100 1000 --output results.json
+    python benchmarks/bench_ingest.py --nodes 1000 --baseline results.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time as time_
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from py4sos import santander, transactional, wrapper
+from benchmarks import generators
+
+
+def measure(func, setup=None, repeat=5):
+    """
+    Runs a function several times and measures it.
+    :param func: function to measure. It receives the value returned by 'setup', if any.
+    :param setup: function preparing the arguments of each run; it is not measured. Optional.
+    :param repeat: number of timed runs. Default 5
+    :return: dictionary with the best and median time in seconds, and the peak and retained traced memory in bytes
+    """
+    def run():
+        args = setup() if setup is not None else None
+        start = time_.perf_counter()
+        result = func(args) if setup is not None else func()
+        return time_.perf_counter() - start, result
+
+    run()  # warm up
+    times = [run()[0] for _ in range(repeat)]
+
+    args = setup() if setup is not None else None
+    tracemalloc.start()
+    result = func(args) if setup is not None else func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"seconds_min": min(times), "seconds_median": statistics.median(times), "peak_bytes": peak,
+            "retained_bytes": current}
+
+
+def _components(sensor_type, markers):
+    # offering, procedure, feature of interest and observation objects of each node and attribute, as in santander
+    type_sensor = wrapper.SensorType(sensor_type)
+    objects = []
+    for o in markers:
+        ide = o['id']
+        coord = (float(o['longitude']), float(o['latitude']), -9.99)
+        foi = wrapper.FoI('degree', 'm', coord, ide)
+        offering = wrapper.Offering('http://www.geosmartcity.nl/test/offering/', ide,
+                                    'offering for ' + ide + '_' + type_sensor.pattern['name'])
+        for name, om in type_sensor.pattern['attributes']:
+            procedure = wrapper.Procedure(ide, name, 'http://www.geosmartcity.nl/test/observableProperty/',
+                                          type_sensor.om_types[om])
+            observation = wrapper.Observation(ide + '_' + ''.join(name.split()) + '_1')
+            observation.values(type_sensor.om_types[om], 1.5, 'units', '2016-07-01T08:00:00+00:00',
+                               '2016-07-01T08:00:00+00:00')
+            objects.append((name, offering, procedure, foi, observation))
+    return type_sensor, objects
+
+
+def benchmarkType(sensor_type, nodes, directory, repeat=5):
+    """
+    Runs the benchmarks of a sensor type.
+    :param sensor_type: name of a SensorType, e.g. 'light'
+    :param nodes: number of nodes in the snapshot
+    :param directory: directory for the generated snapshots
+    :param repeat: number of timed runs of each benchmark. Default 5
+    :return: list of results
+    """
+    folder = os.path.join(directory, sensor_type + '-' + str(nodes)) + os.sep
+    first, second = generators.writeSnapshots(folder, sensor_type, nodes, files=2)
+    tag = wrapper.SensorType(sensor_type).pattern['name']
+    markers = santander.cleanData(santander.loadData(folder, first), tag)
+    type_sensor, objects = _components(sensor_type, markers)
+    by_node = {o[3].fid: o for o in objects}  # an attribute per node
+    registered = santander.requests_from_file(folder, first, sensor_type, folder, hist={})['history']
+
+    if type_sensor.pattern['type'] == 'mobile':
+        insertsensor, sensor_name = transactional.insertMobileSensor, 'insertMobileSensor'
+    else:
+        insertsensor, sensor_name = transactional.insertSensor, 'insertSensor'
+
+    benchmarks = [
+        ('loadData', nodes, lambda: santander.loadData(folder, first), None),
+        ('cleanData', nodes, lambda: santander.cleanData(santander.loadData(folder, first), tag), None),
+        ('requests_from_file[new]', nodes,
+         lambda hist: santander.requests_from_file(folder, first, sensor_type, folder, hist=hist), lambda: {}),
+        ('requests_from_file[registered]', nodes,
+         lambda hist: santander.requests_from_file(folder, second, sensor_type, folder, hist=hist),
+         lambda: {k: {"count": v["count"], "times": list(v["times"])} for k, v in registered.items()}),
+        (sensor_name, len(by_node),
+         lambda: [insertsensor(c[1], c[2], c[3], type_sensor) for c in by_node.values()], None),
+        ('insertObservation', len(objects),
+         lambda: [transactional.insertObservation(c[4], c[3], c[1], c[2], c[0]) for c in objects], None),
+        ('insertObservationSP', len(objects),
+         lambda: [transactional.insertObservationSP(c[4], c[3], c[1], c[2], c[0]) for c in objects], None),
+    ]
+
+    results = []
+    for name, items, func, setup in benchmarks:
+        result = {"benchmark": name, "sensor_type": sensor_type, "nodes": nodes, "items": items}
+        result.update(measure(func, setup, repeat))
+        result["items_per_second"] = items / result["seconds_min"] if result["seconds_min"] > 0 else None
+        results.append(result)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints the speed-up of each benchmark with respect to a previous run.
+    :param results: list of results
+    :param baseline: list of results of the previous run
+    :return: None
+    """
+    previous = {(r["benchmark"], r["sensor_type"], r["nodes"]): r for r in baseline}
+    print('%-32s %-16s %7s %10s %10s %8s' % ('benchmark', 'sensor type', 'nodes', 'baseline', 'now', 'speed-up'))
+    for r in results:
+        b = previous.get((r["benchmark"], r["sensor_type"], r["nodes"]))
+        if b is None:
+            continue
+        print('%-32s %-16s %7d %9.4fs %9.4fs %7.2fx' % (r["benchmark"], r["sensor_type"], r["nodes"],
+                                                        b["seconds_min"], r["seconds_min"],
+                                                        b["seconds_min"] / r["seconds_min"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the parsing and body-building hot paths.')
+    parser.add_argument('--types', nargs='+', default=generators.sensor_types, choices=generators.sensor_types,
+                        help='sensor types. Default all')
+    parser.add_argument('--nodes', nargs='+', type=int, default=[100, 1000], help='nodes per snapshot. Default 100 1000')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark. Default 5')
+    parser.add_argument('--output', help='JSON file for the results. Default: printed')
+    parser.add_argument('--baseline', help='JSON file of a previous run, to print the speed-up')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('py4sos').setLevel(logging.ERROR)  # no progress messages while measuring
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for sensor_type in args.types:
+            for nodes in args.nodes:
+                results += benchmarkType(sensor_type, nodes, directory, args.repeat)
+
+    report = {"time": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+              "implementation": platform.python_implementation(), "machine": platform.machine(),
+              "system": platform.system(), "repeat": args.repeat, "results": results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Synthetic SmartSantander snapshots for benchmarks.
+A snapshot is a JSON file like the ones published by SmartSantander: {"markers": [{"id": ..., "tags": ..., ...}]}, with
+a marker per node holding the attributes of its SensorType (see py4sos.wrapper.SensorType). Data is generated from a
+seed, so the same arguments always give the same files.
+"""
+
+import datetime
+import json
+import os
+import random
+
+from py4sos import wrapper
+
+# Sensor types with attributes; 'air' has none
+sensor_types = ['light', 'bus', 'env_station', 'irrigation', 'agriculture', 'noise', 'vehicle_counter',
+                'vehicle_speed', 'temp', 'outdoor', 'waste']
+
+# Units reported with the values of some attributes; the rest use 'units'
+_units = {"Luminosity": "lux", "Battery level": "%", "Temperature": "C", "Relative humidity": "%", "Noise": "dB",
+          "Speed": "Km/h", "Course": "degrees", "Odometer": "m", "CO": "mg/m3", "Occupancy": "%", " Count": ""}
+
+
+def snapshot(sensor_type, nodes, time='2016-07-01 08:00:00', seed=0, invalid=0.01, empty=0.01):
+    """
+    Generates the markers of a snapshot.
+    :param sensor_type: name of a SensorType, e.g. 'light'
+    :param nodes: number of nodes
+    :param time: time stamp of the observations, 'YYYY-MM-DD hh:mm:ss'
+    :param seed: seed of the random generator. Default 0
+    :param invalid: fraction of markers removed by cleanData (e.g., without coordinates). Default 0.01
+    :param empty: fraction of attribute values without a number. Default 0.01
+    :return: dictionary {"markers": [...]}
+    """
+    pattern = wrapper.SensorType(sensor_type).pattern
+    rnd = random.Random(str(sensor_type) + str(nodes) + str(seed) + time)
+    markers = []
+    for i in range(nodes):
+        marker = {"id": "bench_" + sensor_type + "_" + str(i), "tags": pattern["name"],
+                  "longitude": "%.5f" % (-3.85 + rnd.random() * 0.1), "latitude": "%.5f" % (43.43 + rnd.random() * 0.05),
+                  "Last update": time}
+        for name, om in pattern["attributes"]:
+            if om == "go":  # geometry observations take the location of the node
+                continue
+            if rnd.random() < empty:
+                marker[name] = "--"
+            elif om == "cto":
+                marker[name] = str(rnd.randint(0, 500))
+            else:
+                marker[name] = "%.2f %s" % (rnd.random() * 100, _units.get(name, "units"))
+        if rnd.random() < invalid:
+            marker["longitude"], marker["latitude"] = None, None
+        markers.append(marker)
+    return {"markers": markers}
+
+
+def writeSnapshots(directory, sensor_type, nodes, files=1, seed=0, step=datetime.timedelta(minutes=10)):
+    """
+    Writes consecutive snapshots to a directory, named like SmartSantander files (data_stream-<time>.json).
+    :param directory: path to the output directory. It is created if missing.
+    :param sensor_type: name of a SensorType, e.g. 'light'
+    :param nodes: number of nodes per snapshot
+    :param files: number of snapshots. Default 1
+    :param seed: seed of the random generator. Default 0
+    :param step: time between snapshots. Default 10 minutes
+    :return: list of file names, in time order
+    """
+    os.makedirs(directory, exist_ok=True)
+    start = datetime.datetime(2016, 7, 1, 8, 0, 7)
+    names = []
+    for k in range(files):
+        t = start + k * step
+        name = 'data_stream-' + t.strftime('%Y-%m-%dT%H%M%S') + '.json'
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump(snapshot(sensor_type, nodes, t.strftime('%Y-%m-%d %H:%M:%S'), seed), f)
+        names.append(name)
+    return names
@@ -0,0 +1,231 @@
+"""
+End-to-end load test of py4sos against an in-process SOS (see stubsos.py).
+Synthetic snapshots (see generators.py) are uploaded with upload2sos, or upload_directory2sos, and then read back with
+the readers of core (GetObservation by time, GetObservationById, GetDataAvailability and GetCapabilities). For each
+phase and operation the report gives the number of requests, the throughput, the latency percentiles measured by the
+client (through py4sos.metrics), and the errors by HTTP status, together with the counts of the stub server.
+
+    python benchmarks/load_test.py --type light --nodes 500 --files 10 --threads 4 --latency lognormal:0.01:0.5
+    python benchmarks/load_test.py --error-rate 0.02 --capacity 2 --replay --output report.json
+
+upload_directory2sos pauses for 20 seconds every 50 files; the default mode 'files' runs the same loop without pauses.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time as time_
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from py4sos import core, log, metrics, santander
+from benchmarks import generators, stubsos
+
+
+def percentile(values, q):
+    """
+    :param values: sorted list of numbers
+    :param q: percentile, between 0 and 100
+    :return: value at the percentile (nearest rank), or None when the list is empty
+    """
+    if len(values) == 0:
+        return None
+    rank = max(1, int(-(-q * len(values) // 100)))  # ceiling
+    return values[min(rank, len(values)) - 1]
+
+
+class Recorder:
+    """
+    Collects the duration and status of every request sent by py4sos, by phase and operation.
+    """
+
+    def __init__(self):
+        self.phase = None
+        self.latencies = {}  # (phase, operation): [seconds, ...]
+        self.statuses = {}  # (phase, operation): {status: count}
+
+    def __call__(self, kind, name, labels, value):
+        key = (self.phase, labels.get("operation"))
+        if name == 'py4sos_http_seconds':
+            self.latencies.setdefault(key, []).append(value)
+        elif name == 'py4sos_http_requests_total':
+            statuses = self.statuses.setdefault(key, {})
+            statuses[labels["status"]] = statuses.get(labels["status"], 0) + value
+
+    def report(self, phase, seconds):
+        """
+        :param phase: name of the phase
+        :param seconds: wall time of the phase
+        :return: list with the results of each operation of the phase
+        """
+        results = []
+        for (p, operation), values in sorted(self.latencies.items(), key=lambda i: str(i[0])):
+            if p != phase:
+                continue
+            values = sorted(values)
+            statuses = self.statuses.get((p, operation), {})
+            results.append({"phase": phase, "operation": operation, "requests": len(values),
+                            "requests_per_second": len(values) / seconds if seconds > 0 else None,
+                            "p50": percentile(values, 50), "p95": percentile(values, 95),
+                            "p99": percentile(values, 99), "max": values[-1],
+                            "errors": {s: n for s, n in statuses.items() if s != '200'}})
+        return results
+
+
+def ingest(sos, directory, sensor_type, history_path, threads, mode='files'):
+    """
+    Uploads all snapshots of a directory.
+    :param sos: santander.Sos instance
+    :param directory: directory of the snapshots
+    :param sensor_type: name of a SensorType, e.g. 'light'
+    :param history_path: directory for the history logs
+    :param threads: number of upload threads
+    :param mode: 'files' (requests_from_file and upload2sos for each file) or 'directory' (upload_directory2sos)
+    :return: None
+    """
+    if mode == 'directory':
+        santander.upload_directory2sos(sos, directory, sensor_type, history_path, threads)
+        return None
+    for name in sorted(os.listdir(directory)):
+        collection = santander.requests_from_file(directory, name, sensor_type, history_path)
+        santander.upload2sos(sos, collection, history_path, threads)
+    return None
+
+
+def read(sos, availability, ids, queries, threads, seed=0):
+    """
+    Sends a mix of read requests: GetObservation by time for a random series (60%), GetObservationById (20%),
+    GetDataAvailability for a random procedure (15%) and GetCapabilities (5%).
+    :param sos: santander.Sos instance
+    :param availability: list of the series in the SOS, as in the dataAvailability of a GetDataAvailability response
+    :param ids: list of observation identifiers in the SOS
+    :param queries: number of read requests
+    :param threads: number of requests sent concurrently
+    :param seed: seed of the random choice of queries. Default 0
+    :return: dictionary {exception type: count} of the failed requests
+    """
+    import concurrent.futures
+
+    rnd = random.Random(seed)
+
+    def query(k):
+        series = rnd.choice(availability)
+        choice = rnd.random()
+        if choice < 0.6:
+            return core.getObservationByTime(sos, series["procedure"], None, series["observedProperty"],
+                                             series["featureOfInterest"], series["phenomenonTime"])
+        if choice < 0.8:
+            return core.getObservationById(sos, rnd.sample(ids, min(10, len(ids))), retries=0)
+        if choice < 0.95:
+            return core.getDataAvailability(sos, procedure=series["procedure"])
+        return core.getCapabilites(sos, 'content')
+
+    failures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in concurrent.futures.as_completed([executor.submit(query, k) for k in range(queries)]):
+            try:
+                future.result()
+            except Exception as exc:
+                failures[type(exc).__name__] = failures.get(type(exc).__name__, 0) + 1
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of py4sos against an in-process SOS.')
+    parser.add_argument('--type', default='light', choices=generators.sensor_types, help="sensor type. Default 'light'")
+    parser.add_argument('--nodes', type=int, default=200, help='nodes per snapshot. Default 200')
+    parser.add_argument('--files', type=int, default=5, help='number of snapshots. Default 5')
+    parser.add_argument('--threads', type=int, default=4, help='upload and read threads. Default 4')
+    parser.add_argument('--mode', default='files', choices=['files', 'directory'],
+                        help="'files' uses upload2sos per file (default), 'directory' uses upload_directory2sos")
+    parser.add_argument('--reads', type=int, default=200, help='number of read requests. Default 200')
+    parser.add_argument('--latency', default='0', help="latency of each request: 'constant:S', 'uniform:LOW:HIGH' or "
+                                                       "'lognormal:MEDIAN:SIGMA', in seconds. Default 0")
+    parser.add_argument('--item-latency', default='0', help='latency of each sensor or observation inserted. Default 0')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing. Default 0')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP status of failing requests. Default 500')
+    parser.add_argument('--duplicates', default='reject', choices=['reject', 'silent'],
+                        help="how the server answers duplicates. Default 'reject'")
+    parser.add_argument('--capacity', type=int, help='maximum number of requests in progress. Default no limit')
+    parser.add_argument('--replay', action='store_true',
+                        help='upload the snapshots a second time with empty history logs, so all are duplicates')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generators. Default 0')
+    parser.add_argument('--verbose', action='store_true', help='print the messages of py4sos')
+    parser.add_argument('--output', help='JSON file for the report. Default: printed')
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        log.configure()
+    else:
+        logging.getLogger('py4sos').setLevel(logging.CRITICAL)  # injected errors are expected
+
+    recorder = Recorder()
+    collector = metrics.enable()
+    collector.add_callback(recorder)
+    stub = stubsos.StubSos(stubsos.parseLatency(args.latency), stubsos.parseLatency(args.item_latency),
+                           args.error_rate, args.error_status, args.duplicates, args.capacity, args.seed)
+    results, phases = [], []
+    with stub, tempfile.TemporaryDirectory() as directory:
+        data = os.path.join(directory, 'data') + os.sep
+        generators.writeSnapshots(data, args.type, args.nodes, args.files, args.seed)
+        sos = santander.Sos(stub.url)
+
+        plan = [('ingest', lambda: ingest(sos, data, args.type, _history(directory, 'history'), args.threads,
+                                          args.mode))]
+        if args.replay:
+            plan.append(('replay', lambda: ingest(sos, data, args.type, _history(directory, 'replay'), args.threads,
+                                                  args.mode)))
+        plan.append(('read', lambda: read(sos, stub.dispatch({"request": "GetDataAvailability"})["dataAvailability"],
+                                          list(stub.observations), args.reads, args.threads, args.seed)))
+
+        for phase, run in plan:
+            recorder.phase = phase
+            before = stub.stats()
+            start = time_.perf_counter()
+            outcome = run()
+            seconds = time_.perf_counter() - start
+            after = stub.stats()
+            summary = {"phase": phase, "seconds": seconds,
+                       "observations_stored": after["observations"] - before["observations"],
+                       "server_exceptions": _difference(after["exceptions"], before["exceptions"]),
+                       "server_refused": after["refused"] - before["refused"],
+                       "server_injected_errors": after["injected_errors"] - before["injected_errors"]}
+            if phase == 'read':
+                summary["client_failures"] = outcome
+            else:
+                summary["observations_per_second"] = summary["observations_stored"] / seconds if seconds > 0 else None
+            phases.append(summary)
+            results += recorder.report(phase, seconds)
+        server = stub.stats()
+    metrics.disable()
+
+    report = {"time": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+              "machine": platform.machine(), "system": platform.system(), "arguments": vars(args),
+              "phases": phases, "operations": results, "server": server}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+
+def _history(directory, name):
+    # empty directory for history logs; py4sos expects a trailing separator
+    path = os.path.join(directory, name) + os.sep
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _difference(after, before):
+    # differences between two dictionaries of counts
+    return {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0) != 0}
+
+
+if __name__ == '__main__':
+    main()
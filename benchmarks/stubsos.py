@@ -0,0 +1,492 @@
+"""
+In-process SOS for load tests.
+StubSos answers the JSON binding of a 52North SOS from memory: Batch, InsertSensor, InsertObservation, GetObservation,
+GetObservationById, GetCapabilities (Contents section) and GetDataAvailability. The ingest pipeline and the readers of
+py4sos can then be exercised end to end without hitting a real server. The behaviour of the server is configurable:
+
+    latency       time taken by each HTTP request (constant, uniform or log-normal; per operation if needed)
+    error_rate    fraction of HTTP requests answered with an error (HTTP 500 by default)
+    duplicates    'reject': sensors and observations already stored are refused with an exception, like 52North.
+                  'silent': they are acknowledged but not stored again.
+    capacity      maximum number of requests in progress; requests above it are refused with HTTP 503
+
+    with StubSos(latency=lognormal(0.02, 0.5), error_rate=0.01, capacity=8) as stub:
+        sos = santander.Sos(stub.url)
+        ...
+        print(stub.stats())
+"""
+
+import datetime
+import http.server
+import json
+import random
+import re
+import threading
+import time as time_
+
+from py4sos import core
+
+_unique_id = [re.compile(r'codeSpace="uniqueID">([^<]+)<'),
+              re.compile(r'name="uniqueID">.*?<sml:value>([^<]+)</sml:value>', re.S)]
+_offering_id = re.compile(r'offeringID".*?<swe:value>([^<]+)</swe:value>', re.S)
+
+
+def constant(seconds):
+    """
+    :param seconds: latency, in seconds
+    :return: latency distribution always returning 'seconds'
+    """
+    return lambda rnd: seconds
+
+
+def uniform(low, high):
+    """
+    :param low: shortest latency, in seconds
+    :param high: longest latency, in seconds
+    :return: latency distribution uniform between 'low' and 'high'
+    """
+    return lambda rnd: rnd.uniform(low, high)
+
+
+def lognormal(median, sigma=0.5):
+    """
+    Log-normal latencies have a long tail, like those of a loaded database server.
+    :param median: median latency, in seconds
+    :param sigma: standard deviation of the logarithm of the latency. Default 0.5
+    :return: latency distribution
+    """
+    import math
+
+    mu = math.log(median)
+    return lambda rnd: rnd.lognormvariate(mu, sigma)
+
+
+def parseLatency(text):
+    """
+    Parses a latency distribution given on the command line: 'constant:S', 'uniform:LOW:HIGH' or 'lognormal:MEDIAN:SIGMA'
+    (seconds). A plain number is a constant latency.
+    :param text: description of the distribution
+    :return: latency distribution
+    """
+    parts = text.split(':')
+    try:
+        if len(parts) == 1:
+            return constant(float(parts[0]))
+        params = [float(p) for p in parts[1:]]
+        return {"constant": constant, "uniform": uniform, "lognormal": lognormal}[parts[0]](*params)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid latency: ' + text + ". Use 'constant:S', 'uniform:LOW:HIGH' or "
+                                                      "'lognormal:MEDIAN:SIGMA'")
+
+
+class SosError(Exception):
+    """
+    Exception reported by the SOS, as an OWS exception report.
+    """
+
+    def __init__(self, code, locator, text, status=400):
+        super().__init__(text)
+        self.code = code
+        self.locator = locator
+        self.text = text
+        self.status = status
+
+    def report(self):
+        return {"version": "2.0.0", "exceptions": [{"code": self.code, "locator": self.locator, "text": self.text}]}
+
+
+class StubSos:
+
+    def __init__(self, latency=None, item_latency=None, error_rate=0.0, error_status=500, duplicates='reject',
+                 capacity=None, seed=0, host='127.0.0.1', port=0):
+        """
+        :param latency: time taken by each HTTP request: None (no latency), a number of seconds, a distribution (see
+         constant, uniform and lognormal), or a dictionary {operation: distribution} with an optional 'default' key.
+        :param item_latency: time taken by each sensor or observation inserted, e.g. constant(0.001). It makes the
+         duration of a Batch grow with its size. Optional.
+        :param error_rate: fraction of the HTTP requests answered with 'error_status'. Default 0
+        :param error_status: HTTP status of the injected errors. Default 500
+        :param duplicates: 'reject' (default) or 'silent'. See the module documentation.
+        :param capacity: maximum number of requests in progress. Default None (no limit)
+        :param seed: seed of the random generator for latencies and errors. Default 0
+        :param host: address the server listens on. Default 127.0.0.1
+        :param port: port the server listens on. Default 0 (any free port)
+        """
+        if duplicates not in ('reject', 'silent'):
+            raise ValueError("Unknown duplicates mode: " + str(duplicates) + ". Use 'reject' or 'silent'")
+        if not isinstance(latency, dict):
+            latency = {"default": latency}
+        self.latency = {k: constant(v) if isinstance(v, (int, float)) else v for k, v in latency.items()}
+        self.item_latency = item_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.duplicates = duplicates
+        self.capacity = capacity
+        self.rnd = random.Random(seed)
+        self.address = (host, port)
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(capacity) if capacity is not None else None
+        self.reset()
+
+    def reset(self):
+        """
+        Removes all sensors, observations and statistics.
+        :return: None
+        """
+        with self.lock:
+            self.sensors = {}  # procedure: {"offering", "properties", "observations", "start", "end", "area"}
+            self.observations = {}  # observation id: observation
+            self.keys = set()  # (procedure, property, feature, phenomenon time) of the stored observations
+            self.series = {}  # (procedure, property, feature): [start, end, count]
+            self.counts = {"requests": {}, "statuses": {}, "exceptions": {}, "injected_errors": 0, "refused": 0,
+                           "duplicates": 0}
+        return None
+
+    # Server life cycle
+
+    @property
+    def url(self):
+        # URL of the service endpoint
+        host, port = self.server.server_address[:2]
+        return 'http://' + host + ':' + str(port) + '/service'
+
+    def start(self):
+        """
+        Starts the server in a background thread.
+        :return: URL of the service endpoint
+        """
+        self.server = http.server.ThreadingHTTPServer(self.address, _handler(self))
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='StubSos', daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        """
+        Stops the server.
+        :return: None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+        return None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def stats(self):
+        """
+        :return: dictionary with the number of requests by operation and HTTP status, exceptions by code, injected
+         errors, requests refused for lack of capacity, duplicates, and the number of sensors and observations stored
+        """
+        with self.lock:
+            result = json.loads(json.dumps(self.counts))
+            result["sensors"] = len(self.sensors)
+            result["observations"] = len(self.observations)
+        return result
+
+    # Requests
+
+    def handle(self, body):
+        """
+        Answers an HTTP request, applying the configured capacity, latency and errors.
+        :param body: body of the request formatted as JSON
+        :return: HTTP status, and response formatted as JSON
+        """
+        operation = body.get("request") if isinstance(body, dict) else None
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            status, response = 503, SosError('NoApplicableCode', None, 'The service is busy', 503).report()
+            with self.lock:
+                self.counts["refused"] += 1
+        else:
+            try:
+                self._sleep(self.latency.get(operation, self.latency.get("default")))
+                if self.error_rate > 0 and self.rnd.random() < self.error_rate:
+                    status = self.error_status
+                    response = SosError('NoApplicableCode', None, 'Injected error', status).report()
+                    with self.lock:
+                        self.counts["injected_errors"] += 1
+                else:
+                    try:
+                        status, response = 200, self.dispatch(body)
+                    except SosError as exc:
+                        status, response = exc.status, exc.report()
+                        self._count("exceptions", exc.code)
+            finally:
+                if self.slots is not None:
+                    self.slots.release()
+        self._count("requests", str(operation))
+        self._count("statuses", str(status))
+        return status, response
+
+    def dispatch(self, body):
+        """
+        Runs an operation, without latency nor injected errors.
+        :param body: body of the request formatted as JSON
+        :return: response formatted as JSON. SosError is raised for invalid requests.
+        """
+        if not isinstance(body, dict) or "request" not in body:
+            raise SosError('MissingParameterValue', 'request', 'The request does not name an operation')
+        operation = {"Batch": self.batch, "InsertSensor": self.insertSensor,
+                     "InsertObservation": self.insertObservation, "GetObservation": self.getObservation,
+                     "GetObservationById": self.getObservationById, "GetCapabilities": self.getCapabilities,
+                     "GetDataAvailability": self.getDataAvailability}.get(body["request"])
+        if operation is None:
+            raise SosError('OperationNotSupported', 'request', 'The operation is not supported: ' +
+                           str(body["request"]))
+        return operation(body)
+
+    def batch(self, body):
+        # runs each request; failed requests are answered with an exception report in their place
+        responses = []
+        for request in body.get("requests", []):
+            try:
+                responses.append(self.dispatch(request))
+            except SosError as exc:
+                self._count("exceptions", exc.code)
+                if body.get("stopAtFailure") is True:
+                    raise
+                responses.append(exc.report())
+        return {"request": "Batch", "version": "2.0.0", "service": "SOS", "responses": responses}
+
+    def insertSensor(self, body):
+        description = body.get("procedureDescription", "")
+        procedure = None
+        for pattern in _unique_id:
+            match = pattern.search(description)
+            if match is not None:
+                procedure = match.group(1)
+                break
+        offering = _offering_id.search(description)
+        if procedure is None or offering is None:
+            raise SosError('InvalidParameterValue', 'procedureDescription',
+                           'The procedure description has no unique ID or offering')
+        offering = offering.group(1)
+        self._sleep(self.item_latency)
+        with self.lock:
+            if procedure in self.sensors:
+                self.counts["duplicates"] += 1
+                if self.duplicates == 'reject':
+                    raise SosError('InvalidParameterValue', 'offeringIdentifier',
+                                   "The offering with the identifier '" + offering + "' still exists in this service "
+                                   "and it is not allowed to insert more than one procedure to an offering!")
+            else:
+                self.sensors[procedure] = {"offering": offering, "properties": list(body.get("observableProperty", [])),
+                                           "observations": [], "start": None, "end": None, "area": None}
+        return {"request": "InsertSensor", "version": "2.0.0", "service": "SOS", "assignedProcedure": procedure,
+                "assignedOffering": offering}
+
+    def insertObservation(self, body):
+        observations = body.get("observation")
+        if not isinstance(observations, list):
+            observations = [observations]
+        offering = body.get("offering")
+        offering = offering[0] if isinstance(offering, list) else offering
+        for o in observations:
+            if not isinstance(o, dict) or "procedure" not in o or "phenomenonTime" not in o:
+                raise SosError('InvalidParameterValue', 'observation', 'The observation is not valid')
+            self._sleep(self.item_latency)
+            ide = core.observationId(o)
+            prop = core.identifierOf(o.get("observedProperty"))
+            foi = core.identifierOf(o.get("featureOfInterest"))
+            key = (o["procedure"], prop, foi, str(o["phenomenonTime"]))
+            with self.lock:
+                sensor = self.sensors.get(o["procedure"])
+                if sensor is None or sensor["offering"] != offering:
+                    raise SosError('InvalidParameterValue', 'offering',
+                                   'The requested offering (' + str(offering) + ') is not supported by this server!')
+                if ide in self.observations or key in self.keys:
+                    self.counts["duplicates"] += 1
+                    if self.duplicates == 'reject':
+                        raise SosError('NoApplicableCode', None,
+                                       'Observation with same values already contained in database')
+                    continue
+                self._store(sensor, ide, prop, foi, key, o, offering)
+        return {"request": "InsertObservation", "version": "2.0.0", "service": "SOS"}
+
+    def _store(self, sensor, ide, prop, foi, key, observation, offering):
+        # adds an observation to the indexes; the lock is held
+        time = core.observationTime(observation)
+        stored = {"identifier": observation.get("identifier"), "type": observation.get("type"),
+                  "procedure": observation["procedure"], "offering": offering, "observableProperty": prop,
+                  "featureOfInterest": observation.get("featureOfInterest"),
+                  "phenomenonTime": observation["phenomenonTime"], "resultTime": observation.get("resultTime"),
+                  "result": observation.get("result")}
+        self.observations[ide] = stored
+        self.keys.add(key)
+        sensor["observations"].append((time, stored))
+        sensor["start"] = time if sensor["start"] is None else min(sensor["start"], time)
+        sensor["end"] = time if sensor["end"] is None else max(sensor["end"], time)
+        point = _point(stored)
+        if point is not None:
+            area = sensor["area"]
+            sensor["area"] = (point + point) if area is None else (min(area[0], point[0]), min(area[1], point[1]),
+                                                                   max(area[2], point[0]), max(area[3], point[1]))
+        series = self.series.get(key[:3])
+        if series is None:
+            self.series[key[:3]] = [time, time, 1]
+        else:
+            series[0], series[1], series[2] = min(series[0], time), max(series[1], time), series[2] + 1
+
+    def getObservation(self, body):
+        procedures = _filter(body.get("procedure"))
+        offerings = _filter(body.get("offering"))
+        properties = _filter(body.get("observedProperty"))
+        features = _filter(body.get("featureOfInterest"))
+        during = None
+        if "temporalFilter" in body:
+            value = body["temporalFilter"].get("during", {}).get("value")
+            if not isinstance(value, list) or len(value) != 2:
+                raise SosError('InvalidParameterValue', 'temporalFilter', 'Only the during filter is supported')
+            during = (core.parseTime(value[0]), core.parseTime(value[1]))
+        box = None
+        if "spatialFilter" in body:
+            coordinates = body["spatialFilter"].get("bbox", {}).get("value", {}).get("coordinates")
+            try:
+                ring = coordinates[0]
+                box = (min(c[0] for c in ring), min(c[1] for c in ring), max(c[0] for c in ring),
+                       max(c[1] for c in ring))
+            except (IndexError, KeyError, TypeError, ValueError):
+                raise SosError('InvalidParameterValue', 'spatialFilter', 'Only bbox filters with a polygon are '
+                                                                        'supported')
+        with self.lock:
+            sensors = [(p, s) for p, s in self.sensors.items() if procedures is None or p in procedures]
+            result = []
+            for procedure, sensor in sensors:
+                if offerings is not None and sensor["offering"] not in offerings:
+                    continue
+                for time, o in sensor["observations"]:
+                    if during is not None and not during[0] <= time <= during[1]:
+                        continue
+                    if properties is not None and o["observableProperty"] not in properties:
+                        continue
+                    if features is not None and core.identifierOf(o["featureOfInterest"]) not in features:
+                        continue
+                    if box is not None:
+                        point = _point(o)
+                        if point is None or not (box[0] <= point[0] <= box[2] and box[1] <= point[1] <= box[3]):
+                            continue
+                    result.append(o)
+        return {"request": "GetObservation", "version": "2.0.0", "service": "SOS", "observations": result}
+
+    def getObservationById(self, body):
+        ids = body.get("observation", [])
+        ids = ids if isinstance(ids, list) else [ids]
+        with self.lock:
+            result = [self.observations[i] for i in ids if i in self.observations]
+        return {"request": "GetObservationById", "version": "2.0.0", "service": "SOS", "observations": result}
+
+    def getCapabilities(self, body):
+        sections = body.get("sections")
+        response = {"request": "GetCapabilities", "version": "2.0.0", "service": "SOS"}
+        if sections is None or "ServiceIdentification" in sections:
+            response["serviceIdentification"] = {"title": "StubSos", "serviceType": "OGC:SOS", "versions": ["2.0.0"]}
+        if sections is None or "Contents" in sections:
+            contents = []
+            with self.lock:
+                for procedure, sensor in self.sensors.items():
+                    offering = {"identifier": sensor["offering"], "procedure": [procedure],
+                                "observableProperty": list(sensor["properties"])}
+                    if sensor["start"] is not None:
+                        offering["phenomenonTime"] = [_iso(sensor["start"]), _iso(sensor["end"])]
+                    if sensor["area"] is not None:
+                        offering["observedArea"] = {"lowerLeft": list(sensor["area"][:2]),
+                                                    "upperRight": list(sensor["area"][2:])}
+                    contents.append(offering)
+            response["contents"] = contents
+        return response
+
+    def getDataAvailability(self, body):
+        procedures = _filter(body.get("procedure"))
+        properties = _filter(body.get("observedProperty"))
+        features = _filter(body.get("featureOfInterest"))
+        # like 52North, counts are only reported when asked for with the ShowCount extension
+        count = any(isinstance(e, dict) and e.get("definition") == "ShowCount" and e.get("value") is True
+                    for e in body.get("extensions", []))
+        with self.lock:
+            result = [{"procedure": k[0], "observedProperty": k[1], "featureOfInterest": k[2],
+                       "phenomenonTime": [_iso(v[0]), _iso(v[1])]}
+                      for k, v in self.series.items()
+                      if (procedures is None or k[0] in procedures) and (properties is None or k[1] in properties)
+                      and (features is None or k[2] in features)]
+            if count:
+                for r in result:
+                    r["count"] = self.series[(r["procedure"], r["observedProperty"], r["featureOfInterest"])][2]
+        return {"request": "GetDataAvailability", "version": "2.0.0", "service": "SOS", "dataAvailability": result}
+
+    def _sleep(self, distribution):
+        # waits for a latency drawn from a distribution, if any
+        if distribution is not None:
+            seconds = distribution(self.rnd)
+            if seconds > 0:
+                time_.sleep(seconds)
+
+    def _count(self, group, key):
+        with self.lock:
+            counts = self.counts[group]
+            counts[key] = counts.get(key, 0) + 1
+
+
+def _handler(stub):
+    # request handler class bound to a StubSos
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections open for the pools of requests.Session
+        disable_nagle_algorithm = True  # headers and body are written separately
+
+        def do_GET(self):
+            self._reply(200, {"service": "SOS", "version": "2.0.0"})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                status, response = 400, SosError('InvalidRequest', None, 'The body is not valid JSON').report()
+            else:
+                status, response = stub.handle(body)
+            self._reply(status, response)
+
+        def _reply(self, status, response):
+            content = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _filter(value):
+    # set of identifiers of a filter, or None when the filter is left out
+    if value is None:
+        return None
+    return set(value) if isinstance(value, list) else {value}
+
+
+def _point(observation):
+    # (latitude, longitude) of the feature of interest of an observation, or None
+    feature = observation.get("featureOfInterest")
+    if isinstance(feature, dict):
+        coordinates = feature.get("geometry", {}).get("coordinates")
+        if isinstance(coordinates, list) and len(coordinates) >= 2:
+            return float(coordinates[0]), float(coordinates[1])
+    return None
+
+
+def _iso(time):
+    # time stamp in ISO format, as reported by the SOS
+    return time.astimezone(datetime.timezone.utc).isoformat()
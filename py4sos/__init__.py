@@ -1,3 +1,21 @@
-from . import core
-from . import transactional
-from . import santander
+"""
+Python API to the 52North SOS implementation.
+Submodules are imported on first access (e.g., 'py4sos.core'), so building request bodies does not pay
+for importing the HTTP stack.
+"""
+
+import importlib
+
+__all__ = ['core', 'transactional', 'santander', 'wrapper', 'ratelimit', 'breaker', 'sharding', 'streaming', 'columnar', 'planner', 'cache', 'catalog', 'sync', 'replica', 'export', 'metrics', 'profiling', 'log', 'archive', 'workers']
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module  # next access does not go through __getattr__
+        return module
+    raise AttributeError("module 'py4sos' has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
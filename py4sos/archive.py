@@ -0,0 +1,187 @@
+"""
+Reading of snapshot archives.
+SmartSantander snapshots are archived as plain JSON files, compressed files (.json.gz, .json.zst) and tar bundles
+(.tar, .tar.gz, .tgz, .tar.zst) holding a JSON file per snapshot. Snapshots are read where they are, without
+extracting them to disk first:
+
+    plain files         read in a single call
+    .gz, .zst files     decompressed in memory
+    .tar bundles        members are copied from a memory mapping of the bundle, using an index of their offsets, so
+                        only the pages of the member are read
+    compressed bundles  members are read while the bundle is decompressed as a stream. Listing the members
+                        (listSnapshots) decompresses the whole bundle; reading them in the order of listSnapshots
+                        decompresses it once more. Each process reading a bundle (e.g., each worker) does the same.
+
+A member of a bundle is named '<bundle>/<member>', e.g. 'santander-2016-07-01.tar.gz/data_stream-2016-07-01T080007.json'.
+Reading .zst files requires the 'zstandard' package.
+"""
+
+import gzip
+import mmap
+import os
+import tarfile
+import threading
+
+bundle_suffixes = ('.tar', '.tar.gz', '.tgz', '.tar.zst')
+file_suffixes = ('.json', '.json.gz', '.json.zst')
+
+
+def listSnapshots(directory):
+    """
+    Lists the snapshots in a directory: JSON files, compressed JSON files, and the JSON members of tar bundles. Files and
+    bundles are sorted by name; the members of a bundle keep their order in the bundle. Other files are left out.
+    :param directory: path to the directory, ending with a separator
+    :return: list of snapshot names
+    """
+    names = []
+    for entry in sorted(os.listdir(directory)):
+        if entry.endswith(bundle_suffixes):
+            names.extend(entry + '/' + m for m in members(directory + entry))
+        elif entry.endswith(file_suffixes):
+            names.append(entry)
+    return names
+
+
+def members(path):
+    """
+    :param path: path to a tar bundle
+    :return: names of the JSON files in the bundle, in their order in the bundle
+    """
+    if path.endswith('.tar'):
+        return list(_index(path))
+    names = []
+    tar = _openStream(path)
+    try:
+        for info in tar:
+            if info.isfile() and info.name.endswith('.json'):
+                names.append(info.name)
+    finally:
+        _closeStream(tar)
+    return names
+
+
+def readSnapshot(directory, name):
+    """
+    Reads the content of a snapshot, decompressed.
+    :param directory: path to the directory, ending with a separator
+    :param name: name of the snapshot, as returned by listSnapshots
+    :return: content of the snapshot, as bytes
+    """
+    bundle, member = splitName(name)
+    if bundle is None:
+        return _readFile(directory + name)
+    if bundle.endswith('.tar'):
+        offset, size = _index(directory + bundle)[member]
+        with open(directory + bundle, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[offset:offset + size]
+    return _streams.read(directory + bundle, member)
+
+
+def splitName(name):
+    """
+    :param name: name of a snapshot
+    :return: bundle and member names for a member of a bundle, or (None, name) otherwise
+    """
+    for suffix in bundle_suffixes:
+        i = name.find(suffix + '/')
+        if i > 0:
+            return name[:i + len(suffix)], name[i + len(suffix) + 1:]
+    return None, name
+
+
+def _readFile(path):
+    # content of a plain or compressed file
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    if path.endswith('.zst'):
+        with open(path, 'rb') as f, _zstd().ZstdDecompressor().stream_reader(f) as reader:
+            return reader.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading .zst files requires the 'zstandard' package: pip install zstandard")
+    return zstandard
+
+
+_indexes = {}  # path of a .tar bundle: (modification time, size, {member: (offset, size)})
+_indexes_lock = threading.Lock()
+
+
+def _index(path):
+    # offsets of the JSON members of an uncompressed bundle; rebuilt when the bundle changes
+    stat = os.stat(path)
+    with _indexes_lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+    index = {}
+    with tarfile.open(path, 'r:') as tar:
+        for info in tar:
+            if info.isfile() and info.name.endswith('.json'):
+                index[info.name] = (info.offset_data, info.size)
+    with _indexes_lock:
+        _indexes[path] = (stat.st_mtime, stat.st_size, index)
+    return index
+
+
+def _openStream(path):
+    # compressed bundle opened as a stream, read forward only. Close it with _closeStream.
+    if path.endswith('.tar.zst'):
+        raw = open(path, 'rb')
+        try:
+            tar = tarfile.open(fileobj=_zstd().ZstdDecompressor().stream_reader(raw), mode='r|')
+        except Exception:
+            raw.close()
+            raise
+        tar.raw = raw  # file under the decompressor
+        return tar
+    return tarfile.open(path, 'r|*')
+
+
+def _closeStream(tar):
+    tar.close()
+    raw = getattr(tar, 'raw', None)
+    if raw is not None:
+        raw.close()
+
+
+class _Streams:
+    """
+    Compressed bundle being read. Members ahead of the last member read are reached by skipping forward; reading a
+    member behind it opens the bundle again.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.tar = None
+        self.lock = threading.Lock()
+
+    def read(self, path, member):
+        with self.lock:
+            for reopen in (self.path != path, True):
+                if reopen:
+                    self.close()
+                    self.tar, self.path = _openStream(path), path
+                info = self.tar.next()
+                while info is not None:
+                    if info.name == member and info.isfile():
+                        return self.tar.extractfile(info).read()
+                    info = self.tar.next()
+                if reopen:
+                    break
+            self.close()
+            raise KeyError('No member ' + repr(member) + ' in ' + path)
+
+    def close(self):
+        if self.tar is not None:
+            _closeStream(self.tar)
+            self.tar, self.path = None, None
+
+
+_streams = _Streams()
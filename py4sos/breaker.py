@@ -0,0 +1,135 @@
+"""
+Circuit breaker for requests sent to a SOS.
+The breaker watches the outcome of the latest requests. When the rate of errors becomes too high, the circuit opens
+and requests fail fast (or are spooled by the caller) without reaching the server.
+After a timeout, the server is probed with a cheap request. When the probe succeeds, the circuit closes and traffic resumes.
+Only server side failures (connection errors, timeouts, HTTP 5xx) count as errors. HTTP 4xx responses are
+regarded as problems of the request itself, not of the server.
+"""
+
+import collections
+import threading
+import time as time_
+
+
+class CircuitOpenError(Exception):
+    # Raised when a request is refused because the circuit is open
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with three states: 'closed' (requests go through), 'open' (requests are refused)
+    and 'half-open' (a single trial request is allowed to test the server).
+    """
+
+    def __init__(self, error_rate=0.5, window=20, min_calls=10, reset_timeout=30, probe=None):
+        """
+        :param error_rate: fraction of failed requests, within the window, that opens the circuit. Default 0.5
+        :param window: number of latest requests used to compute the error rate. Default 20
+        :param min_calls: minimum number of requests in the window before the circuit can open. Default 10
+        :param reset_timeout: seconds to wait while open before probing the server again. Default 30
+        :param probe: callable without arguments, which sends a cheap request to the server and raises on failure.
+         When None, a single regular request is let through as a trial.
+        """
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.outcomes = collections.deque(maxlen=window)  # True for success
+        self.state = 'closed'
+        self.opened_at = None
+        self.trial = False  # a probe or trial request is in progress
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Tells if a request can be sent. While open, the server is probed once the reset timeout has elapsed.
+        :return: True when the request can be sent
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.trial or time_.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial = True  # this thread tests the server
+            if self.probe is None:
+                self.state = 'half-open'
+                return True
+
+        try:
+            self.probe()
+        except Exception:
+            with self.lock:
+                self.opened_at = time_.monotonic()  # stay open for another period
+                self.trial = False
+            return False
+        self.close()
+        return True
+
+    def record(self, success):
+        """
+        Records the outcome of a request and updates the state of the circuit.
+        :param success: True when the request did not fail because of the server
+        :return: None
+        """
+        with self.lock:
+            if self.state == 'half-open':
+                self.trial = False
+                if success:
+                    self.state = 'closed'
+                    self.outcomes.clear()
+                else:
+                    self.state = 'open'
+                    self.opened_at = time_.monotonic()
+                return None
+
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if (self.state == 'closed' and len(self.outcomes) >= self.min_calls and
+                    failures / len(self.outcomes) >= self.error_rate):
+                self.state = 'open'
+                self.opened_at = time_.monotonic()
+        return None
+
+    def close(self):
+        """
+        Closes the circuit and forgets previous outcomes.
+        :return: None
+        """
+        with self.lock:
+            self.state = 'closed'
+            self.trial = False
+            self.outcomes.clear()
+        return None
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls 'func' through the breaker.
+        :param func: function sending a request to the server
+        :return: whatever 'func' returns
+        """
+        if not self.allow():
+            raise CircuitOpenError('Circuit is open, requests to the SOS are suspended')
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            self.record(not isServerError(exc))
+            raise
+        self.record(True)
+        return result
+
+
+def isServerError(exc):
+    """
+    Tells if an exception raised while sending a request is caused by the server or the network.
+    :param exc: exception instance
+    :return: True for connection errors, timeouts and HTTP 5xx. False for HTTP 4xx, and for any other exception (e.g.,
+     errors of the caller, or of the response body).
+    """
+    import requests
+
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return isinstance(exc, requests.HTTPError) and status is not None and status >= 500
@@ -0,0 +1,179 @@
+"""
+Response cache for read requests to a SOS (e.g., GetCapabilities, GetDataAvailability).
+Responses are kept in memory (least recently used are dropped first) and, optionally, in a directory on disk.
+Entries are keyed by the URL of the SOS and the normalized body of the request, so a directory can be shared by the
+caches of several SOS instances, and expire after a time-to-live set per operation.
+Expired entries with an ETag or Last-Modified header are revalidated with a conditional request; when the server
+answers '304 Not Modified' the cached response is used again without downloading it.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import threading
+import time as time_
+
+# Time-to-live in seconds per operation. Operations not listed are not cached.
+default_ttl = {"GetCapabilities": 3600, "GetDataAvailability": 300}
+
+
+class ResponseCache:
+
+    def __init__(self, maxsize=128, ttl=None, directory=None, url=''):
+        """
+        :param maxsize: maximum number of responses kept in memory. Default 128
+        :param ttl: dictionary {operation: seconds}. Default is 'default_ttl'
+        :param directory: path to a directory for an on-disk tier. Default None (memory only)
+        :param url: URL of the SOS whose responses are cached. It is part of the key of every entry.
+        """
+        self.maxsize = maxsize
+        self.url = url
+        self.ttl = dict(default_ttl if ttl is None else ttl)
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0}
+
+    def cacheable(self, body):
+        """
+        :param body: body of a request formatted as JSON
+        :return: True when responses to this request are cached
+        """
+        return body.get("request") in self.ttl
+
+    def key(self, body):
+        """
+        :param body: body of a request formatted as JSON
+        :return: key of the request to this SOS. Requests with the same content have the same key, whatever the order
+         of their elements.
+        """
+        normalized = json.dumps([self.url, body], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def lookup(self, body):
+        """
+        Finds the cached response of a request.
+        :param body: body of a request formatted as JSON
+        :return: (entry, fresh). 'entry' is None on a miss. 'fresh' is False when the entry has to be revalidated.
+        """
+        k = self.key(body)
+        with self.lock:
+            entry = self.entries.get(k)
+            if entry is not None:
+                self.entries.move_to_end(k)
+        if entry is None and self.directory is not None:
+            entry = self._load(k)
+            if entry is not None:
+                self._remember(k, entry)
+        with self.lock:
+            if entry is None:
+                self.counters["misses"] += 1
+                return None, False
+            fresh = entry["expires"] > time_.time()
+            if fresh:
+                self.counters["hits"] += 1
+            elif entry["etag"] is None and entry["last_modified"] is None:  # can not be revalidated
+                self.counters["misses"] += 1
+                return None, False
+        return entry, fresh
+
+    def store(self, body, payload, etag=None, last_modified=None):
+        """
+        Stores the response to a request.
+        :param body: body of a request formatted as JSON
+        :param payload: response formatted as JSON
+        :param etag: value of the ETag header of the response, if any
+        :param last_modified: value of the Last-Modified header of the response, if any
+        :return: None
+        """
+        operation = body.get("request")
+        entry = {"operation": operation, "payload": payload, "etag": etag, "last_modified": last_modified,
+                 "expires": time_.time() + self.ttl.get(operation, 0)}
+        self._put(body, entry)
+        with self.lock:
+            self.counters["stored"] += 1
+        return None
+
+    def refresh(self, body, entry):
+        """
+        Extends the life of an entry after the server confirmed it is still valid (HTTP 304).
+        :param body: body of a request formatted as JSON
+        :param entry: entry returned by lookup()
+        :return: None
+        """
+        entry = dict(entry, expires=time_.time() + self.ttl.get(entry["operation"], 0))
+        self._put(body, entry)
+        with self.lock:
+            self.counters["revalidated"] += 1
+        return None
+
+    def conditional_headers(self, entry):
+        """
+        :param entry: entry returned by lookup()
+        :return: headers for a conditional request
+        """
+        headers = {}
+        if entry["etag"] is not None:
+            headers['If-None-Match'] = entry["etag"]
+        if entry["last_modified"] is not None:
+            headers['If-Modified-Since'] = entry["last_modified"]
+        return headers
+
+    def invalidate(self, operation=None):
+        """
+        Removes cached responses, in memory and on disk.
+        :param operation: only responses to this operation (e.g., 'GetCapabilities'). Default None (all responses)
+        :return: None
+        """
+        with self.lock:
+            for k in [k for k, e in self.entries.items() if operation is None or e["operation"] == operation]:
+                del self.entries[k]
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.directory, name)
+                if operation is not None:
+                    entry = self._load(name[:-5])
+                    if entry is None or entry["operation"] != operation:
+                        continue
+                os.remove(path)
+        return None
+
+    def stats(self):
+        """
+        :return: dictionary with the number of hits, misses, revalidations, stored responses, and entries in memory
+        """
+        with self.lock:
+            result = dict(self.counters)
+            result["entries"] = len(self.entries)
+        return result
+
+    def _put(self, body, entry):
+        # stores an entry in memory and on disk
+        k = self.key(body)
+        self._remember(k, entry)
+        if self.directory is not None:
+            tmp = os.path.join(self.directory, k + '.' + str(threading.get_ident()) + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp, os.path.join(self.directory, k + '.json'))
+
+    def _remember(self, k, entry):
+        # adds an entry to memory, dropping the least recently used
+        with self.lock:
+            self.entries[k] = entry
+            self.entries.move_to_end(k)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def _load(self, k):
+        # reads an entry from disk
+        try:
+            with open(os.path.join(self.directory, k + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
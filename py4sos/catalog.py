@@ -0,0 +1,228 @@
+"""
+In-memory catalog of the contents of a SOS, built once from the Contents section of its capabilities.
+It answers questions such as 'is this sensor registered?' or 'which offerings observe this property?' without
+sending requests to the SOS. Offerings are indexed by procedure, observed property and feature of interest (hash
+indexes), by phenomenon time, and by observed area (grid index).
+"""
+
+import bisect
+from . import core
+
+
+class GridIndex:
+    """
+    Spatial index of bounding boxes (or points) on a regular grid. Coordinates are (x, y), e.g. (longitude, latitude).
+    Boxes covering more than 'max_cells' cells (e.g., the area of a mobile sensor, or a world-wide extent) are kept in
+    a list which is scanned by every query, instead of in the grid. Queries covering more cells than there are
+    elements in the index scan all the elements.
+    """
+
+    def __init__(self, cell_size=0.01, max_cells=1024):
+        """
+        :param cell_size: size of the grid cells, in units of the coordinates. Default 0.01 (about 1 km in degrees)
+        :param max_cells: maximum number of cells covered by a box stored in the grid. Default 1024
+        """
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+        self.cells = {}  # (column, row): set of keys
+        self.boxes = {}  # key: (min_x, min_y, max_x, max_y)
+        self.large = set()  # keys of the boxes too large for the grid
+
+    def _span(self, bbox):
+        # first and last column and row of the cells covered by a box, and their number
+        c0, r0 = int(bbox[0] // self.cell_size), int(bbox[1] // self.cell_size)
+        c1, r1 = int(bbox[2] // self.cell_size), int(bbox[3] // self.cell_size)
+        return c0, r0, c1, r1, max(0, c1 - c0 + 1) * max(0, r1 - r0 + 1)
+
+    def _cells(self, bbox):
+        c0, r0, c1, r1, n = self._span(bbox)
+        for c in range(c0, c1 + 1):
+            for r in range(r0, r1 + 1):
+                yield c, r
+
+    def _candidates(self, bbox):
+        # keys of the elements which may intersect a box
+        if self._span(bbox)[4] > len(self.boxes):  # fewer elements than cells to visit
+            yield from self.boxes
+            return
+        yield from self.large
+        for cell in self._cells(bbox):
+            yield from self.cells.get(cell, ())
+
+    def insert(self, key, bbox):
+        """
+        :param key: identifier of the element
+        :param bbox: (min_x, min_y, max_x, max_y), or (x, y) for a point
+        :return: None
+        """
+        if len(bbox) == 2:
+            bbox = (bbox[0], bbox[1], bbox[0], bbox[1])
+        self.boxes[key] = tuple(bbox)
+        if self._span(bbox)[4] > self.max_cells:
+            self.large.add(key)
+            return None
+        for cell in self._cells(bbox):
+            self.cells.setdefault(cell, set()).add(key)
+        return None
+
+    def query(self, bbox):
+        """
+        :param bbox: (min_x, min_y, max_x, max_y)
+        :return: set of keys whose bounding box intersects 'bbox'
+        """
+        found = set()
+        for key in self._candidates(bbox):
+            b = self.boxes[key]
+            if b[0] <= bbox[2] and b[2] >= bbox[0] and b[1] <= bbox[3] and b[3] >= bbox[1]:
+                found.add(key)
+        return found
+
+    def any_within(self, bbox):
+        """
+        :param bbox: (min_x, min_y, max_x, max_y)
+        :return: True when at least one element intersects 'bbox'
+        """
+        for key in self._candidates(bbox):
+            b = self.boxes[key]
+            if b[0] <= bbox[2] and b[2] >= bbox[0] and b[1] <= bbox[3] and b[3] >= bbox[1]:
+                return True
+        return False
+
+
+class Catalog:
+    """
+    Indexes of the offerings of a SOS.
+    """
+
+    def __init__(self, cell_size=0.01):
+        """
+        :param cell_size: size of the cells of the spatial index, in degrees. Default 0.01
+        """
+        self.offerings = {}  # offering identifier: record from the capabilities
+        self.by_procedure = {}  # procedure: set of offerings
+        self.by_property = {}  # observable property: set of offerings
+        self.by_foi = {}  # feature of interest: set of offerings
+        self.times = []  # list of (start, end, offering), sorted by start
+        self.starts = []  # start of each element in 'times'
+        self.area = GridIndex(cell_size)
+
+    @classmethod
+    def fromCapabilities(cls, capabilities, cell_size=0.01):
+        """
+        Builds a catalog from a GetCapabilities response, which must include the Contents section.
+        :param capabilities: capabilities formatted as JSON, as returned by core.getCapabilites(sos, 'content')
+        :param cell_size: size of the cells of the spatial index, in degrees. Default 0.01
+        :return: Catalog instance
+        """
+        catalog = cls(cell_size)
+        for offering in capabilities.get("contents", []):
+            catalog.add(offering)
+        return catalog
+
+    @classmethod
+    def fromSos(cls, sos, cell_size=0.01):
+        """
+        Builds a catalog from the capabilities of a SOS. A single GetCapabilities request is sent (or none, when the
+        response is in the cache of the SOS).
+        :param sos: Object describing an existing SOS with valid URL and token.
+        :param cell_size: size of the cells of the spatial index, in degrees. Default 0.01
+        :return: Catalog instance
+        """
+        return cls.fromCapabilities(core.getCapabilites(sos, 'content'), cell_size)
+
+    def add(self, offering):
+        """
+        Adds an offering to the indexes.
+        :param offering: offering record from the Contents section of the capabilities
+        :return: None
+        """
+        ide = core.identifierOf(offering.get("identifier"))
+        self.offerings[ide] = offering
+        for p in _asList(offering.get("procedure")):
+            self.by_procedure.setdefault(core.identifierOf(p), set()).add(ide)
+        for p in _asList(offering.get("observableProperty", offering.get("observedProperty"))):
+            self.by_property.setdefault(core.identifierOf(p), set()).add(ide)
+        features = _asList(offering.get("featureOfInterest"))
+        for related in _asList(offering.get("relatedFeature")):
+            if isinstance(related, dict) and "featureOfInterest" in related:
+                features.append(related["featureOfInterest"])
+        for f in features:
+            self.by_foi.setdefault(core.identifierOf(f), set()).add(ide)
+
+        period = offering.get("phenomenonTime")
+        if isinstance(period, list) and len(period) == 2:
+            self.times.append((core.parseTime(period[0]), core.parseTime(period[1]), ide))
+
+        area = offering.get("observedArea")
+        if isinstance(area, dict) and "lowerLeft" in area and "upperRight" in area:
+            # EPSG:4326 is reported as (latitude, longitude); the index uses (longitude, latitude)
+            lower, upper = area["lowerLeft"], area["upperRight"]
+            self.area.insert(ide, (lower[1], lower[0], upper[1], upper[0]))
+        return None
+
+    def has_procedure(self, procedure):
+        """
+        :param procedure: procedure identifier as URI
+        :return: True when the procedure (sensor) is registered in the SOS
+        """
+        return procedure in self.by_procedure
+
+    def procedures(self):
+        # set of registered procedures
+        return set(self.by_procedure)
+
+    def properties(self):
+        # set of observable properties
+        return set(self.by_property)
+
+    def features(self):
+        # set of features of interest
+        return set(self.by_foi)
+
+    def find(self, procedure=None, property_=None, feature_of_interest=None):
+        """
+        Finds the offerings matching all the given filters.
+        :param procedure: procedure identifier as URI. Optional.
+        :param property_: observable property identifier as URI. Optional.
+        :param feature_of_interest: feature of interest identifier as URI. Optional.
+        :return: set of offering identifiers
+        """
+        found = None
+        for index, value in ((self.by_procedure, procedure), (self.by_property, property_),
+                             (self.by_foi, feature_of_interest)):
+            if value is None:
+                continue
+            matches = index.get(value, set())
+            found = set(matches) if found is None else found & matches
+        return set(self.offerings) if found is None else found
+
+    def during(self, start, end):
+        """
+        Finds the offerings with observations within a time interval.
+        :param start: start of the interval, iso format with time zone, string
+        :param end: end of the interval, iso format with time zone, string
+        :return: set of offering identifiers
+        """
+        start, end = core.parseTime(start), core.parseTime(end)
+        if len(self.starts) != len(self.times):  # offerings were added
+            self.times.sort(key=lambda t: t[0])
+            self.starts = [t[0] for t in self.times]
+        last = bisect.bisect_right(self.starts, end)  # offerings starting before 'end'
+        return {t[2] for t in self.times[:last] if t[1] >= start}
+
+    def within(self, bbox):
+        """
+        Finds the offerings whose observed area intersects a bounding box.
+        :param bbox: (min_longitude, min_latitude, max_longitude, max_latitude)
+        :return: set of offering identifiers
+        """
+        return self.area.query(bbox)
+
+
+def _asList(value):
+    # single values and missing values as lists
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return list(value)
+    return [value]
@@ -0,0 +1,147 @@
+"""
+Columnar decoding of GetObservation responses into NumPy arrays.
+Observations are turned into one array per field (times, values, and codes for procedures, properties and features
+of interest) instead of a tree of dictionaries, so they can be aggregated with vectorized operations.
+Requires the 'numpy' package, which is optional for py4sos: pip install py4sos[columnar]
+"""
+
+import datetime
+
+from . import core
+
+_epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Categorical:
+    """
+    Array of repeated strings stored as integer codes and a list of distinct values (categories).
+    """
+
+    def __init__(self, codes, categories):
+        """
+        :param codes: numpy array of int32, index into 'categories'
+        :param categories: list of distinct strings
+        """
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    def values(self):
+        """
+        :return: numpy array of objects with the string of each element
+        """
+        import numpy as np
+
+        return np.array(self.categories, dtype=object)[self.codes]
+
+    def mask(self, value):
+        """
+        :param value: one of the categories
+        :return: numpy boolean array, True where the element equals 'value'
+        """
+        try:
+            return self.codes == self.categories.index(value)
+        except ValueError:  # value not present
+            return self.codes == -1
+
+
+class ObservationColumns:
+    """
+    Observations decoded into columns.
+    Attributes:
+        time: phenomenon time, numpy datetime64[ms] in UTC. For time periods, the start of the period.
+        result_time: result time, numpy datetime64[ms] in UTC. NaT when missing.
+        value: result value, numpy float64. NaN for results which are not numeric (e.g., geometries, text).
+        procedure, property, foi: Categorical arrays with the identifiers of each observation.
+        units: dictionary {observed property: unit of measurement}
+    """
+
+    def __init__(self, time, result_time, value, procedure, property_, foi, units):
+        self.time = time
+        self.result_time = result_time
+        self.value = value
+        self.procedure = procedure
+        self.property = property_
+        self.foi = foi
+        self.units = units
+
+    def __len__(self):
+        return len(self.time)
+
+    def select(self, mask):
+        """
+        Selects a subset of observations.
+        :param mask: numpy boolean array or array of indexes
+        :return: new ObservationColumns instance
+        """
+        return ObservationColumns(self.time[mask], self.result_time[mask], self.value[mask],
+                                  Categorical(self.procedure.codes[mask], self.procedure.categories),
+                                  Categorical(self.property.codes[mask], self.property.categories),
+                                  Categorical(self.foi.codes[mask], self.foi.categories), self.units)
+
+
+def _epoch_ms(stamp):
+    # time stamp in ISO format to milliseconds since 1970-01-01 UTC; integer arithmetic, so no rounding errors
+    return (core.parseTime(stamp) - _epoch) // datetime.timedelta(milliseconds=1)
+
+
+def decodeObservations(observations):
+    """
+    Decodes observations into columns.
+    :param observations: SOS response (dictionary with 'observations'), a list of observations or an iterator over
+     observations (e.g., as returned with stream=True).
+    :return: ObservationColumns instance
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("Columnar decoding requires the 'numpy' package: pip install numpy")
+
+    if isinstance(observations, dict):
+        observations = observations.get("observations", [])
+
+    times, result_times, values = [], [], []
+    codes = {"procedure": [], "property": [], "foi": []}
+    categories = {"procedure": {}, "property": {}, "foi": {}}
+    units = {}
+    nat = np.iinfo(np.int64).min  # NaT as int64
+
+    def encode(field, value):
+        table = categories[field]
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        codes[field].append(code)
+
+    for o in observations:
+        phenomenon_time = o["phenomenonTime"]
+        if isinstance(phenomenon_time, list):  # time period
+            phenomenon_time = phenomenon_time[0]
+        times.append(_epoch_ms(phenomenon_time))
+        result_time = o.get("resultTime")
+        result_times.append(_epoch_ms(result_time) if isinstance(result_time, str) else nat)
+
+        prop = core.identifierOf(o.get("observableProperty", o.get("observedProperty")))
+        result = o.get("result")
+        if isinstance(result, dict):
+            value = result.get("value")
+            if "uom" in result and prop not in units:
+                units[prop] = result["uom"]
+        else:
+            value = result
+        numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+        values.append(float(value) if numeric else np.nan)
+
+        encode("procedure", core.identifierOf(o.get("procedure")))
+        encode("property", prop)
+        encode("foi", core.identifierOf(o.get("featureOfInterest")))
+
+    def categorical(field):
+        return Categorical(np.array(codes[field], dtype=np.int32), list(categories[field]))
+
+    return ObservationColumns(np.array(times, dtype=np.int64).astype('datetime64[ms]'),
+                              np.array(result_times, dtype=np.int64).astype('datetime64[ms]'),
+                              np.array(values, dtype=np.float64),
+                              categorical("procedure"), categorical("property"), categorical("foi"), units)
@@ -5,47 +5,133 @@ Author: Manuel G. Garcia
 Created: 24-05-2017
 """
 
+import datetime
+import logging
+import math
 import requests
+from . import streaming
+from . import metrics
 
-def send_request(body, url, token):
+logger = logging.getLogger(__name__)
+
+def send_request(body, url, token, limiter=None, session=None, stream=False, headers=None):
     """
     Sends a request to a SOS using POST method
     :param body: body of the request formatted as JSON
     :param token: Authorization Token for an existing SOS.
     :param url: URL to the endpoint where the SOS can be accessed
+    :param limiter: RateLimiter for the SOS endpoint. The request waits for the 'read' budget. Optional.
+    :param session: requests.Session keeping a pool of connections to the SOS. Optional.
+    :param stream: when True, the body of the response is not downloaded until it is read. Default False
+    :param headers: additional HTTP headers (e.g., for conditional requests). Optional.
     :return: Server response to response formatted as JSON
     """
 
+    if limiter is not None:
+        limiter.acquire('read')
+
     # Add headers:
-    headers = {'Authorization': str(token), 'Accept': 'application/json'}
-    response = requests.post(url, headers=headers, json=body)
+    request_headers = {'Authorization': str(token), 'Accept': 'application/json'}
+    if headers is not None:
+        request_headers.update(headers)
+    response = metrics.timedRequest(body.get('request'), (session or requests).post, url, headers=request_headers,
+                                    json=body, stream=stream)
 
     response.raise_for_status()  # raise HTTP errors
 
     return response
 
 
-def getObservationByTime(sos, procedure, offering, property_, feature_of_interest, time_interval):
+def _send(sos, body, stream=False, headers=None):
+    """
+    Sends a request to the SOS described by a 'sos' object, honouring its rate limits and circuit breaker.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param body: body of the request formatted as JSON
+    :param stream: when True, the body of the response is not downloaded until it is read.
+    :param headers: additional HTTP headers. Optional.
+    :return: Server response
+    """
+    if hasattr(sos, 'require_valid'):  # stop before sending anything to an invalid URL
+        sos.require_valid()
+    options = {"limiter": getattr(sos, 'limiter', None), "session": getattr(sos, 'session', None), "stream": stream,
+               "headers": headers}
+    breaker = getattr(sos, 'breaker', None)
+    if breaker is not None:
+        return breaker.call(send_request, body, sos.sosurl, sos.token, **options)
+    return send_request(body, sos.sosurl, sos.token, **options)
+
+
+def _fetchJson(sos, body):
+    """
+    Sends a request and decodes its response. Responses are taken from the cache of the SOS, if any.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param body: body of the request formatted as JSON
+    :return: response formatted as JSON. Cached responses are shared; they should not be modified.
+    """
+    cache = getattr(sos, 'cache', None)
+    if cache is None or not cache.cacheable(body):
+        return _send(sos, body).json()
+
+    entry, fresh = cache.lookup(body)
+    if entry is not None and fresh:
+        return entry["payload"]
+
+    headers = cache.conditional_headers(entry) if entry is not None else None
+    response = _send(sos, body, headers=headers)
+    if response.status_code == 304 and entry is not None:  # not modified
+        cache.refresh(body, entry)
+        return entry["payload"]
+    payload = response.json()
+    cache.store(body, payload, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return payload
+
+
+def getObservationByTime(sos, procedure, offering, property_, feature_of_interest, time_interval, window=None,
+                         max_observations=10000, threads=4, merge=True, stream=False, columns=False):
     """
     Generate a json-formatted body request for a SOS, which retrieves data based on a time interval.
+    Large intervals can be split into sub-windows, which are requested concurrently and merged in time order.
+    Filters accept a single identifier or a list of identifiers; None leaves the filter out.
+    To query many series at once, see planner.getSeriesObservations.
     :param sos: Object describing an existing SOS with valid URL and token.
-    :param procedure: procedure identifier as URI
-    :param offering: offering identifier as URI
-    :param property_: observable property
-    :param feature_of_interest: feature of interest identifier as URI
+    :param procedure: procedure identifier as URI, or a list of them
+    :param offering: offering identifier as URI, or a list of them
+    :param property_: observable property, or a list of them
+    :param feature_of_interest: feature of interest identifier as URI, or a list of them
     :param time_interval: [start_time, end_time], iso format with time zone, string
+    :param window: None (default) sends a single request for the whole interval. A datetime.timedelta splits the interval
+     into windows of that length. 'auto' sizes the windows from the data availability of the series, so each window
+     holds about 'max_observations' observations.
+    :param max_observations: target number of observations per window when window='auto'. Default 10000
+    :param threads: number of windows requested concurrently. Default 4
+    :param merge: when True (default) a single response with all observations is returned. When False, an iterator over
+     the observations, in time order, is returned; at most 'threads' windows are kept in memory.
+    :param stream: when True, an iterator is returned which decodes the observations one at a time while the response
+     is downloaded, instead of decoding the whole response at once. Default False
+    :param columns: when True, observations are decoded into NumPy arrays (see columnar.ObservationColumns). Requires numpy.
     :return: SOS response containing JSON-formatted Observations filtered by time.
     """
     # TODO: test time interval validity. start_time smaller than end_time
 
+    if columns is True:
+        from . import columnar
+        return columnar.decodeObservations(getObservationByTime(sos, procedure, offering, property_,
+                                                                feature_of_interest, time_interval, window,
+                                                                max_observations, threads, merge=False, stream=True))
+
+    if window is not None:
+        windows = timeWindows(sos, procedure, property_, feature_of_interest, time_interval, window, max_observations)
+        observations = _iterWindows(sos, procedure, offering, property_, feature_of_interest, windows, threads, stream)
+        if stream is True:
+            return observations
+        if merge is not True:
+            return observations
+        return {"request": "GetObservation", "version": "2.0.0", "service": "SOS", "observations": list(observations)}
+
     request_body={
         "request": "GetObservation",
         "service": "SOS",
         "version": "2.0.0",
-        "procedure": procedure,
-        "offering":  offering,
-        "observedProperty": property_,
-        "featureOfInterest": feature_of_interest,
         "temporalFilter": {
             "during": {
                 "ref": "om:phenomenonTime",
@@ -56,30 +142,310 @@ def getObservationByTime(sos, procedure, offering, property_, feature_of_interes
             }
         }
     }
+    _addFilters(request_body, procedure=procedure, offering=offering, observedProperty=property_,
+                featureOfInterest=feature_of_interest)
+
+    if stream is True:
+        return streaming.iterObservations(_send(sos, request_body, stream=True))
+
+    return _fetchJson(sos, request_body)
+
+
+def getObservationByBBox(sos, bbox, time_interval=None, procedure=None, offering=None, property_=None, tile_size=None,
+                         threads=4, foi_index=None):
+    """
+    Retrieves the observations of the features of interest within a bounding box (spatial filter on
+    'om:featureOfInterest/*/sams:shape'). Large boxes can be split into tiles, which are requested concurrently.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param bbox: (min_longitude, min_latitude, max_longitude, max_latitude) in EPSG:4326
+    :param time_interval: [start_time, end_time], iso format with time zone, string. Default None (any time)
+    :param procedure: procedure identifier as URI, or a list of them. Optional.
+    :param offering: offering identifier as URI, or a list of them. Optional.
+    :param property_: observable property, or a list of them. Optional.
+    :param tile_size: size of the tiles in degrees. Default None sends a single request for the whole box.
+    :param threads: number of tiles requested concurrently. Default 4
+    :param foi_index: catalog.GridIndex with the coordinates (longitude, latitude) of the known features of interest.
+     Tiles without features of interest are not requested. Optional.
+    :return: SOS response containing JSON-formatted Observations within the bounding box, in time order.
+    """
+    tiles = bboxTiles(bbox, tile_size)
+    if foi_index is not None:
+        tiles = [t for t in tiles if foi_index.any_within(t)]
+
+    def fetch(tile):
+        request_body = {"request": "GetObservation",
+                        "service": "SOS",
+                        "version": "2.0.0",
+                        "spatialFilter": {
+                            "bbox": {
+                                "ref": "om:featureOfInterest/*/sams:shape",
+                                "value": _polygon(tile)
+                            }
+                        }
+                        }
+        if time_interval is not None:
+            request_body["temporalFilter"] = {"during": {"ref": "om:phenomenonTime",
+                                                         "value": [time_interval[0], time_interval[1]]}}
+        _addFilters(request_body, procedure=procedure, offering=offering, observedProperty=property_)
+        return _fetchJson(sos, request_body).get("observations", [])
+
+    # features on the edge between two tiles are returned by both
+    observations, seen = [], set()
+    for records in _orderedMap(fetch, tiles, threads):
+        for o in records:
+            ide = observationId(o)
+            if ide is not None:
+                if ide in seen:
+                    continue
+                seen.add(ide)
+            observations.append(o)
+    observations.sort(key=observationTime)
+    return {"request": "GetObservation", "version": "2.0.0", "service": "SOS", "observations": observations}
+
+
+def bboxTiles(bbox, tile_size=None):
+    """
+    Splits a bounding box into square tiles.
+    :param bbox: (min_x, min_y, max_x, max_y)
+    :param tile_size: size of the tiles. Default None returns the box itself.
+    :return: list of bounding boxes. Tiles on the right and top edges are clipped to the box.
+    """
+    if tile_size is None:
+        return [tuple(bbox)]
+    if tile_size <= 0:
+        raise ValueError('The tile size must be positive')
+    # rounding avoids a sliver tile when the size of the box is a multiple of the tile size
+    columns = max(1, int(math.ceil(round((bbox[2] - bbox[0]) / tile_size, 9))))
+    rows = max(1, int(math.ceil(round((bbox[3] - bbox[1]) / tile_size, 9))))
+    tiles = []
+    for r in range(rows):
+        for c in range(columns):
+            tiles.append((bbox[0] + c * tile_size, bbox[1] + r * tile_size,
+                          min(bbox[0] + (c + 1) * tile_size, bbox[2]), min(bbox[1] + (r + 1) * tile_size, bbox[3])))
+    return tiles
+
+
+def _polygon(bbox):
+    # bounding box as a GeoJSON polygon; the SOS expects EPSG:4326 coordinates as [latitude, longitude]
+    x0, y0, x1, y1 = bbox
+    return {"type": "Polygon", "coordinates": [[[y0, x0], [y0, x1], [y1, x1], [y1, x0], [y0, x0]]]}
+
+
+def _addFilters(request_body, **filters):
+    """
+    Adds filters (e.g., procedure=...) to the body of a request. Filters with value None are left out.
+    """
+    for name, value in filters.items():
+        if value is not None:
+            request_body[name] = value
+    return request_body
+
+
+def identifierOf(value):
+    """
+    Returns the identifier of a procedure, property or feature of interest as reported by the SOS. Identifiers come either
+    as a string, or as an object like {"identifier": {"value": ...}}, {"identifier": ...} or {"href": ...}.
+    :param value: identifier as reported by the SOS
+    :return: identifier as URI
+    """
+    if isinstance(value, dict):
+        if "identifier" in value:
+            value = value["identifier"]
+        elif "href" in value:
+            value = value["href"]
+        if isinstance(value, dict):
+            value = value.get("value")
+    return value
+
+
+def parseTime(value):
+    """
+    Converts a time stamp in ISO format into a datetime object. Time stamps without time zone are regarded as UTC.
+    :param value: time stamp, string. E.g., '2016-07-01T00:00:00+01:00' or '2016-07-01T00:00:00Z'
+    :return: datetime object with time zone
+    """
+    stamp = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=datetime.timezone.utc)
+    return stamp
+
+
+def observationTime(observation):
+    """
+    Returns the phenomenon time of an observation. For time periods, the start of the period is returned.
+    :param observation: observation formatted as JSON, as returned by the SOS
+    :return: datetime object
+    """
+    phenomenon_time = observation["phenomenonTime"]
+    if isinstance(phenomenon_time, list):  # time period
+        phenomenon_time = phenomenon_time[0]
+    return parseTime(phenomenon_time)
 
-    response = send_request(request_body, sos.sosurl, sos.token)
 
-    return response.json()
+def observationId(observation):
+    """
+    Returns the identifier of an observation.
+    :param observation: observation formatted as JSON, as returned by the SOS
+    :return: identifier as URI, or None when the observation has no identifier
+    """
+    identifier = observation.get("identifier")
+    if isinstance(identifier, dict):
+        return identifier.get("value")
+    return identifier
 
 
-def getObservationById(sos, ids):
+def timeWindows(sos, procedure, property_, feature_of_interest, time_interval, window, max_observations=10000):
+    """
+    Splits a time interval into consecutive windows.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param procedure: procedure identifier as URI, or a list of them
+    :param property_: observable property identifier as URI, or a list of them
+    :param feature_of_interest: feature of interest identifier as URI, or a list of them
+    :param time_interval: [start_time, end_time], iso format with time zone, string
+    :param window: a datetime.timedelta, or 'auto' to size the windows using getDataAvailability. When the SOS does not
+     report the number of observations, windows of one day are used.
+    :param max_observations: target number of observations per window when window='auto'
+    :return: list of [start_time, end_time] windows, iso format, string. With window='auto', the list is empty when the
+     series have no data in the interval.
+    """
+    start, end = parseTime(time_interval[0]), parseTime(time_interval[1])
+    if start >= end:
+        raise ValueError('The start of the time interval must be before its end')
+
+    if window == 'auto':
+        window = datetime.timedelta(days=1)  # when the number of observations is unknown
+        availability = getDataAvailability(sos, procedure, property_, feature_of_interest, count=True)
+        if availability.get("dataAvailability") == []:  # the series have no data
+            return []
+        counted = [a for a in availability.get("dataAvailability", []) if "count" in a]
+        if len(counted) > 0:
+            periods = [(parseTime(a["phenomenonTime"][0]), parseTime(a["phenomenonTime"][1])) for a in counted]
+            # Data is never requested out of the available period
+            start = max(start, min(p[0] for p in periods))
+            end = min(end, max(p[1] for p in periods))
+            if start > end:  # no data in the interval
+                return []
+            if start == end:  # data at a single time stamp
+                return [[start.isoformat(), end.isoformat()]]
+            expected = 0  # number of observations in the interval, for all series
+            for a, (a_start, a_end) in zip(counted, periods):
+                overlap = (min(end, a_end) - max(start, a_start)).total_seconds()
+                span = (a_end - a_start).total_seconds()
+                # Assumes observations are evenly distributed over the available period
+                if span > 0 and overlap > 0:
+                    expected += a["count"] * overlap / span
+                elif span == 0 and start <= a_start <= end:
+                    expected += a["count"]
+            pieces = max(1, -(-int(expected) // max_observations))  # ceiling
+            window = (end - start) / pieces
+    elif not isinstance(window, datetime.timedelta):
+        raise ValueError('The window must be a datetime.timedelta or "auto"')
+
+    windows = []
+    w_start = start
+    while w_start < end:
+        w_end = min(w_start + window, end)
+        windows.append([w_start.isoformat(), w_end.isoformat()])
+        w_start = w_end
+    return windows
+
+
+def _iterWindows(sos, procedure, offering, property_, feature_of_interest, windows, threads=4, stream=False):
+    """
+    Requests the observations of several time windows concurrently, and yields them in time order.
+    At most 'threads' windows are requested, or kept in memory, at the same time. With 'stream', responses are decoded
+    one observation at a time.
+    Observations at the boundary between two windows may be returned by both requests; they are yielded once.
+    """
+    def fetch(w):
+        if stream is True:
+            return list(getObservationByTime(sos, procedure, offering, property_, feature_of_interest, w, stream=True))
+        return getObservationByTime(sos, procedure, offering, property_, feature_of_interest, w).get("observations", [])
+
+    boundary = set()  # identifiers at the end of the previous window
+    for observations in _orderedMap(fetch, windows, threads):
+        observations.sort(key=observationTime)
+        for o in observations:
+            ide = observationId(o)
+            if ide is not None and ide in boundary:
+                continue
+            yield o
+        # keep only identifiers at the last time stamp of this window
+        if observations:
+            last = observationTime(observations[-1])
+            boundary = {observationId(o) for o in observations if observationTime(o) == last}
+        else:
+            boundary = set()
+
+
+def _orderedMap(func, items, threads=4):
+    """
+    Calls 'func' on each item using a pool of threads, and yields the results in the order of 'items'.
+    At most 'threads' calls are running, or their results waiting, at the same time.
+    """
+    import collections
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+        items = iter(items)
+
+        def submit():
+            for item in items:
+                pending.append(executor.submit(func, item))
+                return
+
+        for _ in range(threads):
+            submit()
+        while pending:
+            result = pending.popleft().result()
+            submit()
+            yield result
+
+
+def getObservationById(sos, ids, stream=False, columns=False, chunk_size=None, threads=4, retries=2):
     """
     Retrives data from an existing SOS using observation IDs.
+    Duplicated IDs are requested once. Large lists of IDs can be split into chunks, which are requested concurrently
+    and merged in the order of the IDs.
     :param sos: Object describing an existing SOS with valid URL and token.
     :param ids: a single string or a list of strings  with observations IDs. IDs as URIs
+    :param stream: when True, an iterator is returned which decodes the observations one at a time while the response
+     is downloaded, instead of decoding the whole response at once. Default False
+    :param columns: when True, observations are decoded into NumPy arrays (see columnar.ObservationColumns). Requires numpy.
+    :param chunk_size: maximum number of IDs in a request. Default None (a single request)
+    :param threads: number of chunks requested concurrently. Default 4
+    :param retries: number of times a chunk is requested again after a server or connection error. Default 2
     :return: SOS response containing observations that matches the ID(s), formatted as JSON.
     """
 
-    # check if ids is a list of strings:
-    def checktype(obj):
-        return bool(obj) and all(isinstance(elem, str) for elem in obj)
+    if columns is True:
+        from . import columnar
+        return columnar.decodeObservations(getObservationById(sos, ids, stream=True, chunk_size=chunk_size,
+                                                              threads=threads, retries=retries))
 
-    if checktype(ids) is not True:
-        print('ERROR: The parameter "id" is not a list of strings')
-        print('Check the values for the input parameter')
-        return
-    else:
-        pass
+    if isinstance(ids, str):
+        ids = [ids]
+    # check if ids is a list of strings:
+    if not isinstance(ids, (list, tuple)) or not all(isinstance(elem, str) for elem in ids):
+        raise TypeError('The parameter "ids" is not a list of strings')
+    if len(ids) == 0:
+        raise ValueError('The parameter "ids" is empty')
+    ids = list(dict.fromkeys(ids))  # remove duplicates, keep order
+
+    if chunk_size is not None and len(ids) > chunk_size:
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+        def fetch(chunk):
+            if stream is True:
+                return _retry(lambda: list(getObservationById(sos, chunk, stream=True)), retries)
+            return _retry(lambda: getObservationById(sos, chunk).get("observations", []), retries)
+
+        observations = (o for part in _orderedMap(fetch, chunks, threads) for o in part)
+        if stream is True:
+            return observations
+        return {"request": "GetObservationById", "version": "2.0.0", "service": "SOS",
+                "observations": list(observations)}
 
     request_body = {"request": "GetObservationById",
                     "service": "SOS",
@@ -87,9 +453,28 @@ def getObservationById(sos, ids):
                     "observation": ids
                     }
 
-    response = send_request(request_body, sos.sosurl, sos.token)
+    if stream is True:
+        return streaming.iterObservations(_send(sos, request_body, stream=True))
 
-    return response.json()
+    return _fetchJson(sos, request_body)
+
+
+def _retry(func, retries=2, delay=1.0):
+    """
+    Calls 'func' again when it fails because of the server or the network (connection errors, timeouts, HTTP 5xx; see
+    breaker.isServerError). The delay doubles after each attempt. Other errors, e.g. of the request itself (HTTP 4xx),
+    or requests refused by an open circuit breaker, are not retried.
+    """
+    import time as time_
+    from . import breaker
+
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as exc:
+            if attempt == retries or isinstance(exc, breaker.CircuitOpenError) or not breaker.isServerError(exc):
+                raise
+            time_.sleep(delay * 2 ** attempt)
 
 
 def getCapabilites(sos, level='service'):
@@ -129,38 +514,37 @@ def getCapabilites(sos, level='service'):
             request_body = {"request": "GetCapabilities",
                             "service": "SOS"
                             }
-        response = send_request(request_body, sos.sosurl, sos.token)  # send request
-        return response.json()
+        return _fetchJson(sos, request_body)  # send request
 
     else: # When no level input value matches
-        print('--->> Error: The value for the "level" parameter is not valid!!')
-        print("------>>> Valid values are: 'service', 'content', 'operations', 'all', and 'minimal'")
+        logger.error("The value for the 'level' parameter is not valid: %r. Valid values are: 'service', 'content', "
+                     "'operations', 'all', and 'minimal'", level)
         return None
 
 
-def getDataAvailability(sos, procedure, property_, feature_of_interest):
+def getDataAvailability(sos, procedure=None, property_=None, feature_of_interest=None, count=False):
     """
     Requests metadata regarding the availability of data in an existing SOS.
+    Filters accept a single identifier or a list of identifiers. Filters with value None are left out; without filters,
+    the availability of all series in the SOS is returned.
     :param sos: Object describing an existing SOS with valid URL and token.
-    :param procedure: procedure identifier as URI
-    :param property_: observable property identifier as URI
-    :param feature_of_interest:  feature of interest identifier as URI
+    :param procedure: procedure identifier as URI, or a list of them
+    :param property_: observable property identifier as URI, or a list of them
+    :param feature_of_interest:  feature of interest identifier as URI, or a list of them
+    :param count: when True, the number of observations of each series is requested too ('count' of each record),
+     using the 'ShowCount' extension of 52North. Servers without the extension leave 'count' out. Default False
     :return: availability of data in a SOS filtered by the input parameters, formatted as JSON
     """
 
-    #  TODO: Expand function to the case of multiple filters and no filter
-
     request_body = {"request": "GetDataAvailability",
                     "service": "SOS",
-                    "version": "2.0.0",
-                    "procedure": procedure,
-                    "observedProperty": property_,
-                    "featureOfInterest": feature_of_interest
+                    "version": "2.0.0"
                     }
+    _addFilters(request_body, procedure=procedure, observedProperty=property_, featureOfInterest=feature_of_interest)
+    if count is True:
+        request_body["extensions"] = [{"definition": "ShowCount", "value": True}]
 
-    response = send_request(request_body, sos.sosurl, sos.token)  # send request
-
-    return response.json()
+    return _fetchJson(sos, request_body)  # send request
 
 
 
@@ -0,0 +1,240 @@
+"""
+Bulk export of observation series from a SOS to compressed files.
+The time range is split into days; the series of a day are requested with as few GetObservation requests as the
+query planner allows, several days in parallel, and the responses are decoded while they are downloaded. Each
+(day, series) partition is written to its own file, either CSV compressed with gzip or NumPy NPZ:
+
+    <directory>/<day>/<series>.csv.gz
+
+Rows are written in the order the SOS returns them. CSV rows are written as they are decoded, so a response is never
+held in memory. NPZ arrays can only be written at once; the rows of a partition are kept until it is complete. Both
+formats have the same columns: times, value, unit of measurement, procedure, property, feature of interest and
+observation identifier.
+
+Files are written under a temporary name and renamed when complete. An export which was interrupted resumes where it
+stopped: partitions whose file exists are not requested again.
+
+Usage from the command line:
+    python -m py4sos.export URL DIRECTORY --start 2016-07-01 --end 2016-08-01 --procedure P1 P2 --property Q1
+"""
+
+import csv
+import datetime
+import gzip
+import os
+import re
+import zlib
+from . import core
+from . import planner
+
+formats = {'csv': '.csv.gz', 'npz': '.npz'}
+_columns = ['phenomenonTime', 'resultTime', 'value', 'uom', 'procedure', 'observableProperty', 'featureOfInterest',
+            'identifier']
+
+
+def seriesName(series):
+    """
+    :param series: (procedure, property, feature of interest) tuple
+    :return: name for the files of a series. It is made of the last part of each identifier ('all' for None) and a
+     checksum of the full identifiers, so different series never share a name.
+    """
+    parts = ['all' if e is None else re.split(r'[/#:]', e.rstrip('/'))[-1] for e in series]
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', '__'.join(parts))
+    checksum = zlib.crc32(repr(tuple(series)).encode('utf-8')) & 0xffffffff
+    return name + '-' + format(checksum, '08x')
+
+
+def days(time_interval):
+    """
+    Splits a time interval into days (UTC).
+    :param time_interval: [start_time, end_time], iso format with time zone, string
+    :return: list of (day, start, end): the date as a string and the part of the interval within the day (datetimes)
+    """
+    start, end = core.parseTime(time_interval[0]), core.parseTime(time_interval[1])
+    start, end = start.astimezone(datetime.timezone.utc), end.astimezone(datetime.timezone.utc)
+    result = []
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end:
+        following = day + datetime.timedelta(days=1)
+        # the end of a day is excluded, except for the end of the interval
+        result.append((day.date().isoformat(), max(day, start), min(following - datetime.timedelta(microseconds=1), end)))
+        day = following
+    return result
+
+
+def exportSeries(sos, series, time_interval, directory, file_format='csv', offering=None, max_identifiers=100,
+                 threads=4):
+    """
+    Exports the observations of many series within a time interval to compressed files, one per day and series.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param series: list of (procedure, property, feature of interest) tuples. See planner.cartesian().
+    :param time_interval: [start_time, end_time], iso format with time zone, string
+    :param directory: path to the output directory
+    :param file_format: 'csv' (gzip compressed CSV) or 'npz' (NumPy arrays; requires numpy). Default 'csv'
+    :param offering: offering identifier as URI, or a list of them. Default None (any offering).
+    :param max_identifiers: maximum number of identifiers in a request. Default 100
+    :param threads: number of requests sent concurrently. Default 4
+    :return: dictionary with the number of files written, partitions skipped (already exported) and observations
+    """
+    if file_format not in formats:
+        raise ValueError('Unknown format: ' + str(file_format) + '. Use one of ' + ', '.join(formats))
+    series = list(dict.fromkeys(tuple(s) for s in series))
+    plan = planner.planQueries(series, max_identifiers)
+
+    def path(day, s):
+        return os.path.join(directory, day, seriesName(s) + formats[file_format])
+
+    jobs = []
+    skipped = 0
+    for day, start, end in days(time_interval):
+        for p in plan:
+            missing = [s for s in p["series"] if not os.path.exists(path(day, s))]
+            skipped += len(p["series"]) - len(missing)
+            if len(missing) > 0:
+                jobs.append((day, start, end, p, missing))
+
+    def fetch(job):
+        # writes the partitions of a request while its response is decoded
+        day, start, end, p, missing = job
+        os.makedirs(os.path.join(directory, day), exist_ok=True)
+        writers = {}
+        match = planner.seriesMatcher(missing)
+        try:
+            observations = core.getObservationByTime(sos, p["procedure"], offering, p["observedProperty"],
+                                                     p["featureOfInterest"], [start.isoformat(), end.isoformat()],
+                                                     stream=True)
+            for o in observations:
+                for s in match(o):
+                    if s not in writers:
+                        writers[s] = _writer(file_format, path(day, s) + '.tmp')
+                    writers[s].write(o)
+            for s in missing:  # series without observations get an empty file, so they are not requested again
+                if s not in writers:
+                    writers[s] = _writer(file_format, path(day, s) + '.tmp')
+        except BaseException:
+            for w in writers.values():
+                w.discard()
+            raise
+        count = 0
+        for s, w in writers.items():
+            w.close()
+            os.replace(w.path, path(day, s))
+            count += w.count
+        return len(writers), count
+
+    stats = {"written": 0, "skipped": skipped, "observations": 0}
+    for written, count in core._orderedMap(fetch, jobs, threads):
+        stats["written"] += written
+        stats["observations"] += count
+    return stats
+
+
+def _writer(file_format, path):
+    # writer of a partition file
+    return _CsvWriter(path) if file_format == 'csv' else _NpzWriter(path)
+
+
+def _row(o):
+    # observation as a CSV row
+    result = o.get("result")
+    value, uom = (result.get("value"), result.get("uom")) if isinstance(result, dict) else (result, None)
+    phenomenon_time = o.get("phenomenonTime")
+    if isinstance(phenomenon_time, list):
+        phenomenon_time = phenomenon_time[0]
+    return [phenomenon_time, o.get("resultTime"), value, uom, core.identifierOf(o.get("procedure")),
+            core.identifierOf(o.get("observableProperty", o.get("observedProperty"))),
+            core.identifierOf(o.get("featureOfInterest")), core.observationId(o)]
+
+
+class _CsvWriter:
+    """
+    Gzip compressed CSV file; each observation is written as a row at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.file = gzip.open(path, 'wt', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(_columns)
+
+    def write(self, o):
+        self.writer.writerow(_row(o))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class _NpzWriter:
+    """
+    Compressed NPZ file, one array per column. Rows are kept until the file is closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.rows = []
+
+    def write(self, o):
+        self.rows.append(_row(o))
+        self.count += 1
+
+    def close(self):
+        import numpy as np
+        from . import columnar
+
+        nat = np.iinfo(np.int64).min  # NaT as int64
+
+        def times(k):
+            return np.array([columnar._epoch_ms(r[k]) if isinstance(r[k], str) else nat for r in self.rows],
+                            dtype=np.int64).astype('datetime64[ms]')
+
+        def strings(k):
+            return np.array(['' if r[k] is None else str(r[k]) for r in self.rows], dtype=str)
+
+        values = [float(r[2]) if isinstance(r[2], (int, float)) and not isinstance(r[2], bool) else np.nan
+                  for r in self.rows]
+        with open(self.path, 'wb') as f:  # a file object, so numpy does not add '.npz' to the name
+            np.savez_compressed(f, phenomenonTime=times(0), resultTime=times(1),
+                                value=np.array(values, dtype=np.float64), uom=strings(3), procedure=strings(4),
+                                observableProperty=strings(5), featureOfInterest=strings(6), identifier=strings(7))
+        self.rows = []
+
+    def discard(self):
+        self.rows = []
+
+
+def main(argv=None):
+    import argparse
+    from . import santander
+
+    parser = argparse.ArgumentParser(description='Exports observation series from a SOS to compressed files, one per '
+                                                 'day and series. Run it again to resume an interrupted export.')
+    parser.add_argument('url', help='URL of the SOS service')
+    parser.add_argument('directory', help='output directory')
+    parser.add_argument('--token', default='', help='authorization token')
+    parser.add_argument('--start', required=True, help='start of the time range, ISO format')
+    parser.add_argument('--end', required=True, help='end of the time range, ISO format')
+    parser.add_argument('--procedure', nargs='+', default=[None], help='procedure identifiers. Default any')
+    parser.add_argument('--property', nargs='+', default=[None], help='observable property identifiers. Default any')
+    parser.add_argument('--foi', nargs='+', default=[None], help='feature of interest identifiers. Default any')
+    parser.add_argument('--offering', nargs='+', default=None, help='offering identifiers. Default any')
+    parser.add_argument('--format', choices=sorted(formats), default='csv', help='file format. Default csv')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent requests. Default 4')
+    args = parser.parse_args(argv)
+
+    sos = santander.Sos(args.url, args.token)
+    series = planner.cartesian(args.procedure, args.property, args.foi)
+    stats = exportSeries(sos, series, [args.start, args.end], args.directory, args.format, args.offering,
+                         threads=args.threads)
+    print('Files written: ', stats["written"], ' Partitions skipped: ', stats["skipped"],
+          ' Observations: ', stats["observations"])
+
+
+if __name__ == '__main__':
+    main()
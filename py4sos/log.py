@@ -0,0 +1,106 @@
+"""
+Logging for py4sos.
+Modules log to loggers named after them (e.g., 'py4sos.santander'). Without configuration only warnings and errors are
+printed (by the last resort handler of Python). Call configure() to print progress messages, or attach handlers to the
+'py4sos' logger.
+Messages are formatted only when they are emitted, so in quiet mode the pipeline does no formatting work at all.
+Repeated messages (same logger and template) are rate limited by RateLimitFilter, and parsing reports a summary per
+file instead of a message per object.
+"""
+
+import json
+import logging
+import sys
+import threading
+import time as time_
+
+logger = logging.getLogger('py4sos')
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most 'burst' records with the same template in each interval. The first record after an interval
+    with dropped records tells how many were dropped.
+    """
+
+    def __init__(self, burst=5, interval=60.0):
+        """
+        :param burst: number of records with the same template allowed in an interval. Default 5
+        :param interval: length of the interval, in seconds. Default 60
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}  # (logger name, template): [start of the interval, number of records]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time_.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                dropped = 0 if window is None else max(0, window[1] - self.burst)
+                self.windows[key] = [now, 1]
+                if dropped > 0:
+                    record.suppressed = dropped
+                return True
+            window[1] += 1
+            return window[1] <= self.burst
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Plain text, with the number of dropped repetitions of a message, if any.
+    """
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0) > 0:
+            text += ' (' + str(record.suppressed) + ' similar messages suppressed)'
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    A JSON object per line, with time, level, logger and message, plus the fields passed with 'extra'.
+    """
+
+    _standard = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in self._standard:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(level=logging.INFO, quiet=False, structured=False, burst=5, interval=60.0, stream=None):
+    """
+    Prints the messages of py4sos. Replaces the handler added by a previous call.
+    :param level: lowest level of the messages printed. Default logging.INFO
+    :param quiet: when True, only errors are printed; other messages are not even formatted. Default False
+    :param structured: when True, messages are printed as JSON lines. Default False (plain text)
+    :param burst: number of messages with the same template printed in an interval. None disables rate limiting.
+    :param interval: length of the rate limiting interval, in seconds. Default 60
+    :param stream: output stream. Default sys.stderr
+    :return: the handler
+    """
+    for h in list(logger.handlers):
+        if getattr(h, 'py4sos', False):
+            logger.removeHandler(h)
+    handler = logging.StreamHandler(sys.stderr if stream is None else stream)
+    handler.py4sos = True
+    handler.setFormatter(JsonFormatter() if structured else TextFormatter())
+    if burst is not None:
+        handler.addFilter(RateLimitFilter(burst, interval))
+    logger.addHandler(handler)
+    logger.setLevel(logging.ERROR if quiet else level)
+    return handler
@@ -0,0 +1,300 @@
+"""
+Counters and latency histograms for the ingest pipeline and the requests to a SOS.
+Metrics are off by default: the active collector is NULL, whose methods do nothing, so instrumented code costs a
+function call. Call enable() to collect metrics, then read them with snapshot(), write them to a file in Prometheus
+text format or JSON with write(), or receive every update through a callback. Snapshots taken in other processes
+(e.g., ingest workers) are added up with merge().
+
+Metrics collected by py4sos:
+    py4sos_stage_seconds{stage}                       time spent in each stage (load, clean, build, upload, ...)
+    py4sos_http_seconds{operation}                    duration of the requests to the SOS
+    py4sos_http_requests_total{operation, status}     requests to the SOS by HTTP status ('error' when no response)
+    py4sos_nodes_total{kind}                          nodes parsed from input files ('new' or 'updated')
+    py4sos_batch_requests_total{outcome}              requests within Batches ('inserted', 'duplicate' or 'failed')
+"""
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time as time_
+
+# Upper bounds of the histogram buckets, in seconds
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=default_buckets):
+        """
+        :param buckets: sorted upper bounds of the buckets. Values above the last bound are counted in '+Inf'.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :return: list of (upper bound, number of values smaller or equal), ending with ('+Inf', count)
+        """
+        result, total = [], 0
+        for bound, n in zip(self.buckets + ('+Inf',), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+
+    enabled = True
+
+    def __init__(self, buckets=default_buckets):
+        """
+        :param buckets: upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = tuple(buckets)
+        self.counters = {}  # (name, labels): value
+        self.histograms = {}  # (name, labels): Histogram
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments a counter.
+        :param name: name of the counter, e.g. 'py4sos_http_requests_total'
+        :param value: increment. Default 1
+        :param labels: labels of the counter, e.g. operation='InsertObservation'
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        for func in self.callbacks:
+            func('counter', name, labels, value)
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value (e.g., a duration in seconds) in a histogram.
+        :param name: name of the histogram, e.g. 'py4sos_http_seconds'
+        :param value: value to record
+        :param labels: labels of the histogram
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        for func in self.callbacks:
+            func('histogram', name, labels, value)
+
+    @contextlib.contextmanager
+    def stage(self, name, **labels):
+        """
+        Measures the time spent in a block of code:  with metrics.active.stage('load'): ...
+        :param name: name of the stage
+        :param labels: additional labels
+        """
+        start = time_.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('py4sos_stage_seconds', time_.perf_counter() - start, stage=name, **labels)
+
+    def add_callback(self, func):
+        """
+        Registers a function called on every update, as func(kind, name, labels, value), where kind is 'counter' or
+        'histogram'. It runs in the thread doing the update, so it should return quickly.
+        :param func: callable
+        :return: None
+        """
+        self.callbacks.append(func)
+
+    def snapshot(self):
+        """
+        :return: dictionary {"counters": [...], "histograms": [...]} with the current values, ready for JSON
+        """
+        with self.lock:
+            counters = [{"name": k[0], "labels": dict(k[1]), "value": v} for k, v in sorted(self.counters.items())]
+            histograms = [{"name": k[0], "labels": dict(k[1]), "count": h.count, "sum": h.sum,
+                           "buckets": [[b, n] for b, n in h.cumulative()]}
+                          for k, h in sorted(self.histograms.items(), key=lambda i: i[0])]
+        return {"counters": counters, "histograms": histograms}
+
+    def prometheus(self):
+        """
+        :return: current values in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for c in snapshot["counters"]:
+            if c["name"] not in typed:
+                lines.append('# TYPE ' + c["name"] + ' counter')
+                typed.add(c["name"])
+            lines.append(c["name"] + _labels(c["labels"]) + ' ' + _number(c["value"]))
+        for h in snapshot["histograms"]:
+            if h["name"] not in typed:
+                lines.append('# TYPE ' + h["name"] + ' histogram')
+                typed.add(h["name"])
+            for bound, n in h["buckets"]:
+                lines.append(h["name"] + '_bucket' + _labels(dict(h["labels"], le=_number(bound))) + ' ' + str(n))
+            lines.append(h["name"] + '_sum' + _labels(h["labels"]) + ' ' + _number(h["sum"]))
+            lines.append(h["name"] + '_count' + _labels(h["labels"]) + ' ' + str(h["count"]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, file_format='prometheus'):
+        """
+        Writes the current values to a file, replacing it at once.
+        :param path: path to the file
+        :param file_format: 'prometheus' (text exposition format) or 'json'. Default 'prometheus'
+        :return: None
+        """
+        if file_format == 'json':
+            content = json.dumps(self.snapshot(), indent=1)
+        elif file_format == 'prometheus':
+            content = self.prometheus()
+        else:
+            raise ValueError("Unknown format: " + str(file_format) + ". Use 'prometheus' or 'json'")
+        tmp = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+        return None
+
+    def merge(self, snapshot):
+        """
+        Adds the values of a snapshot, e.g. taken in another process, to this collector. Callbacks are not called.
+        :param snapshot: dictionary returned by snapshot()
+        :return: None
+        """
+        with self.lock:
+            for c in snapshot["counters"]:
+                key = (c["name"], tuple(sorted(c["labels"].items())))
+                self.counters[key] = self.counters.get(key, 0) + c["value"]
+            for h in snapshot["histograms"]:
+                key = (h["name"], tuple(sorted(h["labels"].items())))
+                bounds = tuple(b for b, n in h["buckets"][:-1])
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(bounds)
+                elif histogram.buckets != bounds:
+                    raise ValueError('Histograms with different buckets can not be merged: ' + h["name"])
+                previous = 0
+                for i, (bound, n) in enumerate(h["buckets"]):  # cumulative counts back to counts per bucket
+                    histogram.counts[i] += n - previous
+                    previous = n
+                histogram.sum += h["sum"]
+                histogram.count += h["count"]
+        return None
+
+    def reset(self):
+        # removes all values
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+class _NullMetrics:
+    """
+    Collector used while metrics are disabled. All methods do nothing.
+    """
+
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def stage(self, name, **labels):
+        return _null_stage
+
+    def add_callback(self, func):
+        pass
+
+    def merge(self, snapshot):
+        pass
+
+    def snapshot(self):
+        return {"counters": [], "histograms": []}
+
+    def prometheus(self):
+        return ''
+
+    def write(self, path, file_format='prometheus'):
+        pass
+
+    def reset(self):
+        pass
+
+
+_null_stage = contextlib.nullcontext()
+NULL = _NullMetrics()
+active = NULL  # collector used by py4sos
+
+
+def enable(collector=None):
+    """
+    Starts collecting metrics.
+    :param collector: Metrics instance. Default None creates a new one.
+    :return: the active Metrics instance
+    """
+    global active
+    active = Metrics() if collector is None else collector
+    return active
+
+
+def disable():
+    """
+    Stops collecting metrics.
+    :return: the Metrics instance which was active, or NULL
+    """
+    global active
+    previous, active = active, NULL
+    return previous
+
+
+def _labels(labels):
+    # labels in Prometheus format: {a="1",b="2"}
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for k, v in sorted(labels.items())) + '}'
+
+
+def _number(value):
+    # number in Prometheus format
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def timedRequest(operation, func, *args, **kwargs):
+    """
+    Calls a function sending an HTTP request, and records its duration and status in the active collector.
+    :param operation: name of the SOS operation, e.g. 'GetObservation'
+    :param func: function returning a requests.Response, e.g. session.post
+    :return: the return value of func
+    """
+    collector = active
+    if not collector.enabled:
+        return func(*args, **kwargs)
+    status = 'error'
+    start = time_.perf_counter()
+    try:
+        response = func(*args, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        collector.observe('py4sos_http_seconds', time_.perf_counter() - start, operation=operation)
+        collector.inc('py4sos_http_requests_total', operation=operation, status=status)
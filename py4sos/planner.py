@@ -0,0 +1,176 @@
+"""
+Query planning for reading many series (procedure, observed property, feature of interest) from a SOS.
+Instead of a request per series, series are coalesced into as few GetObservation or GetDataAvailability requests as
+the limits of the server allow. Each request filters by lists of procedures, properties and features of interest.
+Responses are split back into series.
+"""
+
+import itertools
+from . import core
+
+
+def cartesian(procedures, properties, features_of_interest):
+    """
+    Builds the list of series for all combinations of procedures, properties and features of interest.
+    :param procedures: list of procedure identifiers as URI
+    :param properties: list of observable property identifiers as URI
+    :param features_of_interest: list of feature of interest identifiers as URI. Use [None] for any feature.
+    :return: list of (procedure, property, feature of interest) tuples
+    """
+    return list(itertools.product(procedures, properties, features_of_interest))
+
+
+def planQueries(series, max_identifiers=100, max_series=None):
+    """
+    Groups series into requests. A request filters by the procedures, properties and features of interest of its
+    series, so it may also return observations of other combinations; these are dropped by splitObservations.
+    Series are sorted by procedure, which keeps the properties and features of a node in the same request.
+    :param series: list of (procedure, property, feature of interest) tuples. None in a tuple means no filter for
+     that element (e.g., any feature of interest).
+    :param max_identifiers: maximum number of identifiers (procedures + properties + features) in a request. Default 100
+    :param max_series: maximum number of series in a request. Default no limit.
+    :return: list of requests: {"procedure": [...], "observedProperty": [...], "featureOfInterest": [...], "series": [...]}.
+     Filters which are not used are None.
+    """
+    plan = []
+    # series with a different set of filters can not share a request
+    by_filters = {}
+    for s in sorted(set(series), key=lambda s: tuple('' if e is None else e for e in s)):
+        by_filters.setdefault(tuple(e is None for e in s), []).append(s)
+
+    for group in by_filters.values():
+        current = None
+        for s in group:
+            if current is not None:
+                new = sum(1 for i in range(3) if s[i] is not None and s[i] not in current["sets"][i])
+                if (current["size"] + new > max_identifiers or
+                        (max_series is not None and len(current["series"]) >= max_series)):
+                    plan.append(current)
+                    current = None
+            if current is None:
+                current = {"sets": (set(), set(), set()), "lists": ([], [], []), "size": 0, "series": []}
+            for i in range(3):
+                if s[i] is not None and s[i] not in current["sets"][i]:
+                    current["sets"][i].add(s[i])
+                    current["lists"][i].append(s[i])
+                    current["size"] += 1
+            current["series"].append(s)
+        if current is not None:
+            plan.append(current)
+
+    requests = []
+    for p in plan:
+        lists = [l if len(l) > 0 else None for l in p["lists"]]
+        requests.append({"procedure": lists[0], "observedProperty": lists[1], "featureOfInterest": lists[2],
+                         "series": p["series"]})
+    return requests
+
+
+def splitObservations(observations, series):
+    """
+    Splits observations (or data availability records) by series.
+    :param observations: list of observations formatted as JSON, as returned by the SOS
+    :param series: list of (procedure, property, feature of interest) tuples. None matches any value.
+    :return: dictionary {series: list of observations}. Observations of other series are dropped.
+    """
+    result = {s: [] for s in series}
+    match = seriesMatcher(series)
+    for o in observations:
+        for s in match(o):
+            result[s].append(o)
+    return result
+
+
+def seriesMatcher(series):
+    """
+    :param series: list of (procedure, property, feature of interest) tuples. None matches any value.
+    :return: function taking an observation (or a data availability record) and returning the list of series it
+     belongs to
+    """
+    wanted = set(series)
+    masks = {tuple(e is None for e in s) for s in wanted}
+
+    def match(o):
+        key = (core.identifierOf(o.get("procedure")),
+               core.identifierOf(o.get("observableProperty", o.get("observedProperty"))),
+               core.identifierOf(o.get("featureOfInterest")))
+        found = []
+        for mask in masks:
+            masked = tuple(None if m else k for k, m in zip(key, mask))
+            if masked in wanted:
+                found.append(masked)
+        return found
+
+    return match
+
+
+def _runPlan(plan, fetch, threads):
+    # Sends the planned requests concurrently and splits the results by series
+    import concurrent.futures
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        for p, records in zip(plan, executor.map(fetch, plan)):
+            results.update(splitObservations(records, p["series"]))
+    return results
+
+
+def getSeriesObservations(sos, series, time_interval, offering=None, max_identifiers=100, max_series=None, threads=4,
+                          catalog=None):
+    """
+    Retrieves the observations of many series within a time interval, using as few GetObservation requests as possible.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param series: list of (procedure, property, feature of interest) tuples. See cartesian().
+    :param time_interval: [start_time, end_time], iso format with time zone, string
+    :param offering: offering identifier as URI, or a list of them. Default None (any offering).
+    :param max_identifiers: maximum number of identifiers in a request. Default 100
+    :param max_series: maximum number of series in a request. Default no limit.
+    :param threads: number of requests sent concurrently. Default 4
+    :param catalog: Catalog of the SOS. When given, series of procedures which are not registered are not requested.
+    :return: dictionary {series: list of observations in time order}
+    """
+    series = list(series)
+    plan = planQueries(_registered(series, catalog), max_identifiers, max_series)
+
+    def fetch(p):
+        response = core.getObservationByTime(sos, p["procedure"], offering, p["observedProperty"],
+                                             p["featureOfInterest"], time_interval)
+        return response.get("observations", [])
+
+    results = {s: [] for s in series}
+    results.update(_runPlan(plan, fetch, threads))
+    for observations in results.values():
+        observations.sort(key=core.observationTime)
+    return results
+
+
+def getSeriesAvailability(sos, series, max_identifiers=100, max_series=None, threads=4, catalog=None, count=False):
+    """
+    Retrieves the data availability of many series, using as few GetDataAvailability requests as possible.
+    :param sos: Object describing an existing SOS with valid URL and token.
+    :param series: list of (procedure, property, feature of interest) tuples. See cartesian().
+    :param max_identifiers: maximum number of identifiers in a request. Default 100
+    :param max_series: maximum number of series in a request. Default no limit.
+    :param threads: number of requests sent concurrently. Default 4
+    :param catalog: Catalog of the SOS. When given, series of procedures which are not registered are not requested.
+    :param count: when True, the number of observations of each series is requested too. See core.getDataAvailability.
+    :return: dictionary {series: list of data availability records}
+    """
+    series = list(series)
+    plan = planQueries(_registered(series, catalog), max_identifiers, max_series)
+
+    def fetch(p):
+        response = core.getDataAvailability(sos, p["procedure"], p["observedProperty"], p["featureOfInterest"],
+                                            count)
+        return response.get("dataAvailability", [])
+
+    results = {s: [] for s in series}
+    results.update(_runPlan(plan, fetch, threads))
+    return results
+
+
+def _registered(series, catalog):
+    # series whose procedure is registered in the catalog
+    if catalog is None:
+        return series
+    return [s for s in series if s[0] is None or catalog.has_procedure(s[0])]
@@ -0,0 +1,176 @@
+"""
+Profiling of the ingest pipeline, file by file.
+For a sample of the input files, a CPU profile (cProfile) and the top memory allocations (tracemalloc) are recorded,
+together with the time and peak memory of each stage (load, clean, build, upload, ...). Reports are written to a
+directory, usually 'profiles' next to the history logs:
+
+    <name>.prof       CPU profile, readable with pstats or tools like snakeviz
+    <name>.txt        functions with the largest cumulative time, stages, and top allocations
+    summary.jsonl     a line per profiled file, to compare runs and spot regressions
+
+cProfile only sees the thread parsing the file; requests sent by the upload threads show up in the time of the
+'upload' stage.
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import re
+import time as time_
+
+
+class Profiler:
+
+    enabled = True
+
+    def __init__(self, directory, sample_rate=1.0, top=25, memory=True):
+        """
+        :param directory: path to the directory for the reports. It is created if missing.
+        :param sample_rate: fraction of the files which are profiled, between 0 and 1. Default 1 (all files).
+         E.g., 0.05 profiles one file out of 20, starting with the first one.
+        :param top: number of functions and allocations in the reports. Default 25
+        :param memory: when True (default), memory allocations are traced. Tracing slows down the code being profiled.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError('The sample rate must be between 0 and 1')
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.top = top
+        self.memory = memory
+        self.files = 0  # files seen
+        self.depth = 0  # nesting of file() calls
+        self.current = None  # state of the file being profiled
+
+    def sampled(self):
+        """
+        Counts a file and decides whether it is profiled.
+        :return: True when the file is profiled
+        """
+        self.files += 1
+        return math.ceil(self.files * self.sample_rate) > math.ceil((self.files - 1) * self.sample_rate)
+
+    @contextlib.contextmanager
+    def file(self, name):
+        """
+        Profiles the processing of a file:  with profiler.file(file_name): ...
+        Nested calls (e.g., requests_from_file called by upload_directory2sos) are part of the outer file.
+        :param name: name of the file, used for the name of the reports
+        """
+        if self.depth > 0 or not self.sampled():
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+            return
+
+        import cProfile
+        import tracemalloc
+
+        started_tracing = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        self.current = {"name": name, "stages": [], "open": None, "start": time_.perf_counter(),
+                        "cpu": time_.process_time()}
+        self.depth += 1
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.depth -= 1
+            state, self.current = self.current, None
+            self._endStage(state)
+            state["wall"] = time_.perf_counter() - state["start"]
+            state["cpu"] = time_.process_time() - state["cpu"]
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            state["peak"] = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+            if started_tracing:
+                tracemalloc.stop()
+            self._report(state, profile, snapshot)
+
+    def mark(self, name):
+        """
+        Starts a stage (e.g., 'load', 'clean'), ending the previous one. The time and peak memory of each stage of a
+        profiled file are reported. Does nothing when no file is being profiled.
+        :param name: name of the stage
+        :return: None
+        """
+        import tracemalloc
+
+        state = self.current
+        if state is None:
+            return None
+        self._endStage(state)
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        state["open"] = (name, time_.perf_counter())
+        return None
+
+    def _endStage(self, state):
+        # records the stage in progress, if any
+        import tracemalloc
+
+        if state["open"] is not None:
+            name, start = state["open"]
+            peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+            state["stages"].append({"stage": name, "seconds": time_.perf_counter() - start, "peak_bytes": peak})
+            state["open"] = None
+
+    def _report(self, state, profile, snapshot):
+        # writes the reports of a profiled file
+        import pstats
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        base = os.path.join(self.directory, stamp + '_' + re.sub(r'[^A-Za-z0-9._-]+', '_', state["name"]))
+        profile.dump_stats(base + '.prof')
+
+        text = io.StringIO()
+        text.write('File: ' + state["name"] + '\n')
+        text.write('Wall time: %.3f s  CPU time: %.3f s' % (state["wall"], state["cpu"]))
+        if state["peak"] is not None:
+            text.write('  Peak traced memory: %.1f MB' % (state["peak"] / 1e6))
+        text.write('\n\nStages:\n')
+        for s in state["stages"]:
+            text.write('  %-12s %9.3f s' % (s["stage"], s["seconds"]))
+            if s["peak_bytes"] is not None:
+                text.write('  peak %8.1f MB' % (s["peak_bytes"] / 1e6))
+            text.write('\n')
+        text.write('\nCPU profile (cumulative time):\n')
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(self.top)
+        if snapshot is not None:
+            text.write('Top memory allocations:\n')
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                text.write('  ' + str(stat) + '\n')
+        with open(base + '.txt', 'w') as f:
+            f.write(text.getvalue())
+
+        summary = {"time": stamp, "file": state["name"], "wall_seconds": state["wall"], "cpu_seconds": state["cpu"],
+                   "peak_bytes": state["peak"], "stages": state["stages"]}
+        with open(os.path.join(self.directory, 'summary.jsonl'), 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+
+
+class _NullProfiler:
+    """
+    Profiler used when profiling is off. All methods do nothing.
+    """
+
+    enabled = False
+    depth = 0
+
+    def file(self, name):
+        return _null_context
+
+    def mark(self, name):
+        return None
+
+
+_null_context = contextlib.nullcontext()
+NULL = _NullProfiler()
@@ -0,0 +1,145 @@
+"""
+Token-bucket rate limiting for requests sent to a SOS.
+Limits are kept per SOS endpoint (URL) and shared by every Sos object, pipeline and thread pointing to the same
+endpoint within a process. Transactional requests (e.g., Batch, InsertSensor, InsertObservation) and read
+requests (e.g., GetObservation, GetCapabilities) have separate budgets.
+Buckets are thread-safe. Coroutines can use the 'acquire_async' methods, which do not block the event loop.
+"""
+
+import threading
+import time as time_
+
+
+class TokenBucket:
+    """
+    Token bucket filled at a constant rate. Each request consumes one token.
+    Waiting time is reserved under a lock, and the caller sleeps outside of it, so concurrent callers are served in order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: number of tokens added per second (sustained requests per second)
+        :param capacity: maximum number of tokens (burst size). Default is max(1, rate)
+        """
+        if rate <= 0:
+            raise ValueError('The rate of a token bucket must be larger than zero')
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.stamp = time_.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket.
+        :param tokens: number of tokens to consume
+        :return: time in seconds the caller has to wait before sending the request
+        """
+        with self.lock:
+            now = time_.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= tokens  # may become negative; debt is paid by waiting
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Blocks the calling thread until the tokens are available.
+        :param tokens: number of tokens to consume
+        :return: time waited in seconds
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time_.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        """
+        Suspends the calling coroutine until the tokens are available.
+        :param tokens: number of tokens to consume
+        :return: time waited in seconds
+        """
+        import asyncio
+
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """
+    Separate token buckets for transactional and read requests to the same SOS.
+    A budget of None means no limit for that kind of request.
+    """
+
+    kinds = ('transactional', 'read')
+
+    def __init__(self, transactional=None, read=None, burst=None):
+        """
+        :param transactional: maximum number of transactional requests per second
+        :param read: maximum number of read requests per second
+        :param burst: maximum number of requests sent at once, for both kinds. Default is the rate itself.
+        """
+        self.buckets = {}
+        for kind, rate in zip(self.kinds, (transactional, read)):
+            if rate is not None:
+                self.buckets[kind] = TokenBucket(rate, burst)
+
+    def acquire(self, kind='read', tokens=1):
+        """
+        Blocks until a request of the given kind can be sent.
+        :param kind: 'transactional' or 'read'
+        :param tokens: number of requests to account for
+        :return: time waited in seconds
+        """
+        bucket = self.buckets.get(kind)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire(tokens)
+
+    async def acquire_async(self, kind='read', tokens=1):
+        """
+        Suspends the calling coroutine until a request of the given kind can be sent.
+        :param kind: 'transactional' or 'read'
+        :param tokens: number of requests to account for
+        :return: time waited in seconds
+        """
+        bucket = self.buckets.get(kind)
+        if bucket is None:
+            return 0.0
+        return await bucket.acquire_async(tokens)
+
+
+# Rate limiters per SOS endpoint, shared within the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def setLimit(url, transactional=None, read=None, burst=None):
+    """
+    Sets the rate limits for a SOS endpoint. It replaces previous limits for the same URL.
+    :param url: URL to the endpoint where the SOS can be accessed
+    :param transactional: maximum number of transactional requests per second. None for no limit.
+    :param read: maximum number of read requests per second. None for no limit.
+    :param burst: maximum number of requests sent at once
+    :return: the RateLimiter shared by all clients of this endpoint, or None when no limit was given
+    """
+    with _limiters_lock:
+        if transactional is None and read is None:
+            _limiters.pop(str(url), None)
+            return None
+        limiter = RateLimiter(transactional, read, burst)
+        _limiters[str(url)] = limiter
+    return limiter
+
+
+def limiterFor(url):
+    """
+    Returns the rate limiter of a SOS endpoint.
+    :param url: URL to the endpoint where the SOS can be accessed
+    :return: RateLimiter instance, or None when the endpoint has no limits
+    """
+    return _limiters.get(str(url))
@@ -0,0 +1,188 @@
+"""
+Local replica of observations retrieved from a SOS, stored in SQLite.
+Observations are indexed by (procedure, observed property, feature of interest, phenomenon time), and are unique by
+their identifier; observations without identifier are told apart by their result instead. The time
+intervals already downloaded are recorded for each query. A query is answered from the replica for the covered part
+of its interval; only the missing gaps are requested from the SOS.
+"""
+
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+from . import core
+
+_any = '*'  # filter left out of a query (e.g., any feature of interest)
+
+
+def _utc(stamp):
+    # time stamp (string or datetime) as a sortable string in UTC
+    if isinstance(stamp, str):
+        stamp = core.parseTime(stamp)
+    return stamp.astimezone(datetime.timezone.utc).isoformat(timespec='microseconds')
+
+
+def _key(observation):
+    # unique key of an observation within its series and time: its identifier, or a digest of its result
+    ide = core.observationId(observation)
+    if ide is not None:
+        return ide
+    result = json.dumps(observation.get("result"), sort_keys=True)
+    return 'result:' + hashlib.sha1(result.encode('utf-8')).hexdigest()
+
+
+class Replica:
+
+    def __init__(self, sos, path=':memory:', lag=datetime.timedelta(minutes=10), threads=4):
+        """
+        :param sos: Object describing an existing SOS with valid URL and token.
+        :param path: path to the SQLite database. Default ':memory:' (the replica is lost when closed)
+        :param lag: observations younger than this may still be uploaded to the SOS, so the last 'lag' before now is
+         never regarded as covered and is requested again. Default 10 minutes
+        :param threads: number of gaps requested concurrently. Default 4
+        """
+        self.sos = sos
+        self.lag = lag
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS observations (
+                procedure TEXT, property TEXT, foi TEXT, time TEXT, id TEXT, body TEXT,
+                UNIQUE (procedure, property, foi, time, id));
+            CREATE INDEX IF NOT EXISTS observations_series ON observations (procedure, property, foi, time);
+            CREATE TABLE IF NOT EXISTS coverage (
+                procedure TEXT, property TEXT, foi TEXT, start TEXT, end TEXT);
+            CREATE INDEX IF NOT EXISTS coverage_series ON coverage (procedure, property, foi);
+            """)
+
+    def getObservationByTime(self, procedure, property_, feature_of_interest, time_interval):
+        """
+        Retrieves the observations of a series within a time interval, from the replica when possible.
+        Parts of the interval which were not retrieved before are requested from the SOS and stored.
+        :param procedure: procedure identifier as URI. None for any procedure.
+        :param property_: observable property identifier as URI. None for any property.
+        :param feature_of_interest: feature of interest identifier as URI. None for any feature.
+        :param time_interval: [start_time, end_time], iso format with time zone, string
+        :return: response containing JSON-formatted Observations in time order, as returned by the SOS
+        """
+        key = tuple(_any if e is None else e for e in (procedure, property_, feature_of_interest))
+        start, end = _utc(time_interval[0]), _utc(time_interval[1])
+
+        gaps = self.gaps(key, start, end)
+        if len(gaps) > 0:
+            def fetch(gap):
+                response = core.getObservationByTime(self.sos, procedure, None, property_, feature_of_interest,
+                                                     list(gap))
+                return response.get("observations", [])
+
+            settled = _utc(datetime.datetime.now(datetime.timezone.utc) - self.lag)
+            for gap, observations in zip(gaps, core._orderedMap(fetch, gaps, self.threads)):
+                self.store(observations)
+                if gap[0] < settled:
+                    self._cover(key, gap[0], min(gap[1], settled))
+
+        return {"request": "GetObservation", "version": "2.0.0", "service": "SOS",
+                "observations": self.query(procedure, property_, feature_of_interest, start, end)}
+
+    def query(self, procedure, property_, feature_of_interest, start, end):
+        """
+        Reads observations from the replica only; nothing is requested from the SOS.
+        :param procedure: procedure identifier as URI. None for any procedure.
+        :param property_: observable property identifier as URI. None for any property.
+        :param feature_of_interest: feature of interest identifier as URI. None for any feature.
+        :param start: start of the interval, iso format with time zone, string
+        :param end: end of the interval, iso format with time zone, string
+        :return: list of observations formatted as JSON, in time order
+        """
+        sql = "SELECT body FROM observations WHERE time >= ? AND time <= ?"
+        args = [_utc(start), _utc(end)]
+        for column, value in (("procedure", procedure), ("property", property_), ("foi", feature_of_interest)):
+            if value is not None:
+                sql += " AND " + column + " = ?"
+                args.append(value)
+        with self.lock:
+            rows = self.db.execute(sql + " ORDER BY time", args).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def store(self, observations):
+        """
+        Writes observations into the replica. Observations already stored are ignored.
+        :param observations: list of observations formatted as JSON, as returned by the SOS
+        :return: None
+        """
+        rows = []
+        for o in observations:
+            rows.append((core.identifierOf(o.get("procedure")),
+                         core.identifierOf(o.get("observableProperty", o.get("observedProperty"))),
+                         core.identifierOf(o.get("featureOfInterest")),
+                         _utc(core.observationTime(o)), _key(o), json.dumps(o)))
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return None
+
+    def gaps(self, key, start, end):
+        """
+        Finds the parts of an interval which are not covered by the replica for a query.
+        A query is covered by intervals retrieved for it or for a broader query (e.g., any feature of interest).
+        :param key: (procedure, property, feature of interest) of the query; '*' for filters left out
+        :param start: start of the interval, in UTC as returned by _utc()
+        :param end: end of the interval, in UTC as returned by _utc()
+        :return: list of (start, end) intervals, in time order
+        """
+        options = [(e,) if e == _any else (e, _any) for e in key]
+        covered = []
+        with self.lock:
+            for p in options[0]:
+                for q in options[1]:
+                    for f in options[2]:
+                        covered += self.db.execute("SELECT start, end FROM coverage WHERE procedure = ? AND "
+                                                   "property = ? AND foi = ? AND end >= ? AND start <= ?",
+                                                   (p, q, f, start, end)).fetchall()
+        gaps = []
+        cursor = start
+        for c_start, c_end in sorted(covered):
+            if c_start > cursor:
+                gaps.append((cursor, c_start))
+            cursor = max(cursor, c_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def coverage(self, procedure=None, property_=None, feature_of_interest=None):
+        """
+        :return: list of (start, end) intervals retrieved for a query, in time order
+        """
+        key = tuple(_any if e is None else e for e in (procedure, property_, feature_of_interest))
+        with self.lock:
+            return self.db.execute("SELECT start, end FROM coverage WHERE procedure = ? AND property = ? AND foi = ? "
+                                   "ORDER BY start", key).fetchall()
+
+    def invalidate(self):
+        """
+        Removes all observations and coverage from the replica.
+        :return: None
+        """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM observations")
+            self.db.execute("DELETE FROM coverage")
+        return None
+
+    def close(self):
+        # closes the database
+        self.db.close()
+
+    def _cover(self, key, start, end):
+        # records an interval as retrieved for a query, merging it with overlapping intervals
+        with self.lock, self.db:
+            rows = self.db.execute("SELECT start, end FROM coverage WHERE procedure = ? AND property = ? AND foi = ? "
+                                   "AND end >= ? AND start <= ?", key + (start, end)).fetchall()
+            for r in rows:
+                start, end = min(start, r[0]), max(end, r[1])
+            self.db.execute("DELETE FROM coverage WHERE procedure = ? AND property = ? AND foi = ? AND end >= ? AND "
+                            "start <= ?", key + (start, end))
+            self.db.execute("INSERT INTO coverage VALUES (?, ?, ?, ?, ?)", key + (start, end))
+
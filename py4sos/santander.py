@@ -14,15 +14,25 @@ Author: Manuel G. Garcia
 """
 
 import json as json
+import logging
 import os
 import re
 import glob
 import datetime
-import requests
-import concurrent.futures
 import time as time_
+from . import archive
 from . import wrapper
 from . import transactional
+from . import ratelimit
+from . import breaker
+from . import sharding
+from . import metrics
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+# Prefix of procedure identifiers, see transactional.insertSensor
+procedure_prefix = 'http://www.geosmartcity.nl/test/procedure/'
 
 # OM_types dictionary
 om_types = {"m": "OM_Measurement",
@@ -51,7 +61,7 @@ def timeFromFile(filename=str):
     :param filename: string which contains a date and time
     :return: time stamp in ISO format
     """
-    time_st = re.findall(r"\d\d\d\d[-]\d\d[-]\d\d[T]\d+", filename)
+    time_st = re.findall(r"\d\d\d\d[-]\d\d[-]\d\d[T]\d+", filename.rsplit('/', 1)[-1])  # skip the bundle name
     iso_time = time_st[0][:10] + " " + time_st[0][11:13] + ":" + time_st[0][13:15] + ":" + time_st[0][15:]
 
     return iso_time
@@ -62,6 +72,7 @@ def history(hist_directory):
     Opens a history file or creates a new one at root directory.
     A history file keeps a record of which sensors and observations have been processed
     File structure = {node: {count: int, latest: time_of_last_observation}}
+    Only history files ('hist-*.json', see updateHistory) are considered; spool files live in the same directory.
     :param hist_directory: path to directory to store history files.
     :return: The newest history file in root directory OR
             an empty history file
@@ -71,35 +82,28 @@ def history(hist_directory):
 
     try:
         # load latest modified history file
-        newest = max(glob.iglob('*.json'), key=os.path.getmtime)
+        newest = max(glob.iglob('hist-*.json'), key=os.path.getmtime)
         his = open(newest)
         pool = json.load(his)
         his.close()
     # when no history file is found
     except ValueError:  # on empty directory
-        # raise message
-        print('------------------------------------')
-        print('WARNING!:')
-        print('Empty directory for history files')
-        print('Starting new record')
-        print('------------------------------------')
+        logger.warning('Empty directory for history files, starting a new record: %s', hist_directory)
         pool = {}  # start an empty dictionary for history
     return pool
 
 
 def loadData(root_directory, file_name, nest='markers'):
     '''
-    Opens and reads a json file in the root directory
+    Opens and reads a json file in the root directory. Compressed files (.json.gz, .json.zst) and members of tar bundles
+    (e.g., 'bundle.tar.gz/data_stream-2016-07-01T080007.json') are read without extracting them. See archive.py
     :param root_directory: path to directory containing json files.
     :param file_name: file name
     :param nest: key name of the most upper object in the JSON file, which is an array. Default 'markers'
     :return: dictionary containing json objects
     '''
-    # open file
-    with open(root_directory + file_name) as f:
-        jdata = json.load(f)
-        jdata = jdata[nest]
-    return jdata
+    jdata = json.loads(archive.readSnapshot(root_directory, file_name))
+    return jdata[nest]
 
 
 def cleanData(objectlist, has_tag=str, time_attrib=True):
@@ -112,6 +116,7 @@ def cleanData(objectlist, has_tag=str, time_attrib=True):
     """
     # counter for removed objects
     i = 0
+    no_time = 0  # objects without time attribute
     cleanList = []
     for o in objectlist:
         # Keep objects with key 'id' and tag = has_tag
@@ -129,7 +134,7 @@ def cleanData(objectlist, has_tag=str, time_attrib=True):
                     else:
                         reported_time = o['LastValue']  # Another key for time (in waste collector)
                 except KeyError:  # When object has not this key
-                    print("*** Object has no 'Time' attribute ***")
+                    no_time += 1
                     continue  # Go to the next object
                 else:  # if object has time attribute
                     # Filter  zero time
@@ -143,87 +148,388 @@ def cleanData(objectlist, has_tag=str, time_attrib=True):
             # print("!!!No 'id' name in object: " + str(i))
             # print('------------------------')
             i += 1  # increase counter
-    print(str(i) + ' Objects were removed!')
+    logger.info('%d objects were removed, %d objects have no time attribute', i, no_time)
 
     return cleanList
 
 
 class Sos():
-    def __init__(self, url, token=''):
+    def __init__(self, url, token='', validate='lazy', pool_size=10):
+        """
+        :param url: URL to the endpoint where the SOS can be accessed
+        :param token: Authorization Token for the SOS, optional
+        :param validate: when the URL is tested. True: at creation. 'lazy': before the first request sent through
+         this object (default). False: never. Once the URL is found invalid, requests sent through this object raise
+         ValueError. See check.
+        :param pool_size: maximum number of connections kept open to the SOS. Default 10
+        """
         self.sosurl = str(url)  # url to access the SOS
         self.token = str(token)  # security token, optional
-        # Test if URL exists
-        try:
-            test = requests.get(self.sosurl)
-            # TODO: test for token authorization
-            test.raise_for_status()
-        except requests.HTTPError:
-            print("The URL is not valid")
+        self.pool_size = pool_size
+        self._session = None  # connection pool, created on first use
+        self.breaker = None  # circuit breaker, optional
+        self.cache = None  # response cache for read requests, optional
+        self.spool = False  # spool requests while the circuit is open
+        self.valid = None  # result of the URL test, None when not tested
+        self.pending_check = validate == 'lazy'
+        if validate is True:
+            self.check()
+
+    def check(self):
+        """
+        Tests if the URL of the SOS exists. Only definitive results are cached: the server answered (valid, even when the
+        answer is an HTTP error, which is only reported), or the URL can not be requested at all (not valid). When the
+        server can not be reached (e.g., connection errors, timeouts), the URL is tested again before the next request.
+        :return: True when the URL is valid, False when it is not valid or was not reached
+        """
+        import requests
+
+        if self.valid is None:
+            self.pending_check = False
+            try:
+                test = self.session.get(self.sosurl)
+                # TODO: test for token authorization
+                test.raise_for_status()
+                self.valid = True
+            except requests.HTTPError as exc:
+                logger.warning('The URL is not valid: %s (%s)', self.sosurl, exc)
+                self.valid = True  # the server answers; requests are sent anyway
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                logger.warning('The SOS could not be reached, it is tested again before the next request: %s (%s)',
+                               self.sosurl, exc)
+                self.pending_check = True
+                return False
+            except requests.RequestException:
+                logger.error('The URL is not valid: %s', self.sosurl)
+                self.valid = False
+        return self.valid
+
+    def require_valid(self):
+        """
+        Tests the URL of the SOS, if it was not tested yet, before a request is sent.
+        :return: None. Raises ValueError when the URL is not valid, so no request is sent to it. When the SOS was not
+         reached, the request is sent anyway, so it fails (and is retried) like any other request.
+        """
+        if self.pending_check:
+            self.check()
+        if self.valid is False:
+            raise ValueError('The URL of the SOS is not valid: ' + self.sosurl)
+        return None
+
+    @property
+    def session(self):
+        # requests.Session with a pool of connections to this SOS, created on first use
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+            self._mount()
+        return self._session
+
+    def _mount(self):
+        # (re)places the connection pool of the session, sized by self.pool_size
+        import requests
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def set_pool_size(self, pool_size):
+        """
+        Changes the maximum number of connections kept open to the SOS. When the session already exists, its pool is
+        replaced; connections of the previous pool are closed once released.
+        :param pool_size: maximum number of connections
+        :return: None
+        """
+        self.pool_size = pool_size
+        if self._session is not None:
+            self._mount()
+        return None
+
+    @property
+    def limiter(self):
+        # Rate limiter shared by all clients of this endpoint. None when there are no limits.
+        return ratelimit.limiterFor(self.sosurl)
+
+    def set_rate_limit(self, transactional=None, read=None, burst=None):
+        """
+        Limits the number of requests per second sent to this SOS endpoint. Limits are shared by all Sos objects,
+        pipelines and threads using the same URL.
+        :param transactional: maximum number of transactional requests per second (e.g., Batch). None for no limit.
+        :param read: maximum number of read requests per second (e.g., GetObservation). None for no limit.
+        :param burst: maximum number of requests sent at once. Default is the rate itself.
+        :return: RateLimiter instance, or None when limits were removed
+        """
+        return ratelimit.setLimit(self.sosurl, transactional, read, burst)
+
+    def set_circuit_breaker(self, error_rate=0.5, window=20, min_calls=10, reset_timeout=30, spool=False):
+        """
+        Attaches a circuit breaker to this SOS. When the rate of server errors gets too high, requests fail fast
+        (or are spooled to disk by upload2sos) until a probe request shows the server has recovered.
+        :param error_rate: fraction of failed requests, within the window, that opens the circuit. Default 0.5
+        :param window: number of latest requests used to compute the error rate. Default 20
+        :param min_calls: minimum number of requests in the window before the circuit can open. Default 10
+        :param reset_timeout: seconds to wait while open before probing the server again. Default 30
+        :param spool: when True, upload2sos writes Batch requests refused by an open circuit to a spool file
+         in the history directory, and they are sent again once the server recovers. The history log records the
+         spooled data as sent (its observation identifiers are taken), so the spool file is the only copy of that data:
+         it has to be kept until it is sent, to this same SOS.
+        :return: CircuitBreaker instance
+        """
+        self.breaker = breaker.CircuitBreaker(error_rate, window, min_calls, reset_timeout, probe=self.probe)
+        self.spool = spool
+        return self.breaker
+
+    def enable_cache(self, maxsize=128, ttl=None, directory=None):
+        """
+        Caches the responses of read requests to this SOS (by default GetCapabilities and GetDataAvailability).
+        Use self.cache.invalidate() to drop cached responses, and self.cache.stats() for hit/miss statistics.
+        :param maxsize: maximum number of responses kept in memory. Default 128
+        :param ttl: dictionary {operation: seconds}. Default cache.default_ttl
+        :param directory: path to a directory for an on-disk tier. Default None (memory only)
+        :return: ResponseCache instance
+        """
+        from . import cache
+
+        self.cache = cache.ResponseCache(maxsize, ttl, directory, self.sosurl)
+        return self.cache
+
+    def probe(self):
+        """
+        Sends a cheap GetCapabilities request (ServiceIdentification section only) to check the SOS is responding.
+        It bypasses rate limits and the circuit breaker.
+        :return: None. Raises an exception when the SOS does not respond properly.
+        """
+        from . import core
+
+        body = {"request": "GetCapabilities",
+                "service": "SOS",
+                "sections": ["ServiceIdentification"]
+                }
+        core.send_request(body, self.sosurl, self.token, session=self.session)
+        return None
+
+
+def reconcile(sos, source='availability', threads=4):
+    """
+    Fetches the sensors (nodes) already registered in a SOS and their observation count. Nodes missing from the history
+    logs but registered in the SOS are then treated as existing nodes, so InsertSensor is not sent again, and their
+    observation identifiers continue after the ones in the SOS.
+    The count of a node comes from GetDataAvailability when the server reports it. Otherwise it is taken from the
+    identifiers of the newest observations of the node (node_attribute_count), with a GetObservation request per node.
+    :param sos: Object describing an existing SOS with valid URL and token, or a ShardedSos for several SOS instances.
+    :param source: 'availability' uses GetDataAvailability, asking for the number of observations of each series.
+     'capabilities' uses the contents of GetCapabilities, which have no counts.
+    :param threads: number of GetObservation requests sent concurrently for the nodes without count. Default 4
+    :return: dictionary {node id: number of observations of the node}. The count is None when it could not be found;
+     requests_from_file leaves these nodes out, since new identifiers could clash with the ones in the SOS.
+    """
+    from . import core
+    from . import catalog
+
+    if isinstance(sos, sharding.ShardedSos):
+        registered = {}
+        for shard in sos.shards:
+            for ide, count in reconcile(shard, source, threads).items():
+                if count is None or registered.get(ide, 0) is None:
+                    registered[ide] = None
+                else:
+                    registered[ide] = max(count, registered.get(ide, 0))
+        return registered
+
+    registered = {}  # node id: count, None when not reported
+    ends = {}  # node id: end of the newest series
+    if source == 'availability':
+        for a in _availability(sos):
+            procedure = core.identifierOf(a.get("procedure"))
+            if procedure is not None and procedure.startswith(procedure_prefix):
+                ide = procedure[len(procedure_prefix):]
+                # a series per attribute; each snapshot adds an observation to every series
+                count = a.get("count")
+                if count is None or (ide in registered and registered[ide] is None):
+                    registered[ide] = None
+                else:
+                    registered[ide] = max(count, registered.get(ide, 0))
+                _newest(ends, ide, a.get("phenomenonTime"))
+    elif source == 'capabilities':
+        index = catalog.Catalog.fromSos(sos)
+        for procedure in index.procedures():
+            if procedure.startswith(procedure_prefix):
+                ide = procedure[len(procedure_prefix):]
+                registered[ide] = None
+                for offering in index.find(procedure=procedure):
+                    _newest(ends, ide, index.offerings[offering].get("phenomenonTime"))
+    else:
+        raise ValueError("Unknown source: " + str(source) + ". Use 'availability' or 'capabilities'")
+
+    unknown = [ide for ide, count in registered.items() if count is None]
+    if len(unknown) > 0:
+        for ide, count in zip(unknown, core._orderedMap(lambda i: _newestCount(sos, i, ends.get(i)), unknown, threads)):
+            registered[ide] = count
+        missing = sum(1 for ide in unknown if registered[ide] is None)
+        if missing > 0:
+            logger.warning('The observation count of %d registered sensors is unknown; they are left out', missing)
+
+    logger.info('Sensors registered in the SOS: %d', len(registered))
+    return registered
+
+
+def _availability(sos):
+    # data availability of all series, with counts when the server supports the extension
+    from . import core
+    import requests
+
+    try:
+        return core.getDataAvailability(sos, count=True).get("dataAvailability", [])
+    except requests.HTTPError as exc:
+        if exc.response is None or exc.response.status_code >= 500:
+            raise
+        logger.info('The SOS does not support counts in GetDataAvailability: %s', exc)
+    return core.getDataAvailability(sos).get("dataAvailability", [])
+
+
+def _newest(ends, ide, period):
+    # keeps the latest end of the time periods of a node
+    from . import core
+
+    if isinstance(period, list) and len(period) == 2:
+        end = core.parseTime(period[1])
+        if ide not in ends or end > ends[ide]:
+            ends[ide] = end
+
+
+def _newestCount(sos, ide, end):
+    """
+    Finds the observation count of a node from the identifiers of its newest observations (node_attribute_count).
+    :param sos: Object describing an existing SOS
+    :param ide: node identifier
+    :param end: time of the newest observation of the node, datetime object. None when it is not known.
+    :return: the count, or None when it can not be found
+    """
+    from . import core
+
+    if end is None:
+        return None
+    stamp = end.isoformat()
+    response = core.getObservationByTime(sos, procedure_prefix + ide, None, None, None, [stamp, stamp])
+    count = None
+    for o in response.get("observations", []):
+        suffix = str(core.observationId(o)).rsplit('_', 1)[-1]
+        if suffix.isdigit():
+            count = max(int(suffix), count or 0)
+    return count
 
 
 def upload_directory2sos(sos, directory, sensor_type, history_path, threads=1, time_attribute=True,
-                         spatial_profile=True):
+                         spatial_profile=True, multi_observation=False, snapshots_per_request=1, reconcile_with=None,
+                         profile=False, profile_rate=1.0):
     """
     Parses all JSON files in a directory, prepares SOS requests for registering sensors and observations, and uploads data to an existing SOS.
+    Compressed files (.json.gz, .json.zst) and tar bundles (.tar, .tar.gz, .tgz, .tar.zst) are read in place, without
+    extracting them to disk (see archive.listSnapshots).
     Application is limited by an intense use of memory when a directory contains a very large number of files.
     The use of multi-thread  may crash the SOS. To limit the number of crashes, the function will stop for 20 seconds every after every 50 files.
-    :param sos: Object describing an existing SOS with valid URL and token.
+    :param sos: Object describing an existing SOS with valid URL and token, or a ShardedSos for several SOS instances.
     :param directory: path to the directory which contains a JSON file.
     :param sensor_type: the type of sensors for which requests will be prepare (e.g., 'light', 'weather_station', etc.)
     :param history_path: path to directory for history logs
     :param threads: number of threads for multi-thread uploading. Default is 1 thread.
     :param time_attribute: states if specific sensor type contains a time attribute or not. Default is True.
     :param spatial_profile: switches between the use of insertObservationSP (True) to insertObservation (False).
+    :param multi_observation: when True, all the attribute observations of a node are sent in a single InsertObservation request.
+    :param snapshots_per_request: number of files parsed together. When larger than 1, all pending observations of a node
+     across these files are sent in a single InsertObservation request.
+    :param reconcile_with: 'availability' or 'capabilities' to fetch the registered sensors before parsing (see
+     reconcile()). Default None, registration relies only on the history logs.
+    :param profile: when True, CPU profiles and memory allocations are recorded for each file (or group of files), and
+     reports are written to the 'profiles' directory in 'history_path'. See profiling.Profiler. Default False
+    :param profile_rate: fraction of the files which are profiled when profile=True. Default 1 (all files)
     :return: None
     """
 
-    json_files = os.listdir(directory)  # list all files in directory
+    profiler = profiling.NULL
+    if profile is True:
+        profiler = profiling.Profiler(os.path.join(history_path, 'profiles'), profile_rate)
+    registered = None
+    if reconcile_with is not None:
+        registered = reconcile(sos, reconcile_with)
+
+    json_files = archive.listSnapshots(directory)  # list all snapshots in directory, including archived ones
     counter = 0  # initiate counter for monitoring progress
     start_time = datetime.datetime.now()
-    print('=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/')
-    print('Process stated at: ', str(start_time))
-    print('PROCESSING all files in directory: ', directory)
+    logger.info('Processing all files in directory: %s', directory)
+
+    # Files are sorted by name; members of a bundle keep their order, so each bundle is decompressed once.
+    for i in range(0, len(json_files), snapshots_per_request):  # loop over json files.
+        group = json_files[i:i + snapshots_per_request]
+        logger.info('Working on file(s) %d to %d out of %d: %s', counter + 1, counter + len(group), len(json_files),
+                    group)
+        with profiler.file(', '.join(group)):
+            # Load data from JSON file and prepare requests
+            if len(group) == 1:
+                request_collection = requests_from_file(directory, group[0], sensor_type, history_path, time_attribute,
+                                                        spatial_profile, multi_observation, registered=registered,
+                                                        profiler=profiler)
+            else:
+                request_collection = requests_from_files(directory, group, sensor_type, history_path, time_attribute,
+                                                         spatial_profile, registered=registered, profiler=profiler)
 
-    for f in sorted(json_files):  # loop over json files. Files sorted by name.
-        print('---->>Working on file: ', f)
-        print('    >> Parsing file ', str(counter + 1), ' out of: ', str(len(json_files)))
-        print('----------------------------------------------------------')
-        # Load data from JSON file and prepare requests
-        request_collection = requests_from_file(directory, f, sensor_type, history_path, time_attribute,
-                                                spatial_profile)
+            upload2sos(sos, request_collection, history_path, threads, profiler=profiler)
+        counter += len(group)
 
-        upload2sos(sos, request_collection, history_path, threads)
-        counter += 1
+        # Send spooled requests once the server has recovered
+        if getattr(sos, 'spool', False) and sos.breaker.state == 'closed':
+            upload_spool(sos, history_path, threads)
 
         # Put the program to sleep after processing 'n' files.
         n = 50
-        if counter > 0 and (counter % n) == 0:
+        if counter > 0 and (counter // n) > ((counter - len(group)) // n):
             wait_time = 20  # time in seconds
-            # print('=============================================')
-            print('\n       >>>   The monkey is tired   <<<      ')
-            print('            *********************            ')
-            print('            **                 ** ')
-            print('            **   GETTING MORE  **            ')
-            print('            **      BANANAS    **            ')
-            print('            **                 **            ')
-            print('            *********************            ')
-            print('         >>>   Wait ', wait_time, ' seconds ', '  <<<     ')
-            # print('=============================================')
+            logger.info('The monkey is tired, getting more bananas. Wait %d seconds', wait_time)
             time_.sleep(wait_time)
         else:
             pass
 
     end_time = datetime.datetime.now()
     elapse_t = end_time - start_time
-    print('------------------------------')
-    print('>> Directory Upload Complete <<')
-    print('-> Total upload time: ' + str(elapse_t))
-    print('------------------------------')
+    logger.info('Directory upload complete. Total upload time: %s', elapse_t)
 
     return None
 
 
-def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib=True, spatial_profile=True):
+def addObservations(batch, obs_requests, multi_observation=False):
+    """
+    Adds InsertObservation requests to a Batch, either one by one or combined into a single request.
+    :param batch: instance of Batch class
+    :param obs_requests: list of InsertObservation bodies for the same node
+    :param multi_observation: when True, requests are combined into a single InsertObservation with a list of observations.
+    :return: None
+    """
+    if multi_observation is True:
+        if len(obs_requests) > 0:
+            batch.add_request(transactional.combineObservations(obs_requests))
+    else:
+        for r in obs_requests:
+            batch.add_request(r)
+    return None
+
+
+def _carryPending(batch, entry):
+    """
+    Moves the requests of a node which failed in a previous upload (see rollbackHistory) from its history entry to a
+    Batch, so they are sent again.
+    :param batch: instance of Batch class for the node
+    :param entry: history entry of the node
+    :return: None
+    """
+    for r in entry.pop('pending', []):
+        batch.add_request(r)
+        batch.carried.append(r)
+    return None
+
+
+def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib=True, spatial_profile=True,
+                       multi_observation=False, hist=None, registered=None, profiler=None, shard=None):
     """
     Parse a single JSON file and prepare SOS requests for registering sensors and observations.
 
@@ -233,14 +539,31 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
     :param hist_path: path to directory for history logs
     :param time_attrib: states if specific sensor type contains a time attribute or not. Default is True.
     :param spatial_profile: switches between the use of insertObservationSP (True) to insertObservation (False).
+    :param multi_observation: when True, all the attribute observations of a node are sent in a single InsertObservation request.
+    :param hist: history log to update. When None, the newest history file in 'hist_path' is used.
+    :param registered: nodes registered in the SOS, as returned by reconcile(). Nodes in it are not registered again.
+    :param profiler: profiling.Profiler recording the CPU profile and memory allocations of parsing. Optional.
+    :param shard: (index, count) to parse only the nodes of a shard (see sharding.nodeShard), e.g. in a worker owning
+     that part of the history (see workers.py). Default None parses all nodes.
     :return: a list of valid requests, and up-to-date history log
     """
-
-    print('=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/')
-    print('PROCESSING a single file: ', file_name)
-    print('----------------------------------------------------------')
-
-    jdata = loadData(directory, file_name)
+    if profiler is None:
+        profiler = profiling.NULL
+    elif profiler.enabled and profiler.depth == 0:  # profile the whole file
+        with profiler.file(file_name):
+            return requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib, spatial_profile,
+                                      multi_observation, hist, registered, profiler, shard)
+
+    logger.debug('Processing a single file: %s', file_name)
+    empty_values = 0  # attributes without value, reported once per file
+    unknown_count = 0  # registered nodes left out, their observation count is unknown
+
+    collector = metrics.active
+    profiler.mark('load')
+    with collector.stage('load'):
+        jdata = loadData(directory, file_name)
+        if shard is not None:  # the other nodes belong to other workers
+            jdata = [o for o in jdata if 'id' in o and sharding.nodeShard(o['id'], shard[1]) == shard[0]]
 
     # ------------------------------
     # Parsing Parameters:
@@ -249,10 +572,13 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
     type_sensor = wrapper.SensorType(sensor_type)
     sensor_attrib = type_sensor.pattern['attributes']
     # parsing history
-    hist = history(hist_path)
+    if hist is None:
+        hist = history(hist_path)
     # Remove invalid objects
     # print(type_sensor.pattern['name'])
-    clean_obj = cleanData(jdata, type_sensor.pattern['name'], time_attrib)
+    profiler.mark('clean')
+    with collector.stage('clean'):
+        clean_obj = cleanData(jdata, type_sensor.pattern['name'], time_attrib)
 
     #  Chose Insert Observation function:
     if spatial_profile is True:
@@ -266,9 +592,17 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
     else:
         insertsensor = transactional.insertSensor
 
+    profiler.mark('build')
+    build_start = time_.perf_counter()
     prepared_requests = []  # request collector
     for o in clean_obj:  # loop over each object in input file
         ide = o['id']
+        if ide not in hist and registered is not None and ide in registered:
+            if registered[ide] is None:  # new identifiers could clash with the ones in the SOS
+                unknown_count += 1
+                continue
+            # registered in the SOS but missing from the history; continue its observation count
+            hist[ide] = {"count": registered[ide], "times": []}
         if ide in hist:
             # if node was previously processed
             # fetch time:
@@ -283,6 +617,8 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                 tt = t.split()
                 time = tt[0] + 'T' + tt[1] + '+00:00'
                 body = wrapper.Batch(ide)  # initiate batch instance
+                _carryPending(body, hist[ide])
+                obs_requests = []  # insert observation requests for this node
 
                 for a in sensor_attrib:  # loop over each attribute
 
@@ -317,7 +653,8 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                         # change to float data type
                         if len(
                                 val_num) == 0:  # Node attribute had not data, or reported an empty (regarded as Null) value.
-                            print('Empty val_num for: ' + str(ide))
+                            empty_values += 1
+                            logger.debug('Empty value for %s in node %s', a[0], ide)
                             if om == "OM_Measurement":
                                 observation.Value = -9.99  # alternative 'null' value for 'float' types
                             elif om == "OM_CountObservation":
@@ -350,8 +687,9 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                         body_obs = insertobservation(observation, foi, offering, procedure, a[0])
                     else:
                         body_obs = insertobservation(observation, foi, offering, procedure, a[0])
-                    body.add_request(body_obs)  # collect insert observation request
+                    obs_requests.append(body_obs)  # collect insert observation request
 
+                addObservations(body, obs_requests, multi_observation)
                 prepared_requests.append(body)
 
                 # After insert observation (parsing) is successful
@@ -359,6 +697,11 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                 old_val = hist[ide]["count"]
                 hist[ide]["count"] = old_val + 1  # update counter
                 hist[ide]["times"].append(t)  # store new time
+                body.times.append(t)  # to undo the update if the SOS does not store the observations
+            elif len(hist[ide].get('pending', [])) > 0:  # no new data, but requests which failed before
+                body = wrapper.Batch(ide)
+                _carryPending(body, hist[ide])
+                prepared_requests.append(body)
             else:
                 continue
 
@@ -403,7 +746,7 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                 try:
                     coord = (float(o['longitude']), float(o['latitude']), -9.99)  # No data := -9.99
                 except TypeError:
-                    print(o)
+                    logger.warning('Invalid coordinates for node %s: %r, %r', ide, o['longitude'], o['latitude'])
 
                 # Feature of interest
                 foi = wrapper.FoI('degree', 'm', coord, ide)
@@ -414,6 +757,7 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
 
             # Prepare Insert Observation Requests:
             cuenta = 0
+            obs_requests = []
 
             for a in sensor_attrib:
                 # OM type
@@ -445,7 +789,8 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                     # change to float data type
                     # print("type of measurement:", om)
                     if len(val_num) == 0:
-                        print('Empty val_num for: ' + str(ide))
+                        empty_values += 1
+                        logger.debug('Empty value for %s in node %s', a[0], ide)
                         if om == "OM_Measurement":
                             observation.Value = -9.99  # alternative 'null' value for 'float' data type in Database
                         elif om == "OM_CountObservation":
@@ -484,14 +829,30 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
                         0])  # TODO: Fix, this will produce an error if a mobile sensor is declared
                 else:
                     body_obs = insertobservation(observation, foi, offering, procedure, a[0])
-                body.add_request(body_obs)  # add observation request
+                obs_requests.append(body_obs)  # add observation request
                 cuenta += 1
+            addObservations(body, obs_requests, multi_observation)
             prepared_requests.append(body)
 
             # After sensor and observation are successful
             # Update sensor history with new record
 
             hist[ide] = {"count": 1, "times": [t]}
+            body.new = True
+            body.times.append(t)
+
+    if collector.enabled or logger.isEnabledFor(logging.INFO):
+        new = sum(1 for b in prepared_requests if b.request_list and b.request_list[0]['request'] == 'InsertSensor')
+        if collector.enabled:
+            collector.observe('py4sos_stage_seconds', time_.perf_counter() - build_start, stage='build')
+            collector.inc('py4sos_nodes_total', new, kind='new')
+            collector.inc('py4sos_nodes_total', len(prepared_requests) - new, kind='updated')
+        logger.info('Parsed %s: %d objects, %d new nodes, %d updated nodes, %d empty values', file_name,
+                    len(clean_obj), new, len(prepared_requests) - new, empty_values)
+
+    if unknown_count > 0:
+        logger.warning('%d registered nodes with unknown observation count were left out of %s', unknown_count,
+                       file_name)
 
     # insert parsing history. TODO: Is this necessary?
     # hist["last parsed"] = {"runtime error": {}, "file name" : '', "run time": ''}
@@ -499,18 +860,82 @@ def requests_from_file(directory, file_name, sensor_type, hist_path, time_attrib
     return {"requests": prepared_requests, "history": hist, "file": file_name}
 
 
-def upload2sos(sos, request_collection, hist_path, threads=1):
+def requests_from_files(directory, file_names, sensor_type, hist_path, time_attrib=True, spatial_profile=True,
+                        registered=None, profiler=None, shard=None, hist=None):
+    """
+    Parse several JSON files (snapshots) and prepare a single Batch per node. All the pending observations of a node,
+    across all snapshots, are sent in a single InsertObservation request.
+    :param directory: path to the directory which contains the JSON files
+    :param file_names: list of JSON files containing sensor data. Files are parsed in the given order.
+    :param sensor_type: the type of sensors for which requests will be prepare (e.g., 'light', 'weather_station', etc.)
+    :param hist_path: path to directory for history logs
+    :param time_attrib: states if specific sensor type contains a time attribute or not. Default is True.
+    :param spatial_profile: switches between the use of insertObservationSP (True) to insertObservation (False).
+    :param registered: nodes registered in the SOS, as returned by reconcile(). Nodes in it are not registered again.
+    :param profiler: profiling.Profiler recording the CPU profile and memory allocations of parsing. Optional.
+    :param shard: (index, count) to parse only the nodes of a shard. See requests_from_file.
+    :param hist: history log to update. When None, the newest history file in 'hist_path' is used.
+    :return: a list of valid requests, and up-to-date history log
+    """
+    if profiler is not None and profiler.enabled and profiler.depth == 0:  # profile all files together
+        with profiler.file(', '.join(file_names)):
+            return requests_from_files(directory, file_names, sensor_type, hist_path, time_attrib, spatial_profile,
+                                       registered, profiler, shard, hist)
+    if hist is None:
+        hist = history(hist_path)
+    batches = {}  # Batch per node, in order of appearance
+    pending = {}  # insert observation requests per node
+    for f in file_names:
+        collection = requests_from_file(directory, f, sensor_type, hist_path, time_attrib, spatial_profile, hist=hist,
+                                        registered=registered, profiler=profiler, shard=shard)
+        for b in collection['requests']:
+            if b.id not in batches:
+                batches[b.id] = wrapper.Batch(b.id)
+                pending[b.id] = []
+            batches[b.id].new = batches[b.id].new or b.new
+            batches[b.id].times.extend(b.times)
+            batches[b.id].carried.extend(b.carried)
+            for r in b.request_list:
+                if r['request'] == 'InsertSensor' or any(r is c for c in b.carried):  # sent as they are
+                    batches[b.id].add_request(r)
+                else:
+                    pending[b.id].append(r)
+
+    prepared_requests = []
+    for ide, body in batches.items():
+        addObservations(body, pending[ide], multi_observation=True)
+        prepared_requests.append(body)
+
+    return {"requests": prepared_requests, "history": hist, "file": ', '.join(file_names)}
+
+
+def upload2sos(sos, request_collection, hist_path, threads=1, profiler=None, retries=2):
     """
-    Upload data to a SOS using HTTP POST requests
+    Upload data to a SOS using HTTP POST requests.
+    The response of each Batch is parsed: requests refused as duplicates count as stored, requests which failed for
+    transient reasons are sent again (only them), and the history log is rolled back for the nodes whose data the SOS did not store (see
+    rollbackHistory), so they are sent again with the next file.
     :param sos: Object describing an existing SOS
     :param request_collection: dictionary containing: HTTP requests, historic log, and name parsed file. Each request is an instance of Batch class
     :param hist_path: directory in which the history log files will be saved
-    :param threads: number of threads for multi-thread uploading. Default is 1 thread.
-    :return: None
+    :param threads: number of threads for multi-thread uploading. Default is 1 thread. Ignored for a ShardedSos,
+     which uses the concurrency of each shard.
+    :param profiler: profiling.Profiler of the file being uploaded. Optional.
+    :param retries: number of times failed requests are sent again. Default 2
+    :return: dictionary {"inserted": int, "duplicate": int, "failed": int, "spooled": int} with the number of requests
+     inserted, refused as duplicates, failed, and spooled, as recorded in the history log. For a ShardedSos, the outcome
+     of each shard is in "shards" (see sharding.upload2shards).
     """
+    if profiler is None:
+        profiler = profiling.NULL
+    profiler.mark('upload')
+    if isinstance(sos, sharding.ShardedSos):  # route requests to several SOS instances
+        return sharding.upload2shards(sos, request_collection, hist_path)
+
     #  TODO: currently it work for a single file (a list of Batch objects). Estend it to  deal with multiple files and including a 'sleep' time might not be of practical case.
     # If new requests were created
     err_log = {}  # initiate error log
+    accounting = {"inserted": 0, "duplicate": 0, "failed": 0, "spooled": 0}
     num_posts = len(request_collection['requests'])  # number of requests
     hist = request_collection['history']
     file_name = request_collection['file']
@@ -520,68 +945,325 @@ def upload2sos(sos, request_collection, hist_path, threads=1):
 
     if num_posts > 0:
         # send requests
-        print('-----------------------------')
-        print('UPLOADING DATA TO: ' + sos.sosurl)
-        print('SENDING ', str(num_posts), ' REQUESTS...', 'Using:', str(threads), 'threads')
-        print('WARNING: Uploading redundant data won"t be flagged', '...working to fix it...')
+        logger.info('Sending %d requests to %s using %d threads', num_posts, sos.sosurl, threads)
         # wrapper.sosPost(my_requests[count].reqs(), url, token, response=False)
         # my_requests.clear()
         # count += 1
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
-            future_to_req = {executor.submit(wrapper.sosPost, reques.reqs(), sos.sosurl, sos.token, True): reques for
-                             reques in re_quests}
-            for future in concurrent.futures.as_completed(future_to_req):
-                req = future_to_req[future]  # Batch instances
-                # print(future.result())
-                try:
-                    # TODO: server is not reporting errors when sending redundant data. Check sosPost as well.
-                    #     # print('hello')
-                    future.result()
-                # # future.result()
-                except Exception as exc:
-                    future.exception()
-                    err_log[str(datetime.datetime.now())] = [req.id, exc, req.body]
-                    print('%r generated an exception: %s Request: %s' % (req.id, exc, req.body))
+        with metrics.active.stage('upload'):
+            err_log, spooled, results = _postBatches(sos, re_quests, threads, retries)
+        accounting = _countOutcomes(results, spooled)
+        if len(spooled) > 0:
+            accounting['spool'] = spoolBatches(hist_path, spooled)
+            logger.warning('%d requests of %s were spooled to %s; it is the only copy of their data',
+                           accounting['spooled'], file_name, accounting['spool'])
+        rolled_back = rollbackHistory(hist, results)
+        logger.info('Uploaded %s: %d requests inserted, %d duplicates, %d failed. %d nodes rolled back in the history',
+                    file_name, accounting['inserted'], accounting['duplicate'], accounting['failed'], rolled_back)
 
         e_time = datetime.datetime.now()
 
         wait = e_time - start_time
         reqs_per_post = len(re_quests)  # an aproximation
         # print('Upload time: ', file_name, str(wait), )
-        print('SOS server load: ', str(round(reqs_per_post / wait.total_seconds(), 1)), 'Rps')
-        # print('Accumulated time: ', str(datetime.datetime.now() - start_time))
-        print('------------------------------')
+        logger.info('SOS server load: %.1f Rps', reqs_per_post / wait.total_seconds())
         request_collection.clear()
         # count += 1
 
         # update history log file:
-        updateHistory(hist_path, file_name, hist, err_log)
+        profiler.mark('history')
+        with metrics.active.stage('history'):
+            updateHistory(hist_path, file_name, hist, err_log, accounting)
 
     # report not new requests were send
     else:
-        print("*** No NEW sensors nor  NEW observations in file %r ***" % file_name)
+        logger.info('No new sensors nor new observations in file %r', file_name)
         # count += 1
 
     # Create  error log file if any error are reported during uploading
     if len(err_log) > 0:
-        # file name
-        efile = 'runtime-errors' + datetime.datetime.now().strftime("%Y-%m-%dT%H%M%S") + '.log'
-        ef = open(hist_path + efile, 'w')  # save to same directory as history log files
-        json.dump(err_log, ef)
-        ef.close()
+        writeErrorLog(hist_path, err_log)
 
     end_time = datetime.datetime.now()
     elapse_t = end_time - start_time
-    print('------------------------------')
-    print('File Upload Complete')
-    print('Upload time: ' + str(elapse_t))
-    print('------------------------------')
+    logger.info('File upload complete. Upload time: %s', elapse_t)
 
-    return None
+    return accounting
+
+
+def _postBatches(sos, batches, threads=1, retries=2, delay=1.0):
+    """
+    Sends Batch requests to a SOS using a pool of threads. Requests go through the circuit breaker of the SOS, if any.
+    The response of each Batch is parsed (see wrapper.batchOutcomes), and only its requests which failed for transient
+    reasons (errors of the server or the network) are sent again. Other failures are final at once. Requests holding
+    several observations are sent again one request per observation, so the observations already stored do not block
+    the others.
+    :param sos: Object describing an existing SOS
+    :param batches: list of Batch instances
+    :param threads: number of threads for multi-thread uploading. Default is 1 thread.
+    :param retries: number of times failed requests are sent again. Default 2
+    :param delay: seconds before the first retry; the delay doubles for every retry. Default 1
+    :return: error log, list of Batch instances refused while the circuit was open and spooling is enabled, and list of
+     (Batch, outcomes) with the outcome of each request of the Batches which were sent. When requests were split, the
+     Batch of a result is a copy holding the requests as they were last sent.
+    """
+    import concurrent.futures
+    import requests
+
+    if hasattr(sos, 'require_valid'):  # stop before sending anything to an invalid URL
+        sos.require_valid()
+    err_log = {}
+    spooled = []
+    results = []
+    refused = 0  # requests refused by an open circuit
+    circuit = getattr(sos, 'breaker', None)
+
+    def send(batch):
+        if circuit is not None:
+            return circuit.call(wrapper.sosPost, batch.reqs(), sos.sosurl, sos.token, True, sos.limiter, sos.session)
+        return wrapper.sosPost(batch.reqs(), sos.sosurl, sos.token, True, sos.limiter, sos.session)
+
+    def post(batch):
+        # sends a Batch, then its failed requests; returns the requests as last sent, the request of the Batch each one
+        # comes from, and the outcome of each one
+        sent = list(batch.request_list)
+        origins = list(batch.request_list)
+        outcomes = [None] * len(sent)
+        pending = list(range(len(outcomes)))  # requests to send, in their original order
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time_.sleep(delay * 2 ** (attempt - 1))
+                sent, origins, outcomes, pending = _splitPending(sent, origins, outcomes, pending)
+            part = wrapper.Batch(batch.id)
+            for k in pending:
+                part.add_request(sent[k])
+            try:
+                response = send(part)
+                try:
+                    answer = wrapper.batchOutcomes(part.reqs(), response.json())
+                except ValueError:  # no JSON body
+                    answer = [('inserted', None, False)] * len(pending)
+            except breaker.CircuitOpenError as exc:
+                if attempt == 0:
+                    raise  # nothing was sent; the Batch can be spooled
+                answer = [('failed', str(exc), True)] * len(pending)
+                pending = []  # do not wait for the circuit to close
+            except requests.RequestException as exc:  # no request of the Batch was stored
+                answer = [('failed', str(exc), breaker.isServerError(exc))] * len(pending)
+            for k, outcome in zip(pending, answer):
+                outcomes[k] = outcome
+            pending = [k for k in pending if outcomes[k][0] == 'failed' and outcomes[k][2]]
+            if len(pending) == 0:
+                break
+            logger.debug('%d of %d requests of %r failed (attempt %d)', len(pending), len(outcomes), batch.id,
+                         attempt + 1)
+        return sent, origins, outcomes
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        future_to_req = {executor.submit(post, reques): reques for reques in batches}
+        for future in concurrent.futures.as_completed(future_to_req):
+            req = future_to_req[future]  # Batch instances
+            try:
+                sent, origins, outcomes = future.result()
+                if len(sent) != len(req.request_list):  # requests were split
+                    req = _splitBatch(req, sent, origins)
+            except breaker.CircuitOpenError as exc:  # fail fast, server is not reached
+                refused += 1
+                if getattr(sos, 'spool', False):
+                    spooled.append(req)
+                else:
+                    err_log[str(datetime.datetime.now()) + ' ' + str(req.id)] = [req.id, str(exc)]
+                    results.append((req, [('failed', str(exc), True)] * len(req.request_list)))
+                continue
+            except Exception as exc:
+                logger.error('%r generated an exception: %s', req.id, exc)
+                outcomes = [('failed', str(exc), False)] * len(req.request_list)
+            results.append((req, outcomes))
+
+            failed = wrapper.Batch(req.id)
+            messages = []
+            for r, (outcome, message, transient) in zip(req.request_list, outcomes):
+                if outcome == 'failed':
+                    failed.add_request(r)
+                    if message not in messages:
+                        messages.append(message)
+            if len(messages) > 0:  # only the failed requests are logged
+                err_log[str(datetime.datetime.now()) + ' ' + str(req.id)] = [req.id, '; '.join(messages), failed.body]
+                logger.error('%d of %d requests of %r failed: %s', len(failed.request_list), len(outcomes), req.id,
+                             messages[0])
+                logger.debug('Failed requests of %r: %s', req.id, failed.body)
+
+    if refused > 0:
+        logger.warning('Circuit open: %d requests were not sent, %d were spooled', refused, len(spooled))
+
+    return err_log, spooled, results
+
+
+def _splitPending(sent, origins, outcomes, pending):
+    # replaces the pending requests holding several observations by one request per observation
+    if all(not isinstance(sent[k].get('observation'), list) for k in pending):
+        return sent, origins, outcomes, pending
+    split = ([], [], [], [])
+    for k, (r, origin, outcome) in enumerate(zip(sent, origins, outcomes)):
+        parts = transactional.splitObservations(r) if k in pending else [r]
+        for p in parts:
+            if k in pending:
+                split[3].append(len(split[0]))
+            split[0].append(p)
+            split[1].append(origin)
+            split[2].append(outcome)
+    return split
+
+
+def _splitBatch(batch, sent, origins):
+    # copy of a Batch holding its requests as they were sent; parts of carried requests are carried too
+    copy = wrapper.Batch(batch.id)
+    for r in sent:
+        copy.add_request(r)
+    copy.new = batch.new
+    copy.times = batch.times
+    copy.carried = [r for r, o in zip(sent, origins) if any(o is c for c in batch.carried)]
+    return copy
+
+
+def _countOutcomes(results, spooled=()):
+    """
+    Counts the requests inserted, refused as duplicates, failed, and spooled, and records them in the active metrics.
+    :param results: list of (Batch, outcomes), as returned by _postBatches
+    :param spooled: list of Batch instances written to a spool file. Optional.
+    :return: dictionary {"inserted": int, "duplicate": int, "failed": int, "spooled": int}
+    """
+    counts = {"inserted": 0, "duplicate": 0, "failed": 0, "spooled": 0}
+    for batch, outcomes in results:
+        for o in outcomes:
+            counts[o[0]] += 1
+    counts["spooled"] = sum(len(b.request_list) for b in spooled)
+    for outcome, n in counts.items():
+        if n > 0:
+            metrics.active.inc('py4sos_batch_requests_total', n, outcome=outcome)
+    return counts
+
+
+def rollbackHistory(hist, results):
+    """
+    Undoes the updates of the history log made while parsing, for the nodes whose data the SOS did not store, so their
+    data is sent again with the next file. A node whose sensor registration failed is removed from the log. For a node
+    whose new observations all failed, the snapshot times of the Batch are removed and its observation count is
+    restored. Requests refused as duplicates count as stored.
+    Other failed requests keep their observation identifiers, so they are recorded in the entry of the node: requests
+    which failed for transient reasons are kept in 'pending', and are sent again with the next Batch of the node (see
+    requests_from_file); the identifiers of the observations refused by the SOS are listed in 'missing'.
+    :param hist: history log, as updated by requests_from_file
+    :param results: list of (Batch, outcomes), as returned by _postBatches
+    :return: number of nodes rolled back
+    """
+    rolled_back = 0
+    for batch, outcomes in results:
+        entry = hist.get(batch.id)
+        if entry is None:
+            continue
+        sensor = [o[0] for r, o in zip(batch.request_list, outcomes) if r['request'] == 'InsertSensor']
+        if batch.new and sensor == ['failed']:
+            del hist[batch.id]
+            rolled_back += 1
+            continue
+        observations = [(r, o) for r, o in zip(batch.request_list, outcomes) if r['request'] != 'InsertSensor']
+        fresh = [o[0] for r, o in observations if not any(r is c for c in batch.carried)]
+        failed = [(r, o) for r, o in observations if o[0] == 'failed']
+        if len(fresh) > 0 and all(o == 'failed' for o in fresh) and len(batch.times) > 0:
+            for t in batch.times:
+                if t in entry['times']:
+                    entry['times'].remove(t)
+            entry['count'] = max(0, entry['count'] - len(batch.times))
+            rolled_back += 1
+            failed = [(r, o) for r, o in failed if any(r is c for c in batch.carried)]  # their identifiers are taken
+        for r, o in failed:
+            if o[2]:
+                entry.setdefault('pending', []).append(r)
+            else:
+                entry.setdefault('missing', []).extend(_observationIds(r))
+    return rolled_back
+
+
+def _observationIds(request):
+    # identifiers of the observations of an InsertObservation request
+    observations = request.get('observation', [])
+    if not isinstance(observations, list):
+        observations = [observations]
+    ids = []
+    for o in observations:
+        identifier = o.get('identifier')
+        ids.append(identifier.get('value') if isinstance(identifier, dict) else identifier)
+    return ids
+
+
+def spoolBatches(hist_path, batches, name='spool'):
+    """
+    Writes Batch requests which could not be sent to a spool file in the history directory.
+    The history log is not rolled back for these requests: their observation identifiers stay taken, and the spool
+    file is the only copy of their data until upload_spool sends it to the same SOS (or shard).
+    :param hist_path: directory in which the history log files are saved
+    :param batches: list of Batch instances
+    :param name: prefix of the spool file. Default 'spool'
+    :return: name of the spool file
+    """
+    sfile = name + '-' + datetime.datetime.now().strftime("%Y-%m-%dT%H%M%S%f") + '.json'
+    sf = open(hist_path + sfile, 'w')
+    json.dump([{"id": b.id, "body": b.reqs()} for b in batches], sf)
+    sf.close()
+    return sfile
+
+
+def upload_spool(sos, hist_path, threads=1, name='spool'):
+    """
+    Sends again the Batch requests stored in spool files, oldest first. Requests refused again are spooled to a new file.
+    :param sos: Object describing an existing SOS
+    :param hist_path: directory in which the history log and spool files are saved
+    :param threads: number of threads for multi-thread uploading. Default is 1 thread.
+    :param name: prefix of the spool files. Default 'spool'
+    :return: number of Batch requests sent
+    """
+    sent = 0
+    for sfile in sorted(glob.glob(hist_path + name + '-*.json')):
+        sf = open(sfile)
+        items = json.load(sf)
+        sf.close()
+        os.remove(sfile)
+
+        batches = []
+        for item in items:
+            batch = wrapper.Batch(item['id'])
+            for r in item['body']['requests']:
+                batch.add_request(r)
+            batches.append(batch)
+
+        logger.info('Resending %d spooled requests from %s', len(batches), sfile)
+        err_log, spooled, _ = _postBatches(sos, batches, threads)
+        sent += len(batches) - len(spooled)
+        if len(spooled) > 0:  # server is still failing
+            spoolBatches(hist_path, spooled, name)
+        if len(err_log) > 0:
+            writeErrorLog(hist_path, err_log)
+        if len(spooled) > 0:
+            break
+    return sent
+
+
+def writeErrorLog(hist_path, err_log):
+    """
+    Writes the errors reported during uploading to a new log file in the history directory.
+    :param hist_path: directory in which the history log files are saved
+    :param err_log: error reports. Formatted as JSON
+    :return: name of the log file
+    """
+    efile = 'runtime-errors' + datetime.datetime.now().strftime("%Y-%m-%dT%H%M%S") + '.log'
+    ef = open(hist_path + efile, 'w')  # save to same directory as history log files
+    json.dump(err_log, ef)
+    ef.close()
+    return efile
 
 
-def updateHistory(hist_path, file_name, latest_history_log, error_log):
+def updateHistory(hist_path, file_name, latest_history_log, error_log, accounting=None):
     """
     Updates the history log of requests sent to the SOS server. It writes a new file containing the latest changes to a local directory.
     If errors in he server occurred, an error log will be added to the history file
@@ -589,15 +1271,18 @@ def updateHistory(hist_path, file_name, latest_history_log, error_log):
     :param file_name: name of the source file which is uploading.
     :param latest_history_log: up to date history log, formatted as JSON
     :param error_log: error reports. Formatted as JSON
+    :param accounting: number of requests inserted, refused as duplicates, and failed. Optional.
     :return: new history log file formatted as JSON
     """
     hist = latest_history_log
     hist['last upload'] = {"name": file_name, "run time": str(datetime.datetime.now()), "runtime error": error_log}
+    if accounting is not None:
+        hist['last upload']['requests'] = accounting
     fname = 'hist-' + datetime.datetime.now().strftime("%Y-%m-%dT%H%M%S") + '.json'
     fn = open(hist_path + fname, 'w')  # create new history file
     json.dump(hist, fn)  # write to file
     fn.close()
-    print("History log file was updated!!")
+    logger.debug('History log file was updated: %s', fname)
     return None
 
 #  TODO: URI from waste sensors are not valid. They contain spaces and special characters. They have to be remove
@@ -0,0 +1,136 @@
+"""
+Upload of Batch requests to several SOS instances (shards).
+Each Batch is routed to a shard using a stable hash of its node (procedure) identifier, so all the requests of a node
+always reach the same SOS. Every shard keeps its own pool of connections, concurrency limit, rate limits and circuit breaker.
+"""
+
+import datetime
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def nodeShard(key, shards):
+    """
+    Finds the shard of a node or procedure identifier. The hash is stable across runs and processes.
+    :param key: node or procedure identifier
+    :param shards: number of shards
+    :return: index of the shard
+    """
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+
+class ShardedSos:
+    """
+    A group of SOS endpoints sharing the load of an ingest pipeline.
+    """
+
+    def __init__(self, endpoints, concurrency=4):
+        """
+        :param endpoints: list of Sos objects, one per SOS instance. The order of the list defines the routing;
+         it must not change between runs.
+        :param concurrency: number of threads uploading to each shard. An integer, or a list with a value per shard.
+        """
+        if len(endpoints) == 0:
+            raise ValueError('At least one SOS endpoint is required')
+        self.shards = list(endpoints)
+        if isinstance(concurrency, int):
+            concurrency = [concurrency] * len(self.shards)
+        if len(concurrency) != len(self.shards):
+            raise ValueError('The concurrency has to be given for each shard')
+        self.concurrency = list(concurrency)
+        for sos, threads in zip(self.shards, self.concurrency):  # a connection for each thread
+            if getattr(sos, 'pool_size', 0) < threads:
+                if hasattr(sos, 'set_pool_size'):
+                    sos.set_pool_size(threads)  # also resizes a session already in use
+                else:
+                    sos.pool_size = threads
+
+    @property
+    def sosurl(self):
+        # URLs of all shards, for reporting
+        return ', '.join(sos.sosurl for sos in self.shards)
+
+    def shard_index(self, key):
+        """
+        Finds the shard for a node or procedure identifier. The hash is stable across runs and processes.
+        :param key: node or procedure identifier
+        :return: index of the shard
+        """
+        return nodeShard(key, len(self.shards))
+
+    def route(self, batches):
+        """
+        Splits Batch requests by shard.
+        :param batches: list of Batch instances
+        :return: list with a list of Batch instances per shard
+        """
+        routed = [[] for _ in self.shards]
+        for b in batches:
+            routed[self.shard_index(b.id)].append(b)
+        return routed
+
+
+def upload2shards(sharded, request_collection, hist_path):
+    """
+    Upload data to several SOS instances. Shards are uploaded in parallel, each one with its own concurrency limit.
+    :param sharded: ShardedSos instance
+    :param request_collection: dictionary containing: HTTP requests, historic log, and name parsed file. Each request is an instance of Batch class
+    :param hist_path: directory in which the history log files will be saved
+    :return: number of requests inserted, refused as duplicates, failed and spooled (see santander.upload2sos), with the
+     outcome of each shard in "shards": {url: {"requests": int, "failed": int, "errors": int, "spooled": int,
+     "seconds": float, "rps": float}}. Requests are Batch requests, except "failed", which counts the requests within
+     them. The accounting is also recorded in the history log.
+    """
+    import concurrent.futures
+    from . import santander
+
+    hist = request_collection['history']
+    file_name = request_collection['file']
+    routed = sharded.route(request_collection['requests'])
+
+    def upload_shard(i):
+        sos = sharded.shards[i]
+        start = datetime.datetime.now()
+        err_log, spooled, results = santander._postBatches(sos, routed[i], sharded.concurrency[i])
+        if len(spooled) > 0:  # the only copy of their data; it is sent again to this same shard
+            spool_files.append(santander.spoolBatches(hist_path, spooled, 'shard' + str(i) + '-spool'))
+        elif getattr(sos, 'spool', False) and sos.breaker.state == 'closed':
+            santander.upload_spool(sos, hist_path, sharded.concurrency[i], 'shard' + str(i) + '-spool')
+        seconds = (datetime.datetime.now() - start).total_seconds()
+        failed = sum(1 for batch, outcomes in results for o in outcomes if o[0] == 'failed')
+        return err_log, results, spooled, {"requests": len(routed[i]), "failed": failed, "errors": len(err_log),
+                                           "spooled": len(spooled), "seconds": seconds,
+                                           "rps": round(len(routed[i]) / seconds, 1) if seconds > 0 else 0.0}
+
+    err_log = {}
+    results = []
+    spooled = []
+    spool_files = []
+    stats = {}
+    logger.info('Uploading data to %d shards', len(sharded.shards))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sharded.shards)) as executor:
+        for i, (errors, shard_results, shard_spooled, shard_stats) in enumerate(
+                executor.map(upload_shard, range(len(sharded.shards)))):
+            err_log.update(errors)
+            results += shard_results
+            spooled += shard_spooled
+            stats[sharded.shards[i].sosurl] = shard_stats
+            logger.info('Shard %d %s: %d requests, %d errors, %.1f Rps', i, sharded.shards[i].sosurl,
+                        shard_stats['requests'], shard_stats['errors'], shard_stats['rps'])
+            if shard_stats['failed'] > 0 or shard_stats['spooled'] > 0:
+                logger.warning('Shard %d %s: %d requests failed, %d Batch requests spooled', i,
+                               sharded.shards[i].sosurl, shard_stats['failed'], shard_stats['spooled'])
+
+    accounting = santander._countOutcomes(results, spooled)
+    if len(spool_files) > 0:
+        accounting['spool'] = ', '.join(sorted(spool_files))
+    accounting['shards'] = stats
+    santander.rollbackHistory(hist, results)
+    if len(request_collection['requests']) > 0:
+        santander.updateHistory(hist_path, file_name, hist, err_log, accounting)
+    if len(err_log) > 0:
+        santander.writeErrorLog(hist_path, err_log)
+
+    return accounting
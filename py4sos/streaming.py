@@ -0,0 +1,92 @@
+"""
+Incremental decoding of large SOS responses.
+Instead of loading and decoding the whole body of a response at once (e.g., response.json()), the elements of a JSON
+array (e.g., 'observations' in a GetObservation response) are decoded and yielded one at a time while the body is
+downloaded. Only the element being decoded and a small buffer are kept in memory.
+"""
+
+import codecs
+import json
+import re
+
+_whitespace = ' \t\n\r,'
+
+
+def iterArray(chunks, key='observations'):
+    """
+    Yields the elements of the first array with name 'key' in a JSON document, decoding them one at a time.
+    :param chunks: iterable over pieces of the JSON document, as strings
+    :param key: name of the array. Default 'observations'
+    :return: iterator over the decoded elements. Nothing is yielded when the document has no such array.
+    """
+    decoder = json.JSONDecoder()
+    pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+    chunks = iter(chunks)
+
+    # Locate the start of the array
+    buf = ''
+    while True:
+        match = pattern.search(buf)
+        if match is not None:
+            buf = buf[match.end():]
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        buf = buf[-(len(key) + 64):] + chunk  # key may be split between chunks
+
+    pos = 0
+    while True:
+        # skip separators
+        while pos < len(buf) and buf[pos] in _whitespace:
+            pos += 1
+        if pos >= len(buf):
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Unexpected end of the response while reading "' + key + '"')
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if buf[pos] == ']':  # end of the array
+            return
+
+        try:
+            element, end = decoder.raw_decode(buf, pos)
+            # a number may continue in the next chunk, so a separator must follow the element
+            complete = end < len(buf) and buf[end] in _whitespace + ']'
+        except json.JSONDecodeError:
+            complete = False
+        if not complete:
+            chunk = next(chunks, None)
+            if chunk is None:
+                element, end = decoder.raw_decode(buf, pos)  # raises when the element is truncated
+            else:
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+        yield element
+        pos = end
+        if pos > 65536:  # drop decoded text
+            buf, pos = buf[pos:], 0
+
+
+def iterObservations(response, key='observations', chunk_size=65536):
+    """
+    Yields the observations in the body of a SOS response, decoding them one at a time.
+    The request must have been sent with stream=True, so the body is not loaded into memory before reading.
+    :param response: requests.Response of a GetObservation or GetObservationById request
+    :param key: name of the array holding the observations. Default 'observations'
+    :param chunk_size: number of bytes read from the connection at once. Default 64 kB
+    :return: iterator over observations formatted as JSON
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+
+    def chunks():
+        for raw in response.iter_content(chunk_size=chunk_size):
+            yield decoder.decode(raw)
+        yield decoder.decode(b'', final=True)
+
+    try:
+        for element in iterArray(chunks(), key):
+            yield element
+    finally:
+        response.close()
@@ -0,0 +1,173 @@
+"""
+Incremental synchronisation of observations from a SOS.
+A watermark is kept for each series (procedure, observed property, feature of interest): the phenomenon time of the
+newest observation already retrieved. Each poll asks for the data availability of all series at once, skips series
+without new data, and fetches only the new observations, in parallel. Watermarks are stored in a JSON file, so a later
+run continues where the previous one stopped.
+
+Observations may reach the SOS late, with a phenomenon time older than the watermark. Each poll therefore requests the
+data from an overlap window before the watermark too, and leaves out the observations already retrieved (by their
+identifiers, which are kept for the observations in the window). When the SOS reports the number of observations of
+a series, a series whose count and period did not change is not requested. Late observations older than the overlap
+window are not retrieved.
+"""
+
+import datetime
+import json
+import os
+import threading
+from . import core
+from . import planner
+
+
+class SeriesSync:
+
+    def __init__(self, sos, series, path, offering=None, max_identifiers=100, threads=4,
+                 overlap=datetime.timedelta(hours=1)):
+        """
+        :param sos: Object describing an existing SOS with valid URL and token.
+        :param series: list of (procedure, property, feature of interest) tuples. See planner.cartesian().
+        :param path: path to the JSON file with the watermarks. It is created on the first poll.
+        :param offering: offering identifier as URI, or a list of them. Default None (any offering).
+        :param max_identifiers: maximum number of identifiers in a request. Default 100
+        :param threads: number of requests sent concurrently. Default 4
+        :param overlap: datetime.timedelta before the watermark which is requested again, to retrieve observations
+         arriving late. Default one hour. timedelta(0) retrieves only observations newer than the watermark.
+        """
+        self.sos = sos
+        self.series = list(dict.fromkeys(tuple(s) for s in series))
+        self.path = path
+        self.offering = offering
+        self.max_identifiers = max_identifiers
+        self.threads = threads
+        self.overlap = overlap
+        self.lock = threading.Lock()
+        self.watermarks = {}  # series: phenomenon time of the newest observation, datetime
+        self.seen = {}  # series: {identifier: phenomenon time} of the observations retrieved within the overlap
+        self.counts = {}  # series: number of observations reported by the SOS at the previous poll
+        self._load()
+
+    def watermark(self, series):
+        """
+        :param series: (procedure, property, feature of interest) tuple
+        :return: phenomenon time of the newest observation retrieved for the series, datetime. None before the first poll.
+        """
+        return self.watermarks.get(tuple(series))
+
+    def poll(self):
+        """
+        Retrieves the observations added to the SOS since the previous poll, and moves the watermarks forward.
+        :return: dictionary {series: list of new observations in time order}. Series without new data have an empty list.
+        """
+        availability = planner.getSeriesAvailability(self.sos, self.series, self.max_identifiers, threads=self.threads,
+                                                     count=True)
+
+        # series with new data, grouped by the interval to request
+        intervals = {}
+        counts = {}
+        for s in self.series:
+            records = availability.get(s, [])
+            periods = [(core.parseTime(a["phenomenonTime"][0]), core.parseTime(a["phenomenonTime"][1]))
+                       for a in records]
+            if len(periods) == 0:
+                continue
+            start, end = min(p[0] for p in periods), max(p[1] for p in periods)
+            if all("count" in a for a in records):
+                counts[s] = sum(a["count"] for a in records)
+            mark = self.watermark(s)
+            if mark is not None:
+                if end <= mark and (self.overlap <= datetime.timedelta(0) or
+                                    (s in counts and counts[s] == self.counts.get(s))):
+                    continue  # nothing newer, and no late observations (or they can not be detected)
+                if end < mark - self.overlap:
+                    continue
+                start = max(start, mark - self.overlap)
+            intervals.setdefault((start, end), []).append(s)
+
+        jobs = []
+        for interval, group in intervals.items():
+            for p in planner.planQueries(group, self.max_identifiers):
+                jobs.append((interval, p))
+
+        def fetch(job):
+            (start, end), p = job
+            response = core.getObservationByTime(self.sos, p["procedure"], self.offering, p["observedProperty"],
+                                                 p["featureOfInterest"], [start.isoformat(), end.isoformat()])
+            return planner.splitObservations(response.get("observations", []), p["series"])
+
+        results = {s: [] for s in self.series}
+        for split in core._orderedMap(fetch, jobs, self.threads):
+            for s, observations in split.items():
+                mark = self.watermark(s)
+                seen = self.seen.get(s)  # None for watermarks saved without identifiers
+                for o in observations:
+                    ide = core.observationId(o)
+                    if seen is not None and ide is not None and ide in seen:
+                        continue  # retrieved by a previous poll
+                    # observations at or before the watermark are late ones, told apart by their identifier
+                    if mark is None or core.observationTime(o) > mark or (seen is not None and ide is not None):
+                        results[s].append(o)
+
+        for s, observations in results.items():
+            if len(observations) > 0:
+                observations.sort(key=core.observationTime)
+                mark = core.observationTime(observations[-1])
+                if self.watermark(s) is not None:
+                    mark = max(mark, self.watermark(s))
+                seen = dict(self.seen.get(s) or {})
+                seen.update((core.observationId(o), core.observationTime(o)) for o in observations
+                            if core.observationId(o) is not None)
+                self.watermarks[s] = mark
+                self.seen[s] = {i: t for i, t in seen.items() if t >= mark - self.overlap}
+        self.counts.update(counts)
+        self.save()
+        return results
+
+    def reset(self, series=None):
+        """
+        Forgets watermarks, so the next poll retrieves all observations again.
+        :param series: list of series to reset. Default None (all series)
+        :return: None
+        """
+        for s in (self.series if series is None else series):
+            self.watermarks.pop(tuple(s), None)
+            self.seen.pop(tuple(s), None)
+            self.counts.pop(tuple(s), None)
+        self.save()
+        return None
+
+    def save(self):
+        """
+        Writes the watermarks to the JSON file. The file is replaced at once, so it is never left half written.
+        :return: None
+        """
+        content = []
+        for s, t in self.watermarks.items():
+            entry = {"series": list(s), "watermark": t.isoformat(), "count": self.counts.get(s)}
+            if s in self.seen:
+                entry["seen"] = {i: v.isoformat() for i, v in self.seen[s].items()}
+            content.append(entry)
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp = self.path + '.' + str(threading.get_ident()) + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(content, f, indent=1)
+            os.replace(tmp, self.path)
+        return None
+
+    def _load(self):
+        # reads the watermarks, the identifiers within the overlap, and the counts from the JSON file
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            return None
+        for e in content:
+            s = tuple(e["series"])
+            self.watermarks[s] = core.parseTime(e["watermark"])
+            if "seen" in e:
+                self.seen[s] = {i: core.parseTime(v) for i, v in e["seen"].items()}
+            if e.get("count") is not None:
+                self.counts[s] = e["count"]
+        return None
@@ -375,6 +375,54 @@ def insertObservationSP(observation, foi, to_offering, with_procedure, observed_
     return body
 
 
+def combineObservations(bodies):
+    '''
+    Merges several InsertObservation bodies into a single InsertObservation request holding a list of observations.
+    All bodies must publish to the same offering. Bodies which already hold a list of observations are flattened.
+    :param bodies: list of InsertObservation bodies, as returned by insertObservation or insertObservationSP
+    :return: body for a single insert observation request in JSON, or None when 'bodies' is empty
+    '''
+    if len(bodies) == 0:
+        return None
+
+    offering = bodies[0]["offering"]
+    observations = []
+    for b in bodies:
+        if b["offering"] != offering:
+            raise ValueError('Observations for different offerings can not be combined: ' + str(b["offering"]))
+        if isinstance(b["observation"], list):  # already combined
+            observations.extend(b["observation"])
+        else:
+            observations.append(b["observation"])
+
+    body = {
+        "request": "InsertObservation",
+        "service": "SOS",
+        "version": "2.0.0",
+        "offering": offering,
+        "observation": observations  # list of observations
+    }
+    return body
+
+
+def splitObservations(body):
+    '''
+    Splits an InsertObservation request holding a list of observations (see combineObservations) into one request per
+    observation.
+    :param body: InsertObservation body
+    :return: list of InsertObservation bodies, each with a single observation. A body with a single observation is
+     returned as it is.
+    '''
+    if not isinstance(body.get("observation"), list):
+        return [body]
+    bodies = []
+    for o in body["observation"]:
+        single = dict(body)
+        single["observation"] = o
+        bodies.append(single)
+    return bodies
+
+
 def insertMobileSensor(offering, procedure,  foi, sensor_type):
     """
     Prepares the body of a InsertSensor request to register a mobile sensor. Based on SensorML 2.0.
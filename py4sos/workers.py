@@ -0,0 +1,212 @@
+"""
+Parallel ingestion with node-partitioned workers.
+Nodes are partitioned into shards by a stable hash of their identifier (see sharding.nodeShard), and each shard is
+processed by its own worker process: it reads every snapshot, keeps only the nodes of its shard, and parses and uploads
+them. A worker owns the history of its nodes, kept in its own directory:
+
+    <history_path>/shard-<k>-of-<N>/hist-*.json
+
+so the observation identifiers (node_attribute_count) stay deterministic and workers share no state. The coordinator
+only merges the metrics and summaries sent back by the workers. The number of shards is part of the history layout and
+can not change between runs; the history of a single process pipeline is split into shards on the first run.
+
+Decoding a snapshot is the only work repeated by every worker; cleaning, building request bodies and uploading are
+split among them. Rate limits and circuit breakers of the SOS are set up again in each worker; the rate budget of a SOS
+shared by all workers is split evenly among them. Workers are started with the 'spawn' method: scripts using them need the usual
+`if __name__ == '__main__':` guard.
+"""
+
+import glob
+import logging
+import os
+import re
+import time as time_
+
+from . import archive
+from . import metrics
+from . import santander
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+
+def shardDirectory(history_path, index, count):
+    """
+    :param history_path: directory of the history logs
+    :param index: index of the shard
+    :param count: number of shards
+    :return: directory of the history of a shard, ending with a separator
+    """
+    return os.path.join(history_path, 'shard-%d-of-%d' % (index, count)) + os.sep
+
+
+def shardCount(history_path):
+    """
+    :param history_path: directory of the history logs
+    :return: number of shards of the history, or None when it is not sharded
+    """
+    counts = set()
+    for path in glob.glob(os.path.join(history_path, 'shard-*-of-*')):
+        match = re.match(r'shard-\d+-of-(\d+)$', os.path.basename(path))
+        if match is not None and os.path.isdir(path):
+            counts.add(int(match.group(1)))
+    if len(counts) > 1:
+        raise ValueError('History with several shard layouts: ' + history_path)
+    return counts.pop() if len(counts) == 1 else None
+
+
+def splitHistory(history_path, count):
+    """
+    Splits the history log of a single process pipeline (the newest history file in 'history_path') into a history per
+    shard.
+    :param history_path: directory of the history logs
+    :param count: number of shards
+    :return: list with the number of nodes of each shard
+    """
+    hist = santander.history(history_path)
+    parts = [{} for _ in range(count)]
+    for ide, entry in hist.items():
+        if ide != 'last upload':
+            parts[sharding.nodeShard(ide, count)][ide] = entry
+    sizes = [len(p) for p in parts]
+    for k, part in enumerate(parts):
+        path = shardDirectory(history_path, k, count)
+        os.makedirs(path, exist_ok=True)
+        santander.updateHistory(path, 'split of ' + history_path, part, {})
+    logger.info('History in %s split into %d shards: %s nodes', history_path, count, sizes)
+    return sizes
+
+
+def ingestDirectory(sos, directory, sensor_type, history_path, workers=None, threads=1, time_attribute=True,
+                    spatial_profile=True, multi_observation=False, snapshots_per_request=1, retries=2):
+    """
+    Parses all snapshots in a directory (see archive.listSnapshots) and uploads them to a SOS, with a worker process per
+    shard of nodes. Options are those of upload_directory2sos.
+    :param sos: Object describing an existing SOS, or a ShardedSos with a SOS instance per worker (worker k uploads to
+     shard k, which receives the same nodes). Each worker opens its own connections, and applies the rate limits (its
+     share of them, when all workers upload to the same SOS) and a circuit breaker with the settings of 'sos'. Spool
+     files are written to the history directory of each shard. Caches of 'sos' are not used.
+    :param directory: path to the directory with the snapshots
+    :param sensor_type: the type of sensors for which requests will be prepare (e.g., 'light', 'weather_station', etc.)
+    :param history_path: path to directory for history logs
+    :param workers: number of worker processes (shards). Default None: the number of shards of the history, or the
+     number of CPUs for a history which is not sharded yet. It can not change between runs using the same history.
+    :param threads: number of upload threads of each worker. Default 1
+    :param time_attribute: states if specific sensor type contains a time attribute or not. Default is True.
+    :param spatial_profile: switches between the use of insertObservationSP (True) to insertObservation (False).
+    :param multi_observation: when True, all the attribute observations of a node are sent in a single InsertObservation request.
+    :param snapshots_per_request: number of files parsed together. Default 1
+    :param retries: number of times failed requests are sent again. Default 2
+    :return: dictionary {"seconds": float, "shards": [...], "metrics": {...}} with the wall time, a summary per shard
+     (files, nodes, seconds, or error), and the metrics of all workers. The metrics are also added to the active
+     collector, if any.
+    """
+    import concurrent.futures
+    import multiprocessing
+
+    existing = shardCount(history_path)
+    count = workers if workers is not None else (existing or os.cpu_count() or 1)
+    if existing is None:
+        if len(glob.glob(os.path.join(history_path, 'hist-*.json'))) > 0:
+            splitHistory(history_path, count)
+    elif existing != count:
+        raise ValueError('The history in ' + history_path + ' has ' + str(existing) + ' shards; use ' + str(existing) +
+                         ' workers')
+    if isinstance(sos, sharding.ShardedSos):
+        if len(sos.shards) != count:
+            raise ValueError('A ShardedSos needs a worker per shard: ' + str(len(sos.shards)) + ' shards')
+        endpoints = [(s.sosurl, s.token, c, _clientSettings(s)) for s, c in zip(sos.shards, sos.concurrency)]
+    else:  # all workers upload to the same SOS
+        endpoints = [(sos.sosurl, sos.token, max(threads, getattr(sos, 'pool_size', 1)),
+                      _clientSettings(sos, count))] * count
+
+    names = archive.listSnapshots(directory)
+    options = {"threads": threads, "time_attribute": time_attribute, "spatial_profile": spatial_profile,
+               "multi_observation": multi_observation, "snapshots_per_request": snapshots_per_request,
+               "retries": retries}
+    logger.info('Processing %d files in %s with %d workers', len(names), directory, count)
+
+    merged = metrics.Metrics()
+    shards = []
+    start = time_.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=count, mp_context=context) as executor:
+        futures = {executor.submit(_runShard, k, count, endpoints[k], directory, names, sensor_type, history_path,
+                                   options): k for k in range(count)}
+        for future in concurrent.futures.as_completed(futures):
+            k = futures[future]
+            try:
+                summary = future.result()
+            except Exception as exc:
+                logger.error('Worker of shard %d failed: %s', k, exc)
+                shards.append({"shard": k, "error": str(exc)})
+                continue
+            merged.merge(summary.pop("metrics"))
+            shards.append(summary)
+            logger.info('Shard %d: %d files, %d nodes in %.1f s', k, summary["files"], summary["nodes"],
+                        summary["seconds"])
+
+    snapshot = merged.snapshot()
+    metrics.active.merge(snapshot)
+    return {"seconds": time_.perf_counter() - start, "shards": sorted(shards, key=lambda s: s["shard"]),
+            "metrics": snapshot}
+
+
+def _clientSettings(sos, share=1):
+    """
+    Settings of the rate limits and circuit breaker of a SOS, to set them up again in a worker process.
+    :param sos: Object describing an existing SOS
+    :param share: number of workers uploading to the SOS; each one gets an even share of the rate budget. Default 1
+    :return: dictionary {"rate_limit": {...}, "circuit_breaker": {...}} with the arguments of Sos.set_rate_limit and
+     Sos.set_circuit_breaker. Missing keys for a SOS without limits or breaker.
+    """
+    settings = {}
+    limiter = getattr(sos, 'limiter', None)
+    if limiter is not None and len(limiter.buckets) > 0:
+        buckets = limiter.buckets
+        rates = {kind: b.rate / share for kind, b in buckets.items()}
+        if all(b.capacity == max(1.0, b.rate) for b in buckets.values()):
+            burst = None  # default burst, the rate itself
+        else:
+            burst = max(1.0, min(b.capacity for b in buckets.values()) / share)
+        settings["rate_limit"] = {"transactional": rates.get('transactional'), "read": rates.get('read'),
+                                  "burst": burst}
+    circuit = getattr(sos, 'breaker', None)
+    if circuit is not None:
+        settings["circuit_breaker"] = {"error_rate": circuit.error_rate, "window": circuit.outcomes.maxlen,
+                                       "min_calls": circuit.min_calls, "reset_timeout": circuit.reset_timeout,
+                                       "spool": getattr(sos, 'spool', False)}
+    return settings
+
+
+def _runShard(index, count, endpoint, directory, names, sensor_type, history_path, options):
+    # worker process: parses and uploads the nodes of a shard. Returns its summary and metrics.
+    collector = metrics.enable()  # metrics of this worker only
+    url, token, pool_size, settings = endpoint
+    sos = santander.Sos(url, token, validate=False, pool_size=pool_size)
+    if "rate_limit" in settings:
+        sos.set_rate_limit(**settings["rate_limit"])
+    if "circuit_breaker" in settings:
+        sos.set_circuit_breaker(**settings["circuit_breaker"])
+    path = shardDirectory(history_path, index, count)
+    os.makedirs(path, exist_ok=True)
+    hist = santander.history(path)
+    shard = (index, count)
+
+    start = time_.perf_counter()
+    step = options["snapshots_per_request"]
+    for i in range(0, len(names), step):
+        group = names[i:i + step]
+        if len(group) == 1:
+            collection = santander.requests_from_file(directory, group[0], sensor_type, path,
+                                                      options["time_attribute"], options["spatial_profile"],
+                                                      options["multi_observation"], hist=hist, shard=shard)
+        else:
+            collection = santander.requests_from_files(directory, group, sensor_type, path, options["time_attribute"],
+                                                       options["spatial_profile"], shard=shard, hist=hist)
+        santander.upload2sos(sos, collection, path, options["threads"], retries=options["retries"])
+        if getattr(sos, 'spool', False) and sos.breaker.state == 'closed':  # the server has recovered
+            santander.upload_spool(sos, path, options["threads"])
+
+    return {"shard": index, "files": len(names), "nodes": sum(1 for ide in hist if ide != 'last upload'),
+            "seconds": time_.perf_counter() - start, "metrics": collector.snapshot()}
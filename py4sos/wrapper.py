@@ -5,7 +5,12 @@ For documentation of 52North SOS visit: https://wiki.52north.org/bin/view/Sensor
  Created: 23-05-2017
 """
 
-import requests
+# 'requests' is imported when a request is sent, building request bodies does not need it.
+import logging
+import re
+from . import metrics
+
+logger = logging.getLogger(__name__)
 
 
 # OM Measurement types:
@@ -119,7 +124,7 @@ class SensorType:
         elif type_ == 'air': # AIR, Not currently reporting
             self.pattern = {"name": "air", "type": "fixed"}
         else:
-            print("Sensor type is not defined")
+            logger.warning('Sensor type is not defined: %s', type_)
 
 class Batch:
     # Container for prepared request for a SOS
@@ -127,41 +132,99 @@ class Batch:
         self.id = id_
         self.request_list = []
         self.body = {"service": "SOS", "version": "2.0.0", "request": "Batch",  "requests": self.request_list} # "stopAtFailure": True,
+        self.new = False  # the Batch registers its sensor (InsertSensor)
+        self.times = []  # snapshot times added to the history log for this Batch
+        self.carried = []  # requests which failed in a previous upload, sent again with this Batch
     def add_request(self, request):
         self.request_list.append(request)
     def reqs(self):  # output for
         return self.body
 
 
-def sosPost(body, url, token, response=False):
+def sosPost(body, url, token, response=False, limiter=None, session=None):
     '''
     Sends a transaction request to a SOS using POST
     :param body: JSON formatted data describing an observation, its properties and values. See <obs_example.json>
     :param token: Authorization Token from the server side.
     :param url: URL to the endpoint where the SOS with transactional capabilites is listening.
-    :param response: If True, it prints the full response received from the server.
+    :param response: If True, the full response received from the server is logged (DEBUG level).
+    :param limiter: RateLimiter for the SOS endpoint. The request waits for the 'transactional' budget. Optional.
+    :param session: requests.Session keeping a pool of connections to the SOS. Optional.
+    :return: Server response. HTTP errors are raised. A Batch is answered with status 200 even when some of its
+     requests fail; see batchOutcomes.
     '''
 
+    import requests
+
+    if limiter is not None:
+        limiter.acquire('transactional')
+
     # Add headers:
     headers = {'Authorization': str(token), 'Accept': 'application/json'}
 
-    query = requests.post(url, headers=headers, json=body) # json=body)
+    query = metrics.timedRequest(body.get('request'), (session or requests).post, url, headers=headers, json=body)
 
-    # print(query.json())
-    # print(query.status_code)
-    # TODO: when redundant data is passed, function report status code 200.
+    if response is True:
+        logger.debug('Response of the SOS (status code %d): %s', query.status_code, query.text)
     if query.status_code != 200:
 
         # report SOS errors:
         if 'exceptions' in query.json():
-            print('Exception at SOS:')
-            print('Server Status Code: ' + str(query.status_code))
-            print('REPORT@sosPost(): ')
             for i in query.json()['exceptions']:
-                print(i)
+                logger.error('Exception at SOS (status code %d): %s', query.status_code, i)
 
         # for any HTTP error:
-    return query.raise_for_status()
+    query.raise_for_status()
+    return query
+
+
+# Exception texts of the SOS for sensors and observations which are already stored
+_duplicate = re.compile(r'already (contained|exists|inserted)|still exists|duplicate', re.IGNORECASE)
+
+# Exception codes of the SOS for failures which may not happen again (e.g., errors of the server or its database).
+# Other codes (InvalidParameterValue, MissingParameterValue, ...) report problems of the request itself.
+transient_codes = ('NoApplicableCode',)
+
+
+def batchOutcomes(body, response):
+    '''
+    Classifies the requests of a Batch from the response of the SOS, which holds a result per request: either the
+    response of the operation, or an exception report. Each request is 'inserted', 'duplicate' (the sensor or
+    observation was already stored), or 'failed'. A failure is transient when its exception codes are all in
+    'transient_codes', or when the request got no result; only transient failures are worth sending again.
+    An InsertObservation holding several observations (see transactional.combineObservations) is refused as a whole
+    when one of them is stored already, so it is a transient failure instead: the others may be new, and are stored
+    once the request is split (see transactional.splitObservations).
+    :param body: body of the Batch request
+    :param response: Batch response formatted as JSON
+    :return: list with a tuple (outcome, message, transient) per request of the Batch. Message is None for inserted
+     requests; transient is False for requests which did not fail.
+    '''
+    size = len(body['requests'])
+    responses = response.get('responses') if isinstance(response, dict) else None
+    if responses is None:  # no results per request: the Batch was accepted as a whole
+        return [('inserted', None, False)] * size
+
+    outcomes = []
+    for request, r in zip(body['requests'], responses):
+        exceptions = r.get('exceptions', r.get('exception')) if isinstance(r, dict) else None
+        if exceptions is None:
+            outcomes.append(('inserted', None, False))
+            continue
+        if not isinstance(exceptions, list):
+            exceptions = [exceptions]
+        text = '; '.join(str(e.get('text', e)) if isinstance(e, dict) else str(e) for e in exceptions)
+        if _duplicate.search(text):
+            if isinstance(request.get('observation'), list) and len(request['observation']) > 1:
+                outcomes.append(('failed', text, True))
+            else:
+                outcomes.append(('duplicate', text, False))
+            continue
+        codes = [e.get('code') for e in exceptions if isinstance(e, dict)]
+        outcomes.append(('failed', text, len(codes) > 0 and all(c in transient_codes for c in codes)))
+    # e.g., the Batch stopped at a failure
+    outcomes += [('failed', 'No result from the SOS', True)] * (size - len(outcomes))
+    return outcomes
 
 
 def sosSoapPost(body, url, token, response=False):  # TODO: To be completed and debug
@@ -173,6 +236,8 @@ def sosSoapPost(body, url, token, response=False):  # TODO: To be completed and
     :param response: If True, it prints the full response received from the server.
     '''
 
+    import requests
+
     # Add headers:
     headers = {'Authorization': str(token), 'Content-Type': 'application/soap+xml'}
 
@@ -10,6 +10,7 @@ setup(name='py4sos',
       license='Apache License 2.0',
       packages=['py4sos'],
       install_requires=['requests'],
+      extras_require={'columnar': ['numpy'], 'zstd': ['zstandard']},
       classifiers=["Programming Language :: Python","Programming Language :: Python :: 3", "License :: Free for non-commercial use", "Operating System :: Windows", "Development Status :: 2 - Pre-Alpha", "Intended Audience :: Developers","Topic :: Internet :: WWW/HTTP :: HTTP Servers", "Topic :: Internet :: WWW/HTTP :: WSGI :: Middleware", "Intended Audience :: Telecommunications Industry", "Topic :: Software Development :: Pre-processors", "Environment :: Web Environment"],
       long_description = """\
       Python API for a Service Observation Service (SOS)
@@ -19,7 +20,7 @@ setup(name='py4sos',
 
       Core Operations:
         - getCapabilities, getDataAvailability
-        - getObservationByID, getObservationByTime
+        - getObservationByID, getObservationByTime, getObservationByBBox
         
       Transactional Operations:
         - insertSensor, insertObservation, insertObservationSP
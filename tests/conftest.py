@@ -0,0 +1,18 @@
+import pytest
+
+from .context import loadStub
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'loaded(nodes=3, files=2, seed=0): size of the data uploaded to the loaded stub')
+
+
+@pytest.fixture
+def loaded(request, tmp_path):
+    # (stub SOS, Sos instance) with snapshots of light sensors uploaded by the ingest pipeline; see context.loadStub
+    from benchmarks import stubsos
+
+    marker = request.node.get_closest_marker('loaded')
+    options = marker.kwargs if marker is not None else {}
+    with stubsos.StubSos() as stub:
+        yield stub, loadStub(stub, str(tmp_path), **options)
@@ -3,3 +3,27 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import py4sos
+
+# interval covering the snapshots written by benchmarks.generators
+interval = ['2016-07-01T00:00:00+00:00', '2016-07-02T00:00:00+00:00']
+
+
+def loadStub(stub, directory, nodes=3, files=2, seed=0):
+    """
+    Writes snapshots of light sensors and uploads them to a stub SOS with the ingest pipeline.
+    :param stub: benchmarks.stubsos.StubSos instance, started
+    :param directory: empty directory for the snapshots and the history logs
+    :return: Sos instance pointing to the stub
+    """
+    from benchmarks import generators
+
+    data, hist_path = os.path.join(directory, 'data') + os.sep, os.path.join(directory, 'hist') + os.sep
+    os.makedirs(hist_path, exist_ok=True)
+    generators.writeSnapshots(data, 'light', nodes, files, seed)
+    sos = py4sos.santander.Sos(stub.url)
+    cwd = os.getcwd()  # santander.history() changes the working directory
+    try:
+        py4sos.santander.upload_directory2sos(sos, data, 'light', hist_path)
+    finally:
+        os.chdir(cwd)
+    return sos
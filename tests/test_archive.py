@@ -0,0 +1,116 @@
+# Reading of compressed snapshots and tar bundles in place
+
+import gzip
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from .context import py4sos
+from py4sos import archive
+
+
+def content(k):
+    return json.dumps([{"id": 'node_%d' % k, "Last update": '2016-07-01 08:%02d:07' % k}]).encode('utf-8')
+
+
+def bundle(path, members, mode):
+    with tarfile.open(path, mode) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    # directory with a snapshot in each format; returns (directory, {name: content})
+    directory = str(tmp_path) + os.sep
+    expected = {'a.json': content(0), 'b.json.gz': content(1)}
+    with open(directory + 'a.json', 'wb') as f:
+        f.write(expected['a.json'])
+    with gzip.open(directory + 'b.json.gz', 'wb') as f:
+        f.write(expected['b.json.gz'])
+    for bundle_name, mode, first in (('c.tar', 'w', 2), ('d.tar.gz', 'w:gz', 5)):
+        members = [('s%d.json' % k, content(k)) for k in (first + 1, first)] + [('readme.txt', b'not a snapshot')]
+        bundle(directory + bundle_name, members, mode)
+        expected.update((bundle_name + '/' + name, data) for name, data in members if name.endswith('.json'))
+    with open(directory + 'notes.txt', 'w') as f:
+        f.write('left out')
+    return directory, expected
+
+
+def test_list_snapshots(snapshots):
+    directory, expected = snapshots
+    assert archive.listSnapshots(directory) == ['a.json', 'b.json.gz', 'c.tar/s3.json', 'c.tar/s2.json',
+                                                'd.tar.gz/s6.json', 'd.tar.gz/s5.json']  # members in bundle order
+
+
+def test_read_snapshots(snapshots):
+    directory, expected = snapshots
+    names = archive.listSnapshots(directory)
+    for name in names + names[::-1]:  # compressed bundles read backwards too
+        assert archive.readSnapshot(directory, name) == expected[name]
+    with pytest.raises(KeyError):
+        archive.readSnapshot(directory, 'd.tar.gz/missing.json')
+    with pytest.raises(KeyError):
+        archive.readSnapshot(directory, 'c.tar/missing.json')
+
+
+def test_tar_index_follows_changes(snapshots):
+    directory, expected = snapshots
+    assert archive.readSnapshot(directory, 'c.tar/s2.json') == expected['c.tar/s2.json']
+    bundle(directory + 'c.tar', [('s2.json', b'[]' + b' ' * 100)], 'w')
+    os.utime(directory + 'c.tar', (1, 1))  # modification time changes even within the same second
+    assert archive.readSnapshot(directory, 'c.tar/s2.json').strip() == b'[]'
+
+
+def test_split_name_and_empty_file(tmp_path):
+    assert archive.splitName('x.tar.gz/y/z.json') == ('x.tar.gz', 'y/z.json')
+    assert archive.splitName('data_stream.json') == (None, 'data_stream.json')
+    open(str(tmp_path / 'empty.json'), 'wb').close()
+    assert archive.readSnapshot(str(tmp_path) + os.sep, 'empty.json') == b''
+
+
+def test_zstandard(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    directory = str(tmp_path) + os.sep
+    with open(directory + 'a.json.zst', 'wb') as f:
+        f.write(zstandard.ZstdCompressor().compress(content(0)))
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode='w') as tar:
+        info = tarfile.TarInfo('s1.json')
+        info.size = len(content(1))
+        tar.addfile(info, io.BytesIO(content(1)))
+    with open(directory + 'b.tar.zst', 'wb') as f:
+        f.write(zstandard.ZstdCompressor().compress(raw.getvalue()))
+    assert archive.listSnapshots(directory) == ['a.json.zst', 'b.tar.zst/s1.json']
+    assert archive.readSnapshot(directory, 'a.json.zst') == content(0)
+    assert archive.readSnapshot(directory, 'b.tar.zst/s1.json') == content(1)
+
+
+def test_pipeline_reads_bundles(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    plain = str(tmp_path / 'plain') + os.sep
+    names = generators.writeSnapshots(plain, 'light', 3, 3, seed=0)
+    bundled = str(tmp_path / 'bundled') + os.sep
+    os.makedirs(bundled)
+    with open(plain + names[0], 'rb') as f, gzip.open(bundled + names[0] + '.gz', 'wb') as g:
+        g.write(f.read())
+    with tarfile.open(bundled + 'rest.tar.gz', 'w:gz') as tar:
+        for name in names[1:]:
+            tar.add(plain + name, arcname=name)
+
+    stored = []
+    for directory in (plain, bundled):
+        hist_path = directory + 'hist' + os.sep
+        os.makedirs(hist_path)
+        with stubsos.StubSos() as stub:
+            py4sos.santander.upload_directory2sos(py4sos.santander.Sos(stub.url), directory, 'light', hist_path)
+            stored.append(sorted(stub.observations))
+    assert len(stored[0]) > 0
+    assert stored[0] == stored[1]
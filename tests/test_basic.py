@@ -1,5 +1,66 @@
 # Import required modules
 
+import os
+import subprocess
+import sys
+
+import pytest
+
 from .context import py4sos
+from py4sos import santander
+
+
+def test_submodules_are_loaded_on_access():
+    assert set(py4sos.__all__) <= set(dir(py4sos))
+    assert py4sos.transactional is sys.modules['py4sos.transactional']
+    with pytest.raises(AttributeError):
+        py4sos.missing
+    code = 'import sys, py4sos; py4sos.transactional; print("requests" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(py4sos.__file__)))
+    assert out.stdout.strip() == 'False'  # request bodies do not need the HTTP stack
+
+
+def test_url_is_validated_before_the_first_request():
+    from benchmarks import stubsos
+
+    sos = santander.Sos('localhost/sos')  # no scheme: the URL can not be requested
+    assert sos.valid is None  # lazy: nothing is sent at creation
+    with pytest.raises(ValueError):
+        sos.require_valid()
+    assert sos.valid is False
+    assert santander.Sos('localhost/sos', validate=False).require_valid() is None
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url, validate=True)
+        assert sos.valid is True
+        assert sos.require_valid() is None
+
+
+def test_unreachable_sos_is_tested_again():
+    from benchmarks import stubsos
+
+    with stubsos.StubSos() as stub:
+        url = stub.url
+    sos = santander.Sos(url)  # the server is down at first use
+    assert sos.require_valid() is None
+    assert sos.valid is None and sos.pending_check
+    with stubsos.StubSos() as stub:
+        sos.sosurl = stub.url  # the server is back
+        sos.require_valid()
+        assert sos.valid is True and not sos.pending_check
+
+
+def test_http_errors_are_only_reported(caplog):
+    import requests
+
+    class Session:
+        def get(self, url):
+            response = requests.Response()
+            response.status_code, response.url = 404, url
+            return response
 
-# TODO: some test need to be added
+    sos = santander.Sos('http://localhost/sos')
+    sos._session = Session()
+    assert sos.require_valid() is None
+    assert sos.valid is True
+    assert 'not valid' in caplog.text
@@ -0,0 +1,191 @@
+# Accounting of Batch responses, retries and history rollback
+
+import os
+
+from .context import py4sos
+from py4sos import santander, wrapper
+
+prefix = 'http://www.geosmartcity.nl/test/'
+
+
+def sensor(ide):
+    return {"request": "InsertSensor", "service": "SOS", "version": "2.0.0", "procedureDescription": ide}
+
+
+def observation(ide, *counts):
+    observations = [{"identifier": {"value": prefix + 'observation/' + ide + '_Luminosity_' + str(c)}} for c in counts]
+    return {"request": "InsertObservation", "service": "SOS", "version": "2.0.0", "offering": prefix + 'offering/' + ide,
+            "observation": observations[0] if len(observations) == 1 else observations}
+
+
+def batch(ide, requests, new=False, times=(), carried=()):
+    b = wrapper.Batch(ide)
+    for r in list(carried) + list(requests):
+        b.add_request(r)
+    b.new = new
+    b.times = list(times)
+    b.carried = list(carried)
+    return b
+
+
+def exception(code, text):
+    return {"version": "2.0.0", "exceptions": [{"code": code, "locator": None, "text": text}]}
+
+
+inserted = ('inserted', None, False)
+busy = ('failed', 'Database busy', True)
+refused = ('failed', 'Invalid value', False)
+
+
+def test_batch_outcomes_of_52north_responses():
+    body = batch('n', [sensor('n')] + [observation('n', c) for c in range(1, 6)]).reqs()
+    response = {"request": "Batch", "version": "2.0.0", "service": "SOS", "responses": [
+        {"request": "InsertSensor", "assignedProcedure": prefix + 'procedure/n'},
+        {"request": "InsertObservation", "version": "2.0.0", "service": "SOS"},
+        exception('NoApplicableCode', 'Observation with same values already contained in database'),
+        exception('NoApplicableCode', 'The database connection was lost'),
+        {"exception": {"code": "InvalidParameterValue", "locator": "offering", "text": "Offering not supported"}},
+    ]}  # the last request has no result
+    outcomes = wrapper.batchOutcomes(body, response)
+    assert [o[0] for o in outcomes] == ['inserted', 'inserted', 'duplicate', 'failed', 'failed', 'failed']
+    assert [o[2] for o in outcomes] == [False, False, False, True, False, True]
+    assert outcomes[4][1] == 'Offering not supported'
+    assert wrapper.batchOutcomes(body, {"request": "Batch"}) == [inserted] * 6
+    combined = batch('n', [observation('n', 1, 2)]).reqs()
+    stored = {"responses": [exception('NoApplicableCode', 'Observation with same values already contained in database')]}
+    assert wrapper.batchOutcomes(combined, stored)[0][::2] == ('failed', True)  # split and sent again
+
+
+def test_count_outcomes():
+    results = [(batch('a', [observation('a', 1)] * 3), [inserted, ('duplicate', 'x', False), busy]),
+               (batch('b', [observation('b', 1)]), [refused])]
+    spooled = [batch('c', [sensor('c'), observation('c', 1)])]
+    assert santander._countOutcomes(results, spooled) == {"inserted": 1, "duplicate": 1, "failed": 2, "spooled": 2}
+
+
+def test_rollback_new_node_without_sensor():
+    hist = {'n': {"count": 1, "times": ['t1']}}
+    b = batch('n', [sensor('n'), observation('n', 1)], new=True, times=['t1'])
+    assert santander.rollbackHistory(hist, [(b, [refused, refused])]) == 1
+    assert hist == {}
+
+
+def test_rollback_when_all_new_observations_failed():
+    hist = {'n': {"count": 5, "times": ['t4', 't5']}}
+    b = batch('n', [observation('n', 5)] * 2, times=['t5'])
+    assert santander.rollbackHistory(hist, [(b, [busy, refused])]) == 1
+    assert hist == {'n': {"count": 4, "times": ['t4']}}  # the identifiers are used again by the next snapshot
+
+
+def test_partial_failures_are_kept():
+    hist = {'n': {"count": 5, "times": ['t5']}}
+    requests = [observation('n', 5), observation('n', 5), observation('n', 5)]
+    requests[2]["observation"]["identifier"]["value"] += 'b'
+    b = batch('n', requests, times=['t5'])
+    assert santander.rollbackHistory(hist, [(b, [inserted, busy, refused])]) == 0
+    entry = hist['n']
+    assert entry["count"] == 5 and entry["times"] == ['t5']
+    assert entry["pending"] == [requests[1]]
+    assert entry["missing"] == [prefix + 'observation/n_Luminosity_5b']
+
+
+def test_carried_requests_survive_a_rollback():
+    old = observation('n', 3, 4)  # combined request of earlier snapshots
+    hist = {'n': {"count": 5, "times": ['t4', 't5']}}
+    b = batch('n', [observation('n', 5)], times=['t5'], carried=[old])
+    assert santander.rollbackHistory(hist, [(b, [refused, busy])]) == 1
+    assert hist['n'] == {"count": 4, "times": ['t4'], "missing": [prefix + 'observation/n_Luminosity_3',
+                                                                  prefix + 'observation/n_Luminosity_4']}
+
+
+def stubWithFaults(stub, faults):
+    # answers InsertObservation with the exceptions in 'faults' {identifier suffix: [SosError, ...]} first
+    from benchmarks import stubsos
+
+    store = stub.insertObservation
+
+    def insertObservation(body):
+        o = body["observation"]
+        ide = (o[0] if isinstance(o, list) else o)["identifier"]["value"]
+        for suffix, errors in faults.items():
+            if ide.endswith(suffix) and len(errors) > 0:
+                raise stubsos.SosError(*errors.pop(0))
+        return store(body)
+
+    stub.insertObservation = insertObservation
+
+
+def upload(sos, data, names, hist_path, retries=2):
+    for name in names:
+        collection = santander.requests_from_file(data, name, 'light', hist_path)
+        santander.upload2sos(sos, collection, hist_path, retries=retries)
+    return santander.history(hist_path)
+
+
+def test_only_transient_failures_are_sent_again(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(santander.time_, 'sleep', lambda seconds: None)
+    data, hist_path = str(tmp_path / 'data') + os.sep, str(tmp_path / 'hist') + os.sep
+    os.makedirs(hist_path)
+    names = generators.writeSnapshots(data, 'light', 2, 3, seed=0)
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        stubWithFaults(stub, {
+            'bench_light_0_Luminosity_2': [('NoApplicableCode', None, 'busy')] * 3,  # fails on every attempt
+            'bench_light_1_Luminosity_1': [('NoApplicableCode', None, 'busy')],  # stored by the first retry
+            'bench_light_1_Temperature_2': [('InvalidParameterValue', 'observation', 'bad value')] * 3,
+        })
+        hist = upload(sos, data, names[:2], hist_path)
+        assert stub.stats()["exceptions"] == {'NoApplicableCode': 4, 'InvalidParameterValue': 1}
+        assert len(hist['bench_light_0']["pending"]) == 1
+        assert hist['bench_light_1']["missing"] == [prefix + 'observation/bench_light_1_Temperature_2']
+
+        stored = stub.stats()["observations"]
+        hist = upload(sos, data, names[2:], hist_path)  # the pending request goes with the next snapshot
+        assert 'pending' not in hist['bench_light_0']
+        assert prefix + 'observation/bench_light_0_Luminosity_2' in stub.observations
+        assert stub.stats()["observations"] == stored + 1 + 6  # and a snapshot of 2 nodes with 3 attributes
+
+
+def test_client_errors_of_the_whole_batch_are_not_retried(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(santander.time_, 'sleep', lambda seconds: None)
+    data, hist_path = str(tmp_path / 'data') + os.sep, str(tmp_path / 'hist') + os.sep
+    os.makedirs(hist_path)
+    names = generators.writeSnapshots(data, 'light', 2, 1, seed=0)
+    for status, sent in ((400, 2), (503, 6)):
+        with stubsos.StubSos(error_rate=1.0, error_status=status) as stub:
+            sos = santander.Sos(stub.url, validate=False)
+            hist = upload(sos, data, names, hist_path)
+            assert stub.stats()["injected_errors"] == sent
+            assert [ide for ide in hist if ide != 'last upload'] == []  # sensors not registered
+
+
+def test_combined_requests_with_stored_observations_are_split(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(santander.time_, 'sleep', lambda seconds: None)
+    data = str(tmp_path / 'data') + os.sep
+    names = generators.writeSnapshots(data, 'light', 2, 3, seed=0)
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        upload(sos, data, names[:1], history(tmp_path, 'first'))
+        hist_path = history(tmp_path, 'stale')  # replay of all the snapshots, the first one is stored already
+        collection = santander.requests_from_files(data, names, 'light', hist_path)
+        santander.upload2sos(sos, collection, hist_path, retries=2)
+        stats = stub.stats()
+        accounting = santander.history(hist_path)['last upload']['requests']
+    assert stats["observations"] == 18  # 2 nodes with 3 attributes in 3 snapshots
+    assert accounting == {"inserted": 2 * 6, "duplicate": 2 + 2 * 3, "failed": 0,
+                          "spooled": 0}  # sensors and the observations of the first snapshot are duplicates
+
+
+def history(tmp_path, name):
+    path = str(tmp_path / name) + os.sep
+    os.makedirs(path)
+    return path
@@ -0,0 +1,61 @@
+# Spatial queries split into tiles
+
+import pytest
+
+from .context import py4sos, interval
+from py4sos import catalog, core
+
+box = (-3.86, 43.42, -3.74, 43.49)  # covers the nodes written by benchmarks.generators
+
+
+def test_tiles():
+    assert core.bboxTiles((0, 0, 1, 1)) == [(0, 0, 1, 1)]
+    assert core.bboxTiles((0, 0, 1, 1), 0.5) == [(0, 0, 0.5, 0.5), (0.5, 0, 1, 0.5), (0, 0.5, 0.5, 1), (0.5, 0.5, 1, 1)]
+    assert len(core.bboxTiles((0, 0, 0.3, 0.3), 0.1)) == 9  # no sliver tiles
+    tiles = core.bboxTiles((0, 0, 1, 0.25), 0.4)
+    assert [t[2] for t in tiles] == [0.4, 0.8, 1] and all(t[3] == 0.25 for t in tiles)  # clipped to the box
+    with pytest.raises(ValueError):
+        core.bboxTiles((0, 0, 1, 1), 0)
+
+
+def location(observation):
+    # (longitude, latitude) of the feature of interest; the SOS reports [latitude, longitude]
+    latitude, longitude = observation["featureOfInterest"]["geometry"]["coordinates"][:2]
+    return float(longitude), float(latitude)
+
+
+def test_tiles_return_each_observation_once(loaded, monkeypatch):
+    stub, sos = loaded
+    single = core.getObservationByBBox(sos, box, interval)["observations"]
+    assert len(single) == stub.stats()["observations"]
+    tiled = core.getObservationByBBox(sos, box, interval, tile_size=0.03, threads=3)["observations"]
+    assert sorted(core.observationId(o) for o in tiled) == sorted(core.observationId(o) for o in single)
+    assert [core.observationTime(o) for o in tiled] == sorted(core.observationTime(o) for o in single)
+
+    x, y = location(single[0])
+    corner = (x - 0.5, y - 0.5, x + 0.5, y + 0.5)  # the feature is at the corner of 4 tiles
+    returned = []
+    fetch = core._fetchJson
+
+    def counted(sos, body):
+        response = fetch(sos, body)
+        returned.extend(response["observations"])
+        return response
+
+    monkeypatch.setattr(core, '_fetchJson', counted)
+    found = core.getObservationByBBox(sos, corner, tile_size=0.5)["observations"]
+    ids = [core.observationId(o) for o in found]
+    assert len(returned) > len(found) and len(ids) == len(set(ids))
+    assert core.observationId(single[0]) in ids
+
+
+def test_tiles_without_features_are_not_requested(loaded):
+    stub, sos = loaded
+    observations = core.getObservationByBBox(sos, box, interval)["observations"]
+    index = catalog.GridIndex()
+    for o in observations:
+        index.insert(core.identifierOf(o["featureOfInterest"]), location(o))
+    before = stub.stats()["requests"]["GetObservation"]
+    found = core.getObservationByBBox(sos, (-10, 40, 0, 50), interval, tile_size=1, foi_index=index)["observations"]
+    assert stub.stats()["requests"]["GetObservation"] - before == 1  # of 100 tiles
+    assert len(found) == len(observations)
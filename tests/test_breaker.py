@@ -0,0 +1,167 @@
+# Circuit breaker state machine, retries and spooling
+
+import pytest
+import requests
+
+from .context import py4sos
+from py4sos import breaker, core, santander
+
+
+class Clock:
+    # monotonic clock moved by hand
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(breaker.time_, 'monotonic', c)
+    return c
+
+
+def httpError(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(str(status), response=response)
+
+
+def fail(exc):
+    def func():
+        raise exc
+    return func
+
+
+def test_opens_on_error_rate(clock):
+    circuit = breaker.CircuitBreaker(error_rate=0.5, window=4, min_calls=4, reset_timeout=10)
+    for success in (True, False, True):
+        circuit.record(success)
+    assert circuit.state == 'closed'  # fewer calls than min_calls
+    circuit.record(False)
+    assert circuit.state == 'open'
+    assert not circuit.allow()
+    with pytest.raises(breaker.CircuitOpenError):
+        circuit.call(lambda: None)
+
+
+def test_half_open_trial(clock):
+    circuit = breaker.CircuitBreaker(error_rate=0.5, window=2, min_calls=2, reset_timeout=10)
+    circuit.record(False)
+    circuit.record(False)
+    clock.now += 10
+    assert circuit.allow()  # a single trial request
+    assert circuit.state == 'half-open'
+    assert not circuit.allow()
+    circuit.record(False)
+    assert circuit.state == 'open'
+    clock.now += 5
+    assert not circuit.allow()  # the timeout starts again
+    clock.now += 5
+    assert circuit.call(lambda: 'ok') == 'ok'
+    assert circuit.state == 'closed'
+    assert len(circuit.outcomes) == 0
+
+
+def test_probe(clock):
+    answers = [ConnectionError('down'), None]
+
+    def probe():
+        answer = answers.pop(0)
+        if answer is not None:
+            raise answer
+
+    circuit = breaker.CircuitBreaker(window=1, min_calls=1, reset_timeout=10, probe=probe)
+    circuit.record(False)
+    clock.now += 10
+    assert not circuit.allow()  # the probe failed
+    assert circuit.state == 'open'
+    clock.now += 10
+    assert circuit.allow()
+    assert circuit.state == 'closed'
+
+
+def test_client_errors_do_not_count():
+    circuit = breaker.CircuitBreaker(window=2, min_calls=2)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            circuit.call(fail(httpError(400)))
+    assert circuit.state == 'closed'
+    with pytest.raises(requests.HTTPError):
+        circuit.call(fail(httpError(503)))
+    assert circuit.state == 'open'
+
+
+def test_isServerError():
+    assert breaker.isServerError(httpError(500))
+    assert not breaker.isServerError(httpError(404))
+    assert breaker.isServerError(requests.ConnectionError('refused'))
+
+
+def test_retry_skips_open_circuit_and_client_errors():
+    calls = []
+
+    def func(exc):
+        def call():
+            calls.append(exc)
+            raise exc
+        return call
+
+    for exc in (breaker.CircuitOpenError('open'), httpError(400)):
+        calls.clear()
+        with pytest.raises(type(exc)):
+            core._retry(func(exc), retries=3, delay=0)
+        assert len(calls) == 1
+    calls.clear()
+    with pytest.raises(requests.HTTPError):
+        core._retry(func(httpError(502)), retries=2, delay=0)
+    assert len(calls) == 3
+
+
+def test_spool_and_resend(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)  # santander.history() changes the working directory
+    data, hist_path = str(tmp_path / 'data') + '/', str(tmp_path / 'hist') + '/'
+    (tmp_path / 'hist').mkdir()
+    generators.writeSnapshots(data, 'light', 3, 1, seed=1)
+    name = sorted(py4sos.archive.listSnapshots(data))[0]
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        sos.set_circuit_breaker(spool=True)
+        sos.breaker.state, sos.breaker.opened_at = 'open', float('inf')  # refuse everything
+        collection = santander.requests_from_file(data, name, 'light', hist_path)
+        santander.upload2sos(sos, collection, hist_path)
+        assert stub.stats()["observations"] == 0
+        last = santander.history(hist_path)["last upload"]
+        assert last["requests"]["spooled"] > 0
+
+        sos.breaker.close()
+        assert santander.upload_spool(sos, hist_path) == 3
+        assert stub.stats()["observations"] == last["requests"]["spooled"] - 3  # less the InsertSensor requests
+
+
+def test_spool_files_are_not_read_as_history(tmp_path, monkeypatch):
+    import os
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    data, hist_path = str(tmp_path / 'data') + '/', str(tmp_path / 'hist') + '/'
+    (tmp_path / 'hist').mkdir()
+    names = generators.writeSnapshots(data, 'light', 2, 2, seed=1)
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        sos.set_circuit_breaker(spool=True)
+        santander.upload2sos(sos, santander.requests_from_file(data, names[0], 'light', hist_path), hist_path)
+        sos.breaker.state, sos.breaker.opened_at = 'open', float('inf')  # the circuit opens again while resending
+        santander.upload2sos(sos, santander.requests_from_file(data, names[1], 'light', hist_path), hist_path)
+        assert santander.upload_spool(sos, hist_path) == 0
+        spool = [f for f in os.listdir(hist_path) if f.startswith('spool-')]
+        assert len(spool) == 1
+        os.utime(hist_path + spool[0], (2 ** 31, 2 ** 31))  # newer than the history files
+        hist = santander.history(hist_path)
+        assert hist["last upload"]["name"] == names[1]
+        collection = santander.requests_from_file(data, names[1], 'light', hist_path)
+        assert collection["requests"] == []  # the snapshot was recorded, its requests are spooled
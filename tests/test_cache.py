@@ -0,0 +1,98 @@
+# Response cache for read requests
+
+import pytest
+
+from .context import py4sos
+from py4sos import cache, core
+
+capabilities = {"request": "GetCapabilities", "service": "SOS", "sections": ["Contents"]}
+
+
+class Clock:
+    # wall clock moved by hand
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(cache.time_, 'time', c)
+    return c
+
+
+def test_key_is_normalized_and_includes_url():
+    a = cache.ResponseCache(url='http://a/sos')
+    b = cache.ResponseCache(url='http://b/sos')
+    reordered = {"sections": ["Contents"], "service": "SOS", "request": "GetCapabilities"}
+    assert a.key(capabilities) == a.key(reordered)
+    assert a.key(capabilities) != b.key(capabilities)
+
+
+def test_cacheable_operations():
+    responses = cache.ResponseCache()
+    assert responses.cacheable(capabilities)
+    assert not responses.cacheable({"request": "GetObservation"})
+
+
+def test_ttl_and_revalidation(clock):
+    responses = cache.ResponseCache(ttl={"GetCapabilities": 10})
+    responses.store(capabilities, {"contents": []})
+    entry, fresh = responses.lookup(capabilities)
+    assert fresh and entry["payload"] == {"contents": []}
+
+    clock.now += 11
+    assert responses.lookup(capabilities) == (None, False)  # expired, without validators
+
+    responses.store(capabilities, {"contents": []}, etag='"v1"')
+    clock.now += 11
+    entry, fresh = responses.lookup(capabilities)
+    assert not fresh
+    assert responses.conditional_headers(entry) == {'If-None-Match': '"v1"'}
+    responses.refresh(capabilities, entry)
+    assert responses.lookup(capabilities)[1]
+    assert responses.stats() == {"hits": 2, "misses": 1, "revalidated": 1, "stored": 2, "entries": 1}
+
+
+def test_least_recently_used_are_dropped():
+    responses = cache.ResponseCache(maxsize=2)
+    bodies = [dict(capabilities, sections=[str(i)]) for i in range(3)]
+    responses.store(bodies[0], 0)
+    responses.store(bodies[1], 1)
+    responses.lookup(bodies[0])
+    responses.store(bodies[2], 2)
+    assert responses.lookup(bodies[1])[0] is None
+    assert responses.lookup(bodies[0])[0]["payload"] == 0
+
+
+def test_disk_tier_shared_by_urls(tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache.ResponseCache(directory=directory, url='http://a/sos').store(capabilities, 'a')
+    cache.ResponseCache(directory=directory, url='http://b/sos').store(capabilities, 'b')
+    assert cache.ResponseCache(directory=directory, url='http://a/sos').lookup(capabilities)[0]["payload"] == 'a'
+    assert cache.ResponseCache(directory=directory, url='http://b/sos').lookup(capabilities)[0]["payload"] == 'b'
+
+    availability = {"request": "GetDataAvailability", "service": "SOS"}
+    responses = cache.ResponseCache(directory=directory, url='http://a/sos')
+    responses.store(availability, [])
+    responses.invalidate('GetCapabilities')
+    assert responses.lookup(capabilities)[0] is None
+    assert cache.ResponseCache(directory=directory, url='http://b/sos').lookup(capabilities)[0] is None
+    assert responses.lookup(availability)[0] is not None
+
+
+def test_sos_cache_with_stub():
+    from benchmarks import stubsos
+
+    with stubsos.StubSos() as stub:
+        sos = py4sos.santander.Sos(stub.url)
+        sos.enable_cache()
+        first = core.getCapabilites(sos, 'content')
+        assert core.getCapabilites(sos, 'content') == first
+        assert stub.stats()["requests"]["GetCapabilities"] == 1
+        sos.cache.invalidate()
+        core.getCapabilites(sos, 'content')
+        assert stub.stats()["requests"]["GetCapabilities"] == 2
@@ -0,0 +1,69 @@
+# Catalog of the contents of a SOS and its grid index
+
+import pytest
+
+from .context import py4sos
+from py4sos import catalog
+
+capabilities = {"contents": [
+    {"identifier": "o1", "procedure": ["p1"], "observableProperty": ["t", "h"], "featureOfInterest": ["f1"],
+     "phenomenonTime": ["2016-07-01T00:00:00Z", "2016-07-02T00:00:00Z"],
+     "observedArea": {"lowerLeft": [43.40, -3.80], "upperRight": [43.40, -3.80]}},
+    {"identifier": "o2", "procedure": "p2", "observedProperty": "t",
+     "relatedFeature": [{"featureOfInterest": "f2", "role": ["featureOfInterestID"]}],
+     "phenomenonTime": ["2016-07-03T00:00:00Z", "2016-07-04T00:00:00Z"],
+     "observedArea": {"lowerLeft": [-90, -180], "upperRight": [90, 180]}},  # mobile sensor
+    {"identifier": "o3", "procedure": ["p3"], "observableProperty": ["h"]},
+]}
+
+
+def brute(boxes, bbox):
+    return {k for k, b in boxes.items() if b[0] <= bbox[2] and b[2] >= bbox[0] and b[1] <= bbox[3] and b[3] >= bbox[1]}
+
+
+def test_grid_index_matches_brute_force():
+    index = catalog.GridIndex(cell_size=1.0, max_cells=16)
+    boxes = {"point": (0.5, 0.5, 0.5, 0.5), "small": (2, 2, 3.5, 3.5), "edge": (-1, -1, 0, 0),
+             "large": (-50, -50, 50, 50), "world": (-180, -90, 180, 90)}
+    for key, bbox in boxes.items():
+        index.insert(key, bbox)
+    index.insert("tuple", (7.2, 7.9))
+    boxes["tuple"] = (7.2, 7.9, 7.2, 7.9)
+    assert index.large == {"large", "world"}
+    for bbox in [(0, 0, 1, 1), (2.5, 2.5, 2.6, 2.6), (100, 60, 101, 61), (-180, -90, 180, 90), (7, 7, 8, 8),
+                 (-0.5, -0.5, -0.4, -0.4)]:
+        assert index.query(bbox) == brute(boxes, bbox)
+        assert index.any_within(bbox) == (len(brute(boxes, bbox)) > 0)
+
+
+def test_wide_queries_do_not_visit_every_cell():
+    index = catalog.GridIndex(cell_size=1e-6)
+    index.insert("a", (1.0, 1.0))
+    assert index.query((-180, -90, 180, 90)) == {"a"}  # about 6e16 cells
+    assert not index.any_within((2, 2, 170, 80))
+
+
+def test_catalog_indexes():
+    c = catalog.Catalog.fromCapabilities(capabilities)
+    assert c.has_procedure("p2") and not c.has_procedure("p9")
+    assert c.properties() == {"t", "h"}
+    assert c.features() == {"f1", "f2"}
+    assert c.find(property_="t") == {"o1", "o2"}
+    assert c.find(procedure="p1", property_="h") == {"o1"}
+    assert c.find(feature_of_interest="f2") == {"o2"}
+    assert c.find() == {"o1", "o2", "o3"}
+    assert c.during("2016-07-01T12:00:00Z", "2016-07-03T00:00:00Z") == {"o1", "o2"}
+    assert c.during("2016-07-02T01:00:00Z", "2016-07-02T23:00:00Z") == set()
+    assert c.within((-3.81, 43.39, -3.79, 43.41)) == {"o1", "o2"}
+    assert c.within((10, 10, 11, 11)) == {"o2"}
+
+
+@pytest.mark.loaded(nodes=4)
+def test_catalog_from_stub(loaded):
+    stub, sos = loaded
+    c = catalog.Catalog.fromSos(sos)
+    procedures = {'http://www.geosmartcity.nl/test/procedure/bench_light_%d' % i for i in range(4)}
+    assert c.procedures() <= procedures
+    assert len(c.procedures()) > 0
+    assert len(c.during("2016-07-01T00:00:00Z", "2016-07-02T00:00:00Z")) == len(c.offerings)
+    assert c.within((-180, -90, 180, 90)) == set(c.offerings)
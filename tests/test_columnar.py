@@ -0,0 +1,64 @@
+# Columnar decoding of observations into NumPy arrays
+
+import pytest
+
+from .context import py4sos, interval
+from py4sos import columnar, core
+
+np = pytest.importorskip('numpy')
+
+
+def observation(procedure, time, result, property_='temperature', foi='station', result_time=None):
+    o = {"procedure": procedure, "observableProperty": property_, "featureOfInterest": {"identifier": {"value": foi}},
+         "phenomenonTime": time, "result": result}
+    if result_time is not None:
+        o["resultTime"] = result_time
+    return o
+
+
+observations = [
+    observation('p1', '2016-07-01T08:00:00.123+02:00', {"value": 21.5, "uom": "C"}, result_time='2016-07-01T06:00:01Z'),
+    observation('p2', ['2016-07-01T06:10:00Z', '2016-07-01T06:20:00Z'], 7),
+    observation('p1', '1969-12-31T23:59:59.999+00:00', True, property_='door'),
+    observation('p1', '2016-07-01T06:30:00Z', {"type": "Point", "coordinates": [1, 2]}, property_='location'),
+]
+
+
+def test_times_are_exact_milliseconds():
+    columns = columnar.decodeObservations(observations)
+    assert columns.time[0] == np.datetime64('2016-07-01T06:00:00.123', 'ms')
+    assert columns.time[1] == np.datetime64('2016-07-01T06:10:00', 'ms')  # start of a period
+    assert columns.time[2] == np.datetime64('1969-12-31T23:59:59.999', 'ms')
+    assert columns.result_time[0] == np.datetime64('2016-07-01T06:00:01', 'ms')
+    assert np.isnat(columns.result_time[1])
+
+
+def test_values_and_units():
+    columns = columnar.decodeObservations({"observations": observations})
+    assert columns.value[:2].tolist() == [21.5, 7.0]
+    assert np.isnan(columns.value[2])  # booleans are not numbers
+    assert np.isnan(columns.value[3])
+    assert columns.units == {'temperature': 'C'}
+    described = observation('p1', '2016-07-01T06:00:00Z', {"value": 3, "uom": "m"},
+                            property_={"identifier": {"value": 'height'}})  # property reported as an object
+    assert columnar.decodeObservations([described]).units == {'height': 'm'}
+
+
+def test_categorical_and_select():
+    columns = columnar.decodeObservations(iter(observations))
+    assert len(columns) == 4
+    assert columns.procedure.categories == ['p1', 'p2']
+    assert columns.procedure.values().tolist() == ['p1', 'p2', 'p1', 'p1']
+    assert columns.foi.values().tolist() == ['station'] * 4
+    assert not columns.procedure.mask('p9').any()
+    subset = columns.select(columns.procedure.mask('p1'))
+    assert len(subset) == 3
+    assert subset.property.values().tolist() == ['temperature', 'door', 'location']
+
+
+def test_columns_from_stub(loaded):
+    stub, sos = loaded
+    expected = core.getObservationByTime(sos, None, None, None, None, interval)["observations"]
+    columns = core.getObservationByTime(sos, None, None, None, None, interval, columns=True)
+    assert len(columns) == len(expected)
+    assert columns.procedure.values().tolist() == [o["procedure"] for o in expected]
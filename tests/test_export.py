@@ -0,0 +1,81 @@
+# Bulk export of series to compressed files
+
+import csv
+import gzip
+import os
+
+import pytest
+
+from .context import py4sos
+from py4sos import core, export, planner
+
+prefix = 'http://www.geosmartcity.nl/test/'
+procedures = [prefix + 'procedure/bench_light_%d' % i for i in range(3)]
+properties = [prefix + 'observableProperty/Luminosity', prefix + 'observableProperty/Temperature']
+interval = ['2016-06-30T12:00:00+00:00', '2016-07-01T12:00:00+00:00']  # two days
+
+
+def files(directory):
+    return sorted(os.path.relpath(os.path.join(d, f), directory) for d, _, names in os.walk(directory) for f in names)
+
+
+def test_series_names_are_unique():
+    a = export.seriesName(('http://x/procedure/n1', 'http://x/property/t', None))
+    b = export.seriesName(('http://y/procedure/n1', 'http://x/property/t', None))
+    assert a.startswith('n1__t__all-')
+    assert a != b
+
+
+def test_days():
+    split = export.days(['2016-07-01T22:00:00+02:00', '2016-07-02T01:30:00Z'])
+    assert [d[0] for d in split] == ['2016-07-01', '2016-07-02']
+    assert split[0][1].isoformat() == '2016-07-01T20:00:00+00:00'
+    assert split[1][2].isoformat() == '2016-07-02T01:30:00+00:00'
+
+
+def test_csv_export_and_resume(loaded, tmp_path):
+    out = str(tmp_path / 'export')
+    series = planner.cartesian(procedures, properties, [None])
+    stub, sos = loaded
+    expected = planner.getSeriesObservations(sos, series, interval)
+    stats = export.exportSeries(sos, series, interval, out, max_identifiers=3)
+    assert stats == {"written": 12, "skipped": 0, "observations": sum(len(o) for o in expected.values())}
+    reads = stub.stats()["requests"]["GetObservation"]
+    assert export.exportSeries(sos, series, interval, out)["skipped"] == 12
+    assert stub.stats()["requests"]["GetObservation"] == reads
+    assert not any(name.endswith('.tmp') for name in files(out))
+
+    path = os.path.join(out, '2016-07-01', export.seriesName(series[0]) + '.csv.gz')
+    with gzip.open(path, 'rt', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == export._columns
+    assert [r[7] for r in rows[1:]] == [core.observationId(o) for o in expected[series[0]]]
+    with gzip.open(os.path.join(out, '2016-06-30', export.seriesName(series[0]) + '.csv.gz'), 'rt') as f:
+        assert len(f.readlines()) == 1  # header of an empty day
+
+
+def test_npz_export(loaded, tmp_path):
+    np = pytest.importorskip('numpy')
+    out = str(tmp_path / 'export')
+    s = (procedures[0], properties[0], None)
+    stub, sos = loaded
+    export.exportSeries(sos, [s], interval, out, 'npz')
+    expected = core.getObservationByTime(sos, s[0], None, s[1], None, interval)["observations"]
+    with np.load(os.path.join(out, '2016-07-01', export.seriesName(s) + '.npz')) as arrays:
+        assert sorted(arrays.files) == sorted(export._columns)
+        assert arrays["identifier"].tolist() == [core.observationId(o) for o in expected]
+        assert arrays["uom"].tolist() == [o["result"]["uom"] for o in expected]
+        assert arrays["value"].tolist() == [o["result"]["value"] for o in expected]
+
+
+def test_failed_request_leaves_no_files(tmp_path, monkeypatch):
+    def broken(*args, **kwargs):
+        yield {"procedure": procedures[0], "observableProperty": properties[0], "phenomenonTime": interval[1],
+               "result": 1}
+        raise ConnectionError('connection lost')
+
+    monkeypatch.setattr(core, 'getObservationByTime', broken)
+    out = str(tmp_path / 'export')
+    with pytest.raises(ConnectionError):
+        export.exportSeries(None, [(procedures[0], properties[0], None)], ['2016-07-01T00:00:00Z', interval[1]], out)
+    assert files(out) == []
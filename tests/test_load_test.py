@@ -0,0 +1,29 @@
+# Smoke run of the load test harness
+
+import json
+import logging
+
+from .context import py4sos
+
+
+def test_load_test_report(tmp_path, monkeypatch):
+    from benchmarks import load_test
+
+    monkeypatch.chdir(tmp_path)  # the history logs are in a temporary directory, removed at the end
+    level = logging.getLogger('py4sos').level
+    output = str(tmp_path / 'report.json')
+    try:
+        load_test.main(['--nodes', '3', '--files', '2', '--threads', '2', '--reads', '20', '--replay',
+                        '--output', output])
+    finally:
+        logging.getLogger('py4sos').setLevel(level)
+    with open(output) as f:
+        report = json.load(f)
+    phases = {p["phase"]: p for p in report["phases"]}
+    assert list(phases) == ['ingest', 'replay', 'read']
+    assert phases["ingest"]["observations_stored"] > 0
+    assert phases["replay"]["observations_stored"] == 0  # everything is a duplicate
+    assert report["server"]["observations"] == phases["ingest"]["observations_stored"]
+    operations = {(o["phase"], o["operation"]) for o in report["operations"]}
+    assert ('ingest', 'Batch') in operations and ('read', 'GetObservation') in operations
+    assert report["server"]["duplicates"] > 0
@@ -0,0 +1,72 @@
+# Logging configuration, rate limiting and formatters
+
+import io
+import json
+import logging
+
+import pytest
+
+from .context import py4sos
+from py4sos import log
+
+
+class Clock:
+    # monotonic clock moved by hand
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def output():
+    # py4sos messages printed to a string; the configuration is removed afterwards
+    stream = io.StringIO()
+    yield stream
+    for h in list(log.logger.handlers):
+        if getattr(h, 'py4sos', False):
+            log.logger.removeHandler(h)
+    log.logger.setLevel(logging.NOTSET)
+
+
+def record(msg, *args, name='py4sos.santander'):
+    return logging.LogRecord(name, logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_per_template(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(log.time_, 'monotonic', clock)
+    limit = log.RateLimitFilter(burst=2, interval=10)
+    assert [limit.filter(record('Node %s failed', i)) for i in range(4)] == [True, True, False, False]
+    assert limit.filter(record('Other message'))
+    assert limit.filter(record('Node %s failed', 0, name='py4sos.core'))  # other logger
+    clock.now += 10
+    first = record('Node %s failed', 9)
+    assert limit.filter(first)
+    assert first.suppressed == 2
+
+
+def test_configure_text(output):
+    handler = log.configure(stream=output, burst=1)
+    assert log.configure(stream=output, burst=1) is not handler
+    assert sum(1 for h in log.logger.handlers if getattr(h, 'py4sos', False)) == 1  # replaced
+    logger = logging.getLogger('py4sos.santander')
+    logger.info('Processing %s', 'a.json')
+    logger.info('Processing %s', 'b.json')
+    logger.debug('hidden')
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith('INFO py4sos.santander: Processing a.json')
+
+
+def test_configure_structured_and_quiet(output):
+    log.configure(stream=output, structured=True)
+    logging.getLogger('py4sos.core').warning('Slow request: %.1f s', 2.5, extra={"operation": 'GetObservation'})
+    entry = json.loads(output.getvalue())
+    assert entry["message"] == 'Slow request: 2.5 s'
+    assert entry["level"] == 'WARNING' and entry["operation"] == 'GetObservation'
+
+    log.configure(stream=output, quiet=True)
+    logging.getLogger('py4sos.core').warning('not printed')
+    assert 'not printed' not in output.getvalue()
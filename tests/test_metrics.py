@@ -0,0 +1,83 @@
+# Counters, histograms and the merge of snapshots from other processes
+
+import json
+
+import pytest
+
+from .context import py4sos
+from py4sos import metrics
+
+
+@pytest.fixture
+def collector():
+    previous = metrics.active
+    yield metrics.enable()
+    metrics.active = previous
+
+
+def test_counters_and_histograms():
+    m = metrics.Metrics(buckets=(0.1, 1.0))
+    m.inc('requests', operation='Batch')
+    m.inc('requests', 2, operation='Batch')
+    for value in (0.05, 0.5, 5.0):
+        m.observe('seconds', value, operation='Batch')
+    snapshot = m.snapshot()
+    assert snapshot["counters"] == [{"name": 'requests', "labels": {"operation": 'Batch'}, "value": 3}]
+    h = snapshot["histograms"][0]
+    assert h["count"] == 3 and h["sum"] == pytest.approx(5.55)
+    assert h["buckets"] == [[0.1, 1], [1.0, 2], ['+Inf', 3]]
+
+
+def test_merge_adds_snapshots_after_json():
+    workers = [metrics.Metrics(buckets=(0.1, 1.0)) for _ in range(2)]
+    for k, m in enumerate(workers):
+        m.inc('py4sos_batch_requests_total', 10 * (k + 1), outcome='inserted')
+        m.observe('py4sos_stage_seconds', 0.05 + k, stage='upload')
+    merged = metrics.Metrics(buckets=(0.1, 1.0))
+    merged.inc('py4sos_batch_requests_total', 1, outcome='inserted')
+    for m in workers:
+        merged.merge(json.loads(json.dumps(m.snapshot())))  # as sent back by a worker process
+    snapshot = merged.snapshot()
+    assert snapshot["counters"][0]["value"] == 31
+    h = snapshot["histograms"][0]
+    assert h["buckets"] == [[0.1, 1], [1.0, 1], ['+Inf', 2]]
+    assert h["sum"] == pytest.approx(1.1)
+
+    other = metrics.Metrics(buckets=(0.5,))
+    other.observe('py4sos_stage_seconds', 0.2, stage='upload')
+    with pytest.raises(ValueError):
+        merged.merge(other.snapshot())
+
+
+def test_prometheus_format(tmp_path):
+    m = metrics.Metrics(buckets=(1.0,))
+    m.inc('py4sos_http_requests_total', operation='Get"Observation', status=200)
+    m.observe('py4sos_http_seconds', 0.5, operation='GetObservation')
+    text = m.prometheus()
+    assert '# TYPE py4sos_http_requests_total counter' in text
+    assert 'py4sos_http_requests_total{operation="Get\\"Observation",status="200"} 1' in text
+    assert 'py4sos_http_seconds_bucket{le="+Inf",operation="GetObservation"} 1' in text
+    m.write(str(tmp_path / 'metrics.json'), 'json')
+    with open(str(tmp_path / 'metrics.json')) as f:
+        assert json.load(f) == m.snapshot()
+
+
+def test_null_collector(tmp_path):
+    assert not metrics.NULL.enabled
+    with metrics.NULL.stage('load'):
+        metrics.NULL.inc('x')
+    assert metrics.NULL.snapshot() == {"counters": [], "histograms": []}
+    assert metrics.NULL.prometheus() == ''
+    metrics.NULL.write(str(tmp_path / 'metrics.prom'))
+    assert not (tmp_path / 'metrics.prom').exists()
+    metrics.NULL.reset()
+
+
+@pytest.mark.loaded(nodes=3, files=2)
+def test_pipeline_metrics_from_stub(collector, loaded):
+    stub, sos = loaded
+    stored = stub.stats()["observations"]
+    counters = {(c["name"], tuple(sorted(c["labels"].items()))): c["value"] for c in collector.snapshot()["counters"]}
+    assert counters[('py4sos_batch_requests_total', (('outcome', 'inserted'),))] == stored + 3  # and InsertSensor
+    stages = {h["labels"]["stage"] for h in collector.snapshot()["histograms"] if h["name"] == 'py4sos_stage_seconds'}
+    assert {'load', 'clean', 'build', 'upload', 'history'} <= stages
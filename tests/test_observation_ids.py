@@ -0,0 +1,82 @@
+# Chunked and retried GetObservationById requests
+
+import time
+
+import pytest
+import requests
+
+from .context import py4sos, interval
+from py4sos import breaker, core
+
+
+def failing(stub, errors):
+    # answers GetObservationById with the (code, status) in 'errors' first
+    from benchmarks import stubsos
+
+    fetch = stub.getObservationById
+
+    def getObservationById(body):
+        if len(errors) > 0:
+            code, status = errors.pop(0)
+            raise stubsos.SosError(code, None, 'Injected', status)
+        return fetch(body)
+
+    stub.getObservationById = getObservationById
+
+
+@pytest.fixture
+def ids(loaded):
+    stub, sos = loaded
+    observations = core.getObservationByTime(sos, None, None, None, None, interval)["observations"]
+    return [core.observationId(o) for o in observations][::-1]
+
+
+def sent(stub):
+    return stub.stats()["requests"].get("GetObservationById", 0)
+
+
+def test_chunks_keep_the_order_of_the_ids(loaded, ids):
+    stub, sos = loaded
+    single = core.getObservationById(sos, ids)["observations"]
+    before = sent(stub)
+    chunked = core.getObservationById(sos, ids + ids[:3], chunk_size=4, threads=3)["observations"]  # duplicates
+    assert sent(stub) - before == -(-len(ids) // 4)
+    assert [core.observationId(o) for o in chunked] == [core.observationId(o) for o in single] == ids
+    streamed = list(core.getObservationById(sos, ids, stream=True, chunk_size=5))
+    assert streamed == chunked
+
+
+def test_server_errors_are_retried(loaded, ids, monkeypatch):
+    stub, sos = loaded
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    failing(stub, [('NoApplicableCode', 503), ('NoApplicableCode', 500)])
+    before = sent(stub)
+    found = core.getObservationById(sos, ids, chunk_size=len(ids) - 1, threads=1)["observations"]
+    assert [core.observationId(o) for o in found] == ids
+    assert sent(stub) - before == 2 + 2
+
+    failing(stub, [('InvalidParameterValue', 400)])
+    before = sent(stub)
+    with pytest.raises(requests.HTTPError):
+        core.getObservationById(sos, ids, chunk_size=len(ids) - 1, threads=1)
+    assert sent(stub) - before <= 2  # the failed chunk is not sent again
+
+
+def test_only_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    calls = []
+
+    def call(exc):
+        def func():
+            calls.append(exc)
+            raise exc
+        return func
+
+    for exc, attempts in ((requests.ConnectionError('refused'), 3), (requests.Timeout('slow'), 3),
+                          (TypeError('bug'), 1), (KeyError('observations'), 1), (ValueError('The URL is not valid'), 1),
+                          (breaker.CircuitOpenError('open'), 1)):
+        calls.clear()
+        with pytest.raises(type(exc)):
+            core._retry(call(exc), retries=2)
+        assert len(calls) == attempts
+    assert not breaker.isServerError(TypeError('bug'))
@@ -0,0 +1,59 @@
+# Query planning for many series
+
+from .context import py4sos, interval
+from py4sos import catalog, core, planner
+
+prefix = 'http://www.geosmartcity.nl/test/'
+
+
+def test_cartesian():
+    assert planner.cartesian(['p1', 'p2'], ['t'], [None]) == [('p1', 't', None), ('p2', 't', None)]
+
+
+def test_plan_respects_identifier_limit():
+    series = planner.cartesian(['p%d' % i for i in range(10)], ['t', 'h'], ['f'])
+    plan = planner.planQueries(series, max_identifiers=6)
+    assert sorted(s for p in plan for s in p["series"]) == sorted(series)
+    for p in plan:
+        assert sum(len(p[k]) for k in ("procedure", "observedProperty", "featureOfInterest")) <= 6
+        assert {s[0] for s in p["series"]} == set(p["procedure"])  # the properties of a node stay together
+    assert len(plan) == 4
+
+
+def test_plan_max_series_and_filters():
+    series = [('p1', 't', None), ('p2', 't', None), ('p1', 't', 'f'), ('p1', 't', 'f')]
+    plan = planner.planQueries(series, max_series=1)
+    assert len(plan) == 3  # duplicates are removed
+    assert {p["featureOfInterest"] is None for p in plan} == {True, False}  # different filters, different requests
+
+
+def test_split_observations():
+    series = [('p1', 't', None), ('p1', 't', 'f1'), ('p2', 'h', 'f2')]
+    observations = [{"procedure": 'p1', "observableProperty": 't', "featureOfInterest": {"identifier": 'f1'}},
+                    {"procedure": 'p1', "observedProperty": 't', "featureOfInterest": 'f3'},
+                    {"procedure": 'p2', "observableProperty": 't', "featureOfInterest": 'f2'}]
+    split = planner.splitObservations(observations, series)
+    assert split[('p1', 't', None)] == observations[:2]
+    assert split[('p1', 't', 'f1')] == observations[:1]
+    assert split[('p2', 'h', 'f2')] == []  # other property
+
+
+def test_series_from_stub(loaded):
+    procedures = [prefix + 'procedure/bench_light_%d' % i for i in range(3)] + [prefix + 'procedure/unknown']
+    series = planner.cartesian(procedures, [prefix + 'observableProperty/Luminosity',
+                                            prefix + 'observableProperty/Temperature'], [None])
+    stub, sos = loaded
+    expected = {s: core.getObservationByTime(sos, s[0], None, s[1], None, interval)["observations"]
+                for s in series}
+    sent = stub.stats()["requests"]["GetObservation"]
+    found = planner.getSeriesObservations(sos, series, interval, max_identifiers=4)
+    assert stub.stats()["requests"]["GetObservation"] - sent == 2
+
+    registered = catalog.Catalog.fromSos(sos)
+    availability = planner.getSeriesAvailability(sos, series, catalog=registered)
+    assert stub.stats()["requests"]["GetDataAvailability"] == 1
+    for s in series:
+        assert [core.observationId(o) for o in found[s]] == [core.observationId(o) for o in expected[s]]
+    assert len(found[series[0]]) > 0
+    assert availability[series[-1]] == []
+    assert len(availability[series[0]]) == 1
@@ -0,0 +1,52 @@
+# Profiling of the ingest pipeline
+
+import json
+import os
+
+import pytest
+
+from .context import py4sos
+from py4sos import profiling, santander
+
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    from benchmarks import generators
+
+    monkeypatch.chdir(tmp_path)
+    data, hist_path = str(tmp_path / 'data') + os.sep, str(tmp_path / 'hist') + os.sep
+    os.makedirs(hist_path)
+    return data, hist_path, generators.writeSnapshots(data, 'light', 2, 4, seed=0)
+
+
+def test_sampling():
+    profiler = profiling.Profiler('unused', sample_rate=0.5)
+    assert [profiler.sampled() for _ in range(4)] == [True, False, True, False]
+    assert all(profiling.Profiler('unused').sampled() for _ in range(3))
+    with pytest.raises(ValueError):
+        profiling.Profiler('unused', sample_rate=2)
+
+
+def test_parsing_with_profiling_off(snapshots):
+    # the null profiler has depth 0; it must not open a file context (which re-entered requests_from_file)
+    data, hist_path, names = snapshots
+    single = santander.requests_from_file(data, names[0], 'light', hist_path, profiler=profiling.NULL)
+    assert len(single["requests"]) == 2
+    several = santander.requests_from_files(data, names, 'light', hist_path, profiler=profiling.NULL)
+    assert len(several["requests"]) == 2
+
+
+def test_reports_of_sampled_files(snapshots):
+    from benchmarks import stubsos
+
+    data, hist_path, names = snapshots
+    with stubsos.StubSos() as stub:
+        santander.upload_directory2sos(santander.Sos(stub.url), data, 'light', hist_path, profile=True,
+                                       profile_rate=0.5)
+        assert stub.stats()["observations"] == 2 * 3 * 4
+    directory = os.path.join(hist_path, 'profiles')
+    with open(os.path.join(directory, 'summary.jsonl')) as f:
+        summary = [json.loads(line) for line in f]
+    assert [s["file"] for s in summary] == [names[0], names[2]]
+    assert [s["stage"] for s in summary[0]["stages"]] == ['load', 'clean', 'build', 'upload', 'history']
+    assert sum(name.endswith('.prof') for name in os.listdir(directory)) == 2
@@ -0,0 +1,65 @@
+# Token buckets and per-endpoint rate limiters
+
+import pytest
+
+from .context import py4sos
+from py4sos import ratelimit
+
+
+class Clock:
+    # monotonic clock moved by hand
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(ratelimit.time_, 'monotonic', c)
+    return c
+
+
+def test_bucket_burst_then_rate(clock):
+    bucket = ratelimit.TokenBucket(2, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)  # one token short at 2 tokens per second
+    assert bucket.reserve() == pytest.approx(1.0)  # waiting times add up
+    clock.now += 1.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_bucket_refill_is_capped(clock):
+    bucket = ratelimit.TokenBucket(10, capacity=2)
+    bucket.reserve(2)
+    clock.now += 60
+    assert bucket.reserve(2) == 0.0
+    assert bucket.reserve() == pytest.approx(0.1)
+
+
+def test_bucket_default_capacity():
+    assert ratelimit.TokenBucket(0.5).capacity == 1.0
+    assert ratelimit.TokenBucket(8).capacity == 8.0
+    with pytest.raises(ValueError):
+        ratelimit.TokenBucket(0)
+
+
+def test_limiter_budgets_per_kind(clock):
+    limiter = ratelimit.RateLimiter(transactional=1)
+    assert limiter.acquire('read') == 0.0  # no budget: no limit
+    assert limiter.acquire('transactional') == 0.0
+    assert limiter.buckets['transactional'].reserve() == pytest.approx(1.0)
+
+
+def test_limiters_are_shared_per_url():
+    url = 'http://localhost/test-ratelimit/sos'
+    try:
+        limiter = ratelimit.setLimit(url, transactional=5, burst=2)
+        assert ratelimit.limiterFor(url) is limiter
+        assert py4sos.santander.Sos(url, validate=False).limiter is limiter
+        assert ratelimit.limiterFor(url + '/other') is None
+    finally:
+        ratelimit.setLimit(url)
+    assert ratelimit.limiterFor(url) is None
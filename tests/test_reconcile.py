@@ -0,0 +1,43 @@
+# Reconciliation of the sensors registered in a SOS with a lost history
+
+import os
+
+import pytest
+
+from .context import py4sos
+from py4sos import santander
+
+
+@pytest.mark.parametrize('source', ['availability', 'capabilities'])
+@pytest.mark.loaded(nodes=3, files=2)
+def test_identifiers_continue_after_the_sos(loaded, tmp_path, monkeypatch, source):
+    from benchmarks import generators
+
+    monkeypatch.chdir(tmp_path)
+    stub, sos = loaded
+    stored = stub.stats()["observations"]
+    registered = santander.reconcile(sos, source)
+    assert registered == {'bench_light_%d' % i: 2 for i in range(3)}
+
+    data, hist_path = str(tmp_path / 'later') + os.sep, str(tmp_path / 'new-hist') + os.sep
+    os.makedirs(hist_path)
+    names = generators.writeSnapshots(data, 'light', 3, 3, seed=0)
+    for name in names[:2]:  # already uploaded
+        os.remove(data + name)
+    santander.upload_directory2sos(sos, data, 'light', hist_path, reconcile_with=source)
+    stats = stub.stats()
+    ids = set(stub.observations)
+    assert stats["duplicates"] == 0
+    assert stats["sensors"] == 3
+    assert stats["observations"] == stored * 3 // 2
+    assert len([i for i in ids if i.endswith('_3')]) == stored // 2
+    hist = santander.history(hist_path)
+    assert all(hist[ide]["count"] == 3 for ide in registered)
+
+
+@pytest.mark.loaded(nodes=2, files=1)
+def test_unknown_counts_are_left_out(loaded, monkeypatch):
+    monkeypatch.setattr(santander, '_newestCount', lambda sos, ide, end: None)
+
+    stub, sos = loaded
+    assert santander.reconcile(sos, 'capabilities') == {'bench_light_0': None, 'bench_light_1': None}
@@ -0,0 +1,58 @@
+# Local SQLite replica of observations
+
+from .context import py4sos, interval
+from py4sos import core, replica
+
+prefix = 'http://www.geosmartcity.nl/test/'
+procedure = prefix + 'procedure/bench_light_0'
+
+
+def observation(ide, time, value):
+    o = {"procedure": "p", "observableProperty": "t", "featureOfInterest": "f", "phenomenonTime": time,
+         "result": {"value": value, "uom": "C"}}
+    if ide is not None:
+        o["identifier"] = {"value": ide}
+    return o
+
+
+def test_store_keeps_distinct_observations():
+    local = replica.Replica(None)
+    time = '2016-07-01T08:00:00+00:00'
+    local.store([observation('a', time, 1), observation('a', time, 1), observation(None, time, 2),
+                 observation(None, time, 3), observation(None, time, 3)])
+    found = local.query('p', 't', None, time, time)
+    assert sorted(o["result"]["value"] for o in found) == [1, 2, 3]
+
+
+def test_gaps_and_broader_coverage():
+    local = replica.Replica(None)
+    t = ['2016-07-01T0%d:00:00+00:00' % h for h in range(10)]
+    local._cover(('p', 't', 'f'), t[1], t[3])
+    local._cover(('p', 't', replica._any), t[5], t[6])
+    local._cover(('p', 't', 'f'), t[2], t[4])  # merged with the first interval
+    assert local.coverage('p', 't', 'f') == [(t[1], t[4])]
+    assert local.gaps(('p', 't', 'f'), t[0], t[9]) == [(t[0], t[1]), (t[4], t[5]), (t[6], t[9])]
+    assert local.gaps(('p', 't', replica._any), t[5], t[6]) == []
+    assert local.gaps(('p', 't', replica._any), t[1], t[3]) == [(t[1], t[3])]  # narrower query, not covering
+
+
+def test_repeated_queries_are_answered_locally(loaded, tmp_path):
+    stub, sos = loaded
+    expected = core.getObservationByTime(sos, procedure, None, None, None, interval)["observations"]
+    local = replica.Replica(sos, str(tmp_path / 'replica.sqlite'))
+    first = local.getObservationByTime(procedure, None, None, interval)["observations"]
+    reads = stub.stats()["requests"]["GetObservation"]
+    again = local.getObservationByTime(procedure, None, None, ['2016-07-01T08:05:00+00:00', interval[1]])
+    assert stub.stats()["requests"]["GetObservation"] == reads
+    local.close()
+
+    reopened = replica.Replica(sos, str(tmp_path / 'replica.sqlite'))
+    assert reopened.getObservationByTime(procedure, None, None, interval)["observations"] == first
+    assert stub.stats()["requests"]["GetObservation"] == reads
+    reopened.invalidate()
+    assert reopened.coverage(procedure) == []
+    reopened.getObservationByTime(procedure, None, None, interval)
+    assert stub.stats()["requests"]["GetObservation"] == reads + 1
+    assert sorted(core.observationId(o) for o in first) == sorted(core.observationId(o) for o in expected)
+    assert [core.observationTime(o) for o in first] == sorted(core.observationTime(o) for o in first)
+    assert len(again["observations"]) == len(first) // 2
@@ -0,0 +1,63 @@
+# Routing of Batch requests to several SOS instances
+
+import os
+import zlib
+
+import pytest
+
+from .context import py4sos
+from py4sos import santander, sharding, wrapper
+
+
+def test_routing_is_stable():
+    ids = ['node_%d' % i for i in range(50)]
+    assert [sharding.nodeShard(i, 3) for i in ids] == [zlib.crc32(i.encode('utf-8')) % 3 for i in ids]
+    sharded = sharding.ShardedSos([santander.Sos('http://localhost/%d/sos' % i, validate=False) for i in range(3)])
+    routed = sharded.route([wrapper.Batch(i) for i in ids])
+    assert sum(len(r) for r in routed) == len(ids)
+    for k, batches in enumerate(routed):
+        assert all(sharded.shard_index(b.id) == k for b in batches)
+    assert sharded.sosurl == 'http://localhost/0/sos, http://localhost/1/sos, http://localhost/2/sos'
+    with pytest.raises(ValueError):
+        sharding.ShardedSos([])
+    with pytest.raises(ValueError):
+        sharding.ShardedSos(sharded.shards, concurrency=[1, 2])
+
+
+def test_pool_size_of_a_session_in_use():
+    sos = santander.Sos('http://localhost/sos', validate=False, pool_size=2)
+    session = sos.session
+    assert session.get_adapter(sos.sosurl)._pool_maxsize == 2
+    sharding.ShardedSos([sos], concurrency=6)  # a connection for each thread
+    assert sos.session is session
+    assert sos.pool_size == 6 and session.get_adapter(sos.sosurl)._pool_maxsize == 6
+    assert session.get_adapter('https://localhost/sos')._pool_maxsize == 6
+    sos.set_pool_size(3)
+    assert session.get_adapter(sos.sosurl)._pool_maxsize == 3
+
+
+def test_upload_to_shards(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(santander.time_, 'sleep', lambda seconds: None)
+    data, hist_path = str(tmp_path / 'data') + os.sep, str(tmp_path / 'hist') + os.sep
+    os.makedirs(hist_path)
+    names = generators.writeSnapshots(data, 'light', 6, 1, seed=0)
+    with stubsos.StubSos() as good, stubsos.StubSos(error_rate=1.0, error_status=400) as bad:
+        sharded = sharding.ShardedSos([santander.Sos(good.url), santander.Sos(bad.url, validate=False)], 2)
+        collection = santander.requests_from_file(data, names[0], 'light', hist_path)
+        nodes = [b.id for b in collection["requests"]]
+        accounting = santander.upload2sos(sharded, collection, hist_path)
+        stored = good.stats()["sensors"]
+        urls = good.url, bad.url
+    on_bad = [ide for ide in nodes if sharding.nodeShard(ide, 2) == 1]
+    assert 0 < len(on_bad) < len(nodes)
+    assert stored == len(nodes) - len(on_bad)
+    shards = accounting["shards"]
+    assert shards[urls[0]]["failed"] == 0 and shards[urls[0]]["requests"] == len(nodes) - len(on_bad)
+    assert shards[urls[1]]["failed"] == 4 * len(on_bad)  # InsertSensor and 3 observations
+    assert accounting["failed"] == shards[urls[1]]["failed"]
+    hist = santander.history(hist_path)
+    assert hist["last upload"]["requests"]["shards"][urls[1]]["failed"] == 4 * len(on_bad)
+    assert sorted(ide for ide in hist if ide != 'last upload') == sorted(set(nodes) - set(on_bad))  # rolled back
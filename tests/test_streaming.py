@@ -0,0 +1,68 @@
+# Incremental decoding of JSON arrays in SOS responses
+
+import json
+
+import pytest
+
+from .context import py4sos, interval
+from py4sos import core, streaming
+
+document = json.dumps({"request": "GetObservation", "version": "2.0.0",
+                       "observations": [{"identifier": {"value": "a"}, "result": {"value": 12.5, "uom": "C"}},
+                                        {"identifier": {"value": "b"}, "result": {"value": -3, "uom": "C"}},
+                                        {"identifier": {"value": "c"}, "result": 1024},
+                                        {"identifier": {"value": "d"}, "result": "café – ok"}]},
+                      ensure_ascii=False)
+
+
+def pieces(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class Response:
+    # requests.Response with a body read in chunks
+    def __init__(self, body, encoding='utf-8'):
+        self.body = body
+        self.encoding = encoding
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64, len(document)])
+def test_iterArray_matches_json(size):
+    assert list(streaming.iterArray(pieces(document, size))) == json.loads(document)["observations"]
+
+
+def test_numbers_split_between_chunks():
+    assert list(streaming.iterArray(['{"values": [12', '34, 5', '6.7', '5]}'], key='values')) == [1234, 56.75]
+
+
+def test_missing_and_empty_arrays():
+    assert list(streaming.iterArray(pieces('{"observations": []}', 3))) == []
+    assert list(streaming.iterArray(pieces('{"exceptions": [{"code": "x"}]}', 3))) == []
+
+
+def test_truncated_document():
+    with pytest.raises(ValueError):
+        list(streaming.iterArray(pieces(document[:len(document) // 2], 16)))
+
+
+def test_iterObservations_decodes_multibyte_characters():
+    response = Response(document.encode('utf-8'))
+    observations = list(streaming.iterObservations(response, chunk_size=5))
+    assert observations[-1]["result"] == "café – ok"
+    assert response.closed
+
+
+def test_stream_from_stub(loaded):
+    stub, sos = loaded
+    expected = core.getObservationByTime(sos, None, None, None, None, interval)["observations"]
+    streamed = list(core.getObservationByTime(sos, None, None, None, None, interval, stream=True))
+    assert len(streamed) > 0
+    assert streamed == expected
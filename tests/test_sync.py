@@ -0,0 +1,67 @@
+# Incremental synchronisation of observations since a watermark
+
+import datetime
+
+from .context import py4sos
+from py4sos import core, sync
+
+prefix = 'http://www.geosmartcity.nl/test/'
+series = [(prefix + 'procedure/bench_light_0', prefix + 'observableProperty/Luminosity', None),
+          (prefix + 'procedure/bench_light_1', prefix + 'observableProperty/Luminosity', None)]
+
+
+def insert(stub, like, identifier, time):
+    # stores a copy of an observation with another identifier and phenomenon time
+    observation = dict(like, identifier={"value": identifier}, observedProperty=like["observableProperty"],
+                       phenomenonTime=time, resultTime=time)
+    stub.dispatch({"request": "InsertObservation", "service": "SOS", "version": "2.0.0", "offering": like["offering"],
+                   "observation": observation})
+
+
+def ids(results, s):
+    return [core.observationId(o) for o in results[s]]
+
+
+def test_poll_late_and_new_observations(loaded, tmp_path):
+    path = str(tmp_path / 'marks.json')
+    stub, sos = loaded
+    tracker = sync.SeriesSync(sos, series, path)
+    first = tracker.poll()
+    assert [len(first[s]) for s in series] == [2, 2]
+    assert tracker.watermark(series[0]) == core.parseTime('2016-07-01T08:10:07+00:00')
+
+    reads = stub.stats()["requests"]["GetObservation"]
+    assert tracker.poll() == {s: [] for s in series}
+    assert stub.stats()["requests"]["GetObservation"] == reads  # counts did not change
+
+    like = first[series[0]][0]
+    insert(stub, like, 'late', '2016-07-01T08:05:00+00:00')
+    insert(stub, like, 'new', '2016-07-01T08:20:00+00:00')
+    second = tracker.poll()
+    assert ids(second, series[0]) == ['late', 'new']
+    assert second[series[1]] == []
+    assert tracker.watermark(series[0]) == core.parseTime('2016-07-01T08:20:00+00:00')
+
+    restarted = sync.SeriesSync(sos, series, path)
+    assert restarted.watermark(series[0]) == tracker.watermark(series[0])
+    assert restarted.poll() == {s: [] for s in series}
+    restarted.reset([series[1]])
+    assert [len(o) for o in restarted.poll().values()] == [0, 2]
+
+
+def test_no_overlap(loaded, tmp_path):
+    stub, sos = loaded
+    tracker = sync.SeriesSync(sos, series, str(tmp_path / 'marks.json'), overlap=datetime.timedelta(0))
+    like = tracker.poll()[series[0]][0]
+    insert(stub, like, 'late', '2016-07-01T08:05:00+00:00')
+    insert(stub, like, 'new', '2016-07-01T08:20:00+00:00')
+    assert ids(tracker.poll(), series[0]) == ['new']
+
+
+def test_late_observations_outside_the_overlap(loaded, tmp_path):
+    stub, sos = loaded
+    tracker = sync.SeriesSync(sos, series, str(tmp_path / 'marks.json'), overlap=datetime.timedelta(minutes=5))
+    like = tracker.poll()[series[0]][0]
+    insert(stub, like, 'too late', '2016-07-01T08:01:00+00:00')
+    insert(stub, like, 'late', '2016-07-01T08:06:00+00:00')
+    assert ids(tracker.poll(), series[0]) == ['late']
@@ -0,0 +1,42 @@
+# Multi-observation InsertObservation requests
+
+import os
+
+import pytest
+
+from .context import py4sos
+from py4sos import santander, transactional
+
+
+def body(offering, *identifiers):
+    observations = [{"identifier": {"value": i}} for i in identifiers]
+    return {"request": "InsertObservation", "service": "SOS", "version": "2.0.0", "offering": offering,
+            "observation": observations[0] if len(observations) == 1 else observations}
+
+
+def test_combine_observations():
+    combined = transactional.combineObservations([body('o', 'a'), body('o', 'b', 'c'), body('o', 'd')])
+    assert [o["identifier"]["value"] for o in combined["observation"]] == ['a', 'b', 'c', 'd']
+    assert combined["offering"] == 'o'
+    assert transactional.combineObservations([]) is None
+    with pytest.raises(ValueError):
+        transactional.combineObservations([body('o', 'a'), body('other', 'b')])
+
+
+def test_one_request_per_node(tmp_path, monkeypatch):
+    from benchmarks import generators, stubsos
+
+    monkeypatch.chdir(tmp_path)
+    data, hist_path = str(tmp_path / 'data') + os.sep, str(tmp_path / 'hist') + os.sep
+    os.makedirs(hist_path)
+    names = generators.writeSnapshots(data, 'light', 3, 2, seed=0)
+    single = santander.requests_from_file(data, names[0], 'light', str(tmp_path / 'other') + os.sep, hist={})
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        for name in names:
+            collection = santander.requests_from_file(data, name, 'light', hist_path, multi_observation=True)
+            for batch in collection['requests']:
+                kinds = [r['request'] for r in batch.request_list]
+                assert kinds.count('InsertObservation') == 1
+            santander.upload2sos(sos, collection, hist_path)
+        assert stub.stats()["observations"] == 2 * sum(len(b.request_list) - 1 for b in single['requests'])
@@ -0,0 +1,54 @@
+# Splitting of time intervals into windows requested concurrently
+
+import datetime
+
+import pytest
+
+from .context import py4sos, interval
+from py4sos import core
+
+prefix = 'http://www.geosmartcity.nl/test/'
+procedure = prefix + 'procedure/bench_light_0'
+luminosity = prefix + 'observableProperty/Luminosity'
+
+
+def test_fixed_windows():
+    windows = core.timeWindows(None, None, None, None, interval, datetime.timedelta(hours=7))
+    assert len(windows) == 4
+    assert windows[0][0] == interval[0] and windows[-1][1] == interval[1]
+    assert all(a[1] == b[0] for a, b in zip(windows, windows[1:]))  # consecutive
+    assert windows[-1][0] == '2016-07-01T21:00:00+00:00'  # the last window is shorter
+    with pytest.raises(ValueError):
+        core.timeWindows(None, None, None, None, interval[::-1], datetime.timedelta(hours=1))
+    with pytest.raises(ValueError):
+        core.timeWindows(None, None, None, None, interval, 3600)
+
+
+def test_auto_windows_follow_the_data(loaded):
+    stub, sos = loaded
+    windows = core.timeWindows(sos, procedure, luminosity, None, interval, 'auto', max_observations=1)
+    assert windows == [['2016-07-01T08:00:07+00:00', '2016-07-01T08:05:07+00:00'],
+                       ['2016-07-01T08:05:07+00:00', '2016-07-01T08:10:07+00:00']]  # 2 observations in the series
+    assert len(core.timeWindows(sos, None, None, None, interval, 'auto')) == 1
+
+
+def test_auto_windows_without_data(loaded):
+    stub, sos = loaded
+    assert core.timeWindows(sos, prefix + 'procedure/unknown', None, None, interval, 'auto') == []
+    earlier = ['2016-06-01T00:00:00+00:00', '2016-06-02T00:00:00+00:00']
+    assert core.timeWindows(sos, procedure, None, None, earlier, 'auto') == []
+    assert core.getObservationByTime(sos, procedure, None, None, None, earlier, window='auto')["observations"] == []
+
+
+def test_observations_at_window_boundaries_are_returned_once(loaded):
+    stub, sos = loaded
+    start = ['2016-07-01T08:00:07+00:00', '2016-07-01T08:20:07+00:00']
+    expected = core.getObservationByTime(sos, procedure, None, None, None, start)["observations"]
+    sent = stub.stats()["requests"]["GetObservation"]
+    windows = datetime.timedelta(minutes=10)  # the second snapshot is at the end of the first window
+    found = core.getObservationByTime(sos, procedure, None, None, None, start, window=windows, threads=2)
+    assert stub.stats()["requests"]["GetObservation"] - sent == 2
+    assert len(expected) == 6
+    assert [core.observationId(o) for o in found["observations"]] == [core.observationId(o) for o in expected]
+    assert list(core.getObservationByTime(sos, procedure, None, None, None, start, window=windows,
+                                          merge=False)) == found["observations"]
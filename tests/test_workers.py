@@ -0,0 +1,108 @@
+# Node-partitioned ingest workers with a sharded history
+
+import os
+
+import pytest
+
+from .context import py4sos
+from py4sos import ratelimit, santander, sharding, workers
+
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    from benchmarks import generators
+
+    monkeypatch.chdir(tmp_path)
+    data = str(tmp_path / 'data') + os.sep
+    return data, generators.writeSnapshots(data, 'light', 6, 3, seed=0)
+
+
+def history(tmp_path, name):
+    path = str(tmp_path / name) + os.sep
+    os.makedirs(path)
+    return path
+
+
+def singleProcess(data, hist_path):
+    # observation identifiers stored by the single process pipeline
+    from benchmarks import stubsos
+
+    with stubsos.StubSos() as stub:
+        santander.upload_directory2sos(santander.Sos(stub.url), data, 'light', hist_path)
+        return sorted(stub.observations)
+
+
+def test_workers_store_the_same_identifiers(tmp_path, snapshots):
+    from benchmarks import stubsos
+
+    data, names = snapshots
+    expected = singleProcess(data, history(tmp_path, 'single'))
+    hist_path = history(tmp_path, 'sharded')
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        sos.set_rate_limit(transactional=1000)
+        sos.set_circuit_breaker(spool=True)
+        try:
+            summary = workers.ingestDirectory(sos, data, 'light', hist_path, workers=2)
+            assert workers.shardCount(hist_path) == 2
+            again = workers.ingestDirectory(sos, data, 'light', hist_path)  # as many workers as shards
+        finally:
+            sos.set_rate_limit()
+        stored = sorted(stub.observations)
+        stats = stub.stats()
+    assert stats["duplicates"] == 0
+    assert stored == expected
+    assert [s["shard"] for s in summary["shards"]] == [0, 1]
+    assert sum(s["nodes"] for s in summary["shards"]) == stats["sensors"]
+    assert len(again["shards"]) == 2 and all("error" not in s for s in again["shards"])
+    inserted = [c["value"] for c in summary["metrics"]["counters"]
+                if c["name"] == 'py4sos_batch_requests_total' and c["labels"] == {"outcome": 'inserted'}]
+    assert inserted == [len(expected) + stats["sensors"]]  # and InsertSensor
+
+
+def test_single_process_history_is_split(tmp_path, snapshots):
+    from benchmarks import stubsos
+
+    data, names = snapshots
+    expected = singleProcess(data, history(tmp_path, 'single'))
+    hist_path = history(tmp_path, 'sharded')
+    with stubsos.StubSos() as stub:
+        sos = santander.Sos(stub.url)
+        first = data + 'first' + os.sep
+        os.makedirs(first)
+        os.replace(data + names[0], first + names[0])
+        santander.upload_directory2sos(sos, first, 'light', hist_path)
+        workers.ingestDirectory(sos, data, 'light', hist_path, workers=3)
+        stored = sorted(stub.observations)
+        assert stub.stats()["duplicates"] == 0
+    assert stored == expected
+    parts = [santander.history(workers.shardDirectory(hist_path, k, 3)) for k in range(3)]
+    for k, part in enumerate(parts):
+        assert all(sharding.nodeShard(ide, 3) == k for ide in part if ide != 'last upload')
+
+
+def test_shard_layout_can_not_change(tmp_path):
+    hist_path = history(tmp_path, 'hist')
+    os.makedirs(workers.shardDirectory(hist_path, 0, 2))
+    with pytest.raises(ValueError):
+        workers.ingestDirectory(santander.Sos('http://localhost/sos', validate=False), hist_path, 'light', hist_path,
+                                workers=3)
+    os.makedirs(workers.shardDirectory(hist_path, 0, 4))
+    with pytest.raises(ValueError):
+        workers.shardCount(hist_path)
+
+
+def test_client_settings_are_split_among_workers():
+    sos = santander.Sos('http://localhost/test-workers/sos', validate=False)
+    assert workers._clientSettings(sos) == {}
+    try:
+        sos.set_rate_limit(transactional=8, read=20)
+        sos.set_circuit_breaker(error_rate=0.6, window=10, spool=True)
+        settings = workers._clientSettings(sos, 4)
+        assert settings["rate_limit"] == {"transactional": 2.0, "read": 5.0, "burst": None}
+        assert settings["circuit_breaker"] == {"error_rate": 0.6, "window": 10, "min_calls": 10, "reset_timeout": 30,
+                                               "spool": True}
+        sos.set_rate_limit(transactional=8, burst=6)
+        assert workers._clientSettings(sos, 4)["rate_limit"]["burst"] == 1.5
+    finally:
+        ratelimit.setLimit(sos.sosurl)